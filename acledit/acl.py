@@ -2,26 +2,114 @@
 Functions for working with ACLs, decoupled from GUI code
 """
 from getpass import getuser
+import grp
+import os
 import pwd
+import stat
 import posix1e as acl 
 import sys
 from pathlib import Path
-from acledit.acl_set import AclSet, ERROR_TO_STR, AclEntry, ACL_PERMISSION
+from typing import Callable, Iterator, Literal, TypeAlias
+from acledit.acl_set import AclSet, ERROR_TO_STR, AclEntry, ACL_PERMISSION, STR_TO_ACL_TYPE
+from acledit import xattr_acl
+from acledit.templates import CompiledTemplate, ShareTemplate
+from acledit.throttle import Throttle
+from acledit.identity import owner_name
+from acledit.bulk import AclInterner, BulkStats, MemoryBudget, PathResult, WalkEntry, default_budget, walk_tree, access_and_default_fingerprint
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import BaseModel, Field
+import threading
+import time
 
 
+#: The permission bits of each permission that the ancestor checks can need
+_CHECK_PERMISSIONS = {"read": xattr_acl.READ, "execute": xattr_acl.EXECUTE}
+
+def _recipient_ids(user: str) -> tuple[int, set[int]]:
+    """
+    Looks up the user ID of a user, and every group they are a member of
+    """
+    recipient = _share_recipient(user)
+    return recipient.pw_uid, set(os.getgrouplist(user, recipient.pw_gid))
+
+def _user_allowed(path: str, uid: int, gids: set[int], permission: str) -> bool:
+    """
+    Checks whether a user has a permission on a file, the same way as the kernel and `plan_ancestors` do
+    """
+    st = os.stat(path)
+    return xattr_acl.allows(xattr_acl.read_acl(path, st), st.st_uid, st.st_gid, uid, gids, _CHECK_PERMISSIONS[permission])
+
 def can_read_recursive(user: str, path: Path) -> bool:
     """
     Walks through a file and its ancestors, and checks if the user has read access to all of them
     """
+    uid, gids = _recipient_ids(user)
     # The user needs read on the file in question
-    if not AclSet.from_file(str(path)).can_access(user, permission="read"):
+    if not _user_allowed(str(path), uid, gids, "read"):
         return False
     # The user needs execute on the parent directories
     for parent in path.parents:
-        if not AclSet.from_file(str(parent)).can_access(user, permission="execute"):
+        if not _user_allowed(str(parent), uid, gids, "execute"):
             return False
     return True
 
+class AncestorStatus(BaseModel):
+    """
+    Whether a user has the permission they need on one directory in a path
+    """
+    path: str
+    #: The permission the user needs, either "read" for the file itself or "execute" for its ancestors
+    permission: str
+    allowed: bool
+    #: Set if the ACL couldn't be read
+    error: str | None = None
+
+def check_ancestors(user: str, path: Path, workers: int = 8, cancel: threading.Event | None = None) -> Iterator[AncestorStatus]:
+    """
+    Checks the file and all of its ancestors concurrently, yielding each result as soon as it is known.
+    Stops as soon as any of them denies access, so the final result is the one that blocks access.
+    Params:
+        cancel: If this is set, the check stops early
+    """
+    uid, gids = _recipient_ids(user)
+
+    def check(target: Path, permission: str) -> AncestorStatus:
+        try:
+            allowed = _user_allowed(str(target), uid, gids, permission)
+        except OSError as e:
+            return AncestorStatus(path=str(target), permission=permission, allowed=False, error=str(e))
+        return AncestorStatus(path=str(target), permission=permission, allowed=allowed)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(check, path, "read")]
+        futures += [executor.submit(check, parent, "execute") for parent in path.parents]
+        for future in as_completed(futures):
+            status = future.result()
+            yield status
+            if not status.allowed or (cancel is not None and cancel.is_set()):
+                return
+    finally:
+        # Don't wait for the checks that are no longer needed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def audit_tree(path: str, stats: BulkStats | None = None, budget: MemoryBudget | None = None) -> Iterator[AclSet]:
+    """
+    Yields the ACLs of `path` and everything under it.
+    Each distinct ACL is only parsed and name-resolved once.
+    Params:
+        stats: If provided, this is updated as files are visited
+        budget: Limits how many parsed ACLs are remembered. Defaults to the default budget
+    """
+    interner = AclSet.interner(max_size=(budget or default_budget()).distinct_acls)
+    for entry in walk_tree(path):
+        acl_set = AclSet.from_file(entry.target, interner=interner, st=entry.st)
+        acl_set.file_path = entry.path
+        if stats is not None:
+            stats.files += 1
+            stats.distinct_acls = interner.misses
+        yield acl_set
+
 def validate_acl(acl: acl.ACL) -> None:
     """
     If the ACL is invalid, raises an exception explaining the issue
@@ -39,38 +127,165 @@ def validate_acl(acl: acl.ACL) -> None:
     else:
         raise Exception("Unknown ACL error")
 
-def grant_user(file_path: str, user_id: int, permissions: list[ACL_PERMISSION] = [], default: bool = False, recursive: bool = False):
+ACCESS_CHANGE: TypeAlias = Callable[[xattr_acl.RawAcl], xattr_acl.RawAcl | None]
+DEFAULT_CHANGE: TypeAlias = Callable[[xattr_acl.RawAcl, xattr_acl.RawAcl], xattr_acl.RawAcl | None]
+
+def apply_recursive(
+    file_path: str,
+    access_change: ACCESS_CHANGE | None,
+    default_change: DEFAULT_CHANGE | None = None,
+    recursive: bool = False,
+    directories_only: bool = False,
+    throttle: Throttle | None = None,
+    progress: Callable[[BulkStats], None] | None = None,
+    budget: MemoryBudget | None = None,
+) -> BulkStats:
+    """
+    Applies ACL changes to a file, or to a directory and everything under it.
+    Each change is only computed and encoded once for each distinct ACL in the tree,
+    and the resulting bytes are then written to every file that has that ACL.
+    Params:
+        access_change: Function that receives a file's access ACL and returns the new ACL, or None to leave the file unchanged
+        default_change: Function that receives a directory's default and access ACLs and returns the new default ACL, or None to leave it unchanged
+        directories_only: If True, a recursive change only applies to directories, leaving existing files untouched.
+            Combined with a default change, this makes future files inherit the change in time proportional to the number of directories
+        throttle: If provided, every ACL write is rate limited by this
+        progress: If provided, this is periodically called with the statistics so far
+        budget: Limits how many distinct ACLs are remembered. The walk itself only holds one directory listing per level of the tree.
+            Defaults to the default budget
+    """
+    def prepare_access(path: str, st: os.stat_result) -> bytes | None:
+        new_acl = access_change(xattr_acl.read_acl(path, st))
+        return None if new_acl is None else xattr_acl.encode(new_acl)
+
+    def prepare_default(path: str, st: os.stat_result) -> bytes | None:
+        new_acl = default_change(xattr_acl.read_acl(path, st, default=True), xattr_acl.read_acl(path, st))
+        return None if new_acl is None else xattr_acl.encode(new_acl)
+
+    max_size = (budget or default_budget()).distinct_acls
+    access_changes = AclInterner(prepare_access, max_size=max_size) if access_change is not None else None
+    # The default ACL may be derived from both ACLs, so it is keyed by both
+    default_changes = AclInterner(prepare_default, key=access_and_default_fingerprint, max_size=max_size) if default_change is not None else None
+    stats = BulkStats()
+
+    files = walk_tree(file_path, directories_only=directories_only) if recursive else [WalkEntry(file_path, os.stat(file_path), file_path)]
+    def write(data: bytes, target: str, default: bool = False):
+        write_acl_throttled(data, target, default=default, throttle=throttle)
+
+    start = time.monotonic()
+    last_progress = start
+    for entry in files:
+        stats.files += 1
+        changed = False
+        try:
+            # Set access ACL
+            if access_changes is not None:
+                data = access_changes(entry.target, entry.st)
+                if data is not None:
+                    write(data, entry.target)
+                    changed = True
+
+            # Set default ACL
+            if default_changes is not None and stat.S_ISDIR(entry.st.st_mode):
+                data = default_changes(entry.target, entry.st)
+                if data is not None:
+                    write(data, entry.target, default=True)
+                    changed = True
+        except OSError as e:
+            # The target may be a file descriptor link, which means nothing to the user
+            raise OSError(e.errno, e.strerror, entry.path) from e
+
+        if changed:
+            stats.changed += 1
+
+        now = time.monotonic()
+        if progress is not None and now - last_progress > 0.5:
+            last_progress = now
+            stats.elapsed = now - start
+            stats.distinct_acls = sum(interner.misses for interner in [access_changes, default_changes] if interner is not None)
+            progress(stats)
+
+    stats.elapsed = time.monotonic() - start
+    stats.distinct_acls = sum(interner.misses for interner in [access_changes, default_changes] if interner is not None)
+    if progress is not None:
+        progress(stats)
+    return stats
+
+def _perm_bits(permissions: list[ACL_PERMISSION]) -> int:
+    bits = 0
+    for perm in permissions:
+        bits |= perm
+    return bits
+
+def grant_user(file_path: str, user_id: int, permissions: list[ACL_PERMISSION] = [], default: bool = False, recursive: bool = False, **kwargs) -> BulkStats:
     """
     Creates a new ACL entry on the file specified that grants permissions to the user specified.
     Params:
         permissions: A list of permissions such as `posix1e.ACL_WRITE`
+        kwargs: Passed to `apply_recursive`
     """
-    path = Path(file_path)
-    is_dir = path.is_dir()
+    perm = _perm_bits(permissions)
 
-    # Set access ACL
-    facl = acl.ACL(file=file_path)
-    grant_user_entry(facl, user_id, permissions)
-    apply_acl_safely(facl, file_path, type=acl.ACL_TYPE_ACCESS)
-
-    # Set default ACL
-    if default and is_dir:
-        dfacl = acl.ACL(filedef=file_path)
-        
+    def default_change(default_acl: xattr_acl.RawAcl, access_acl: xattr_acl.RawAcl) -> xattr_acl.RawAcl | None:
         # All ACLs seem to require a user owner, group owner and other entry, 
         # so we copy it from the standard ACL
-        if len(list(dfacl)) == 0:
-            for entry in facl:
-                if entry.tag_type in {acl.ACL_USER_OBJ, acl.ACL_GROUP_OBJ, acl.ACL_OTHER}:
-                    dfacl.append(entry)
+        return xattr_acl.grant(xattr_acl.with_base_entries(default_acl, access_acl), acl.ACL_USER, user_id, perm)
 
-        grant_user_entry(dfacl, user_id, permissions)
-        apply_acl_safely(dfacl, file_path, type=acl.ACL_TYPE_DEFAULT)
+    return apply_recursive(
+        file_path,
+        lambda access_acl: xattr_acl.grant(access_acl, acl.ACL_USER, user_id, perm),
+        default_change if default else None,
+        recursive=recursive,
+        **kwargs
+    )
 
-    # Recurse
-    if recursive and is_dir:
-        for child in path.iterdir():
-            grant_user(str(child), user_id, permissions=permissions, default=default, recursive=recursive)
+def revoke_principal(file_path: str, tag_type: int, qualifier: int, recursive: bool = False, **kwargs) -> BulkStats:
+    """
+    Removes the entry for a named user or group from the access and default ACLs.
+    Files where the principal has no entry are left untouched.
+    Params:
+        tag_type: Either `posix1e.ACL_USER` or `posix1e.ACL_GROUP`
+        qualifier: The user or group ID
+        kwargs: Passed to `apply_recursive`
+    """
+    return apply_recursive(
+        file_path,
+        lambda access_acl: xattr_acl.revoke(access_acl, tag_type, qualifier),
+        lambda default_acl, access_acl: xattr_acl.revoke(default_acl, tag_type, qualifier),
+        recursive=recursive,
+        **kwargs
+    )
+
+def modify_principal(file_path: str, tag_type: int, qualifier: int, permissions: list[ACL_PERMISSION], recursive: bool = False, **kwargs) -> BulkStats:
+    """
+    Replaces the permissions of an existing named user or group entry in the access and default ACLs.
+    Files where the principal has no entry are left untouched.
+    Params:
+        tag_type: Either `posix1e.ACL_USER` or `posix1e.ACL_GROUP`
+        qualifier: The user or group ID
+        permissions: The complete list of permissions the principal should have
+        kwargs: Passed to `apply_recursive`
+    """
+    perm = _perm_bits(permissions)
+    return apply_recursive(
+        file_path,
+        lambda access_acl: xattr_acl.modify(access_acl, tag_type, qualifier, perm),
+        lambda default_acl, access_acl: xattr_acl.modify(default_acl, tag_type, qualifier, perm),
+        recursive=recursive,
+        **kwargs
+    )
+
+def principal_id(tag_type: Literal["user", "group"], name: str) -> int:
+    """
+    Looks up the ID of a user or group by name
+    """
+    try:
+        if tag_type == "user":
+            return pwd.getpwnam(name).pw_uid
+        else:
+            return grp.getgrnam(name).gr_gid
+    except KeyError:
+        raise Exception(f"{name} is not a valid {tag_type}!")
 
 def ensure_mask(facl: acl.ACL):
     """
@@ -108,6 +323,29 @@ def get_or_create_entry(facl: acl.ACL, tag_type: int, qualifier: int):
     entry.qualifier = qualifier
     return entry
 
+def write_acl_safely(data: bytes, file: str, default: bool = False):
+    """
+    Try to write an encoded ACL.
+    If it fails, run validation to work out why it might have failed.
+    """
+    try:
+        xattr_acl.write_acl(file, data, default=default)
+    except OSError as e:
+        validate_acl(xattr_acl.to_pylibacl(xattr_acl.decode(data)))
+        raise e
+
+def write_acl_throttled(data: bytes, file: str, default: bool = False, throttle: Throttle | None = None):
+    """
+    Writes an encoded ACL like `write_acl_safely`, waiting for the throttle first and reporting how long the write took
+    """
+    if throttle is None:
+        write_acl_safely(data, file, default=default)
+        return
+    throttle.wait()
+    start = time.monotonic()
+    write_acl_safely(data, file, default=default)
+    throttle.record(time.monotonic() - start)
+
 def apply_acl_safely(facl: acl.ACL, file: str, type: int = acl.ACL_TYPE_ACCESS):
     """
     Try to apply an ACL.
@@ -119,54 +357,339 @@ def apply_acl_safely(facl: acl.ACL, file: str, type: int = acl.ACL_TYPE_ACCESS):
         validate_acl(facl)
         raise e
 
-def execute_share(
-    path: str,
-    share_user: str,
-    editable: bool,
-    recursive: bool,
-    default: bool,
-) -> None:
+def _share_recipient(share_user: str) -> pwd.struct_passwd:
     """
-    High level operation that shares `path` with `share_user`, automatically adjusting parent directory ACLs where necessary
+    Looks up the account of the user being shared with
     """
-    current_path = Path(path)
-    current_user = getuser()
-
     try:
-        recipient_id = pwd.getpwnam(share_user).pw_uid
+        return pwd.getpwnam(share_user)
     except KeyError:
         raise Exception(f"Username {share_user} is not a valid Milton user!")
 
+def _check_shareable(current_path: Path, share_user: str):
+    """
+    Raises an exception if the current user can't share this file with `share_user`
+    """
     if current_path.owner() != getuser():
         raise Exception(f"You do not own this file or directory. The current owner is {current_path.owner()}. Only the owner can share it.")
 
-    acls = AclSet.from_file(path)
+    acls = AclSet.from_file(str(current_path))
     for permission in acls.acls:
         if permission.tag_type == "user" and permission.qualifier == share_user:
             raise Exception(f"There is already some access control configured for {share_user}. Consider opening the Editor.")
 
-    # Grant X access to each parent so that the directory can be listed
-    # We iterate in reverse so that we can fail early
-    for parent in reversed(current_path.parents):
-        if parent.owner() == current_user:
-            entry = get_or_create_entry(
-                facl=acl.ACL(file=str(parent)),
-                tag_type=acl.ACL_USER,
-                qualifier=recipient_id,
-            )
-            entry.permset.execute = True
-        else:
-            parent_acl = AclSet.from_file(str(parent))
-            if not parent_acl.can_access(share_user):
-                raise Exception(f"Share failed because the parent directory {parent} is not owned by you, and cannot be accessed by {share_user}. Please contact {parent.owner()} and request that they share this directory with {share_user}.")
+class AncestorAction(BaseModel):
+    """
+    What sharing needs to change on one ancestor directory so that the recipient can reach the shared files
+    """
+    path: str
+    #: "ok" if the recipient can already traverse the directory, "grant" if they will be given execute access to it,
+    #: or "blocked" if they can't traverse it and the current user can't change that
+    action: Literal["ok", "grant", "blocked"]
+    #: Why the directory is blocked
+    message: str | None = None
+    #: The encoded ACL to write, for "grant"
+    new_acl: bytes | None = Field(default=None, exclude=True)
+
+def plan_ancestors(paths: list[str], share_users: list[str], workers: int = 8) -> dict[str, AncestorAction]:
+    """
+    Works out what every ancestor directory of `paths` needs so that all of `share_users` can traverse it, without changing anything.
+    Each distinct ancestor is only read once, and the ancestors are read concurrently.
+    Returns:
+        The action for each ancestor, shallowest first
+    """
+    recipients = [(share_user, *_recipient_ids(share_user)) for share_user in share_users]
+    current_uid = os.getuid()
+
+    def plan(parent: Path) -> AncestorAction:
+        try:
+            st = os.stat(parent)
+            entries = xattr_acl.read_acl(str(parent), st)
+        except OSError as e:
+            return AncestorAction(path=str(parent), action="blocked", message=f"Share failed because the parent directory {parent} could not be read: {e.strerror}")
+        needed = [
+            (share_user, uid) for share_user, uid, groups in recipients
+            if not xattr_acl.allows(entries, st.st_uid, st.st_gid, uid, groups, xattr_acl.EXECUTE)
+        ]
+        if not needed:
+            return AncestorAction(path=str(parent), action="ok")
+        if st.st_uid != current_uid:
+            names = ", ".join(share_user for share_user, _ in needed)
+            return AncestorAction(path=str(parent), action="blocked", message=f"Share failed because the parent directory {parent} is not owned by you, and cannot be accessed by {names}. Please contact {owner_name(st.st_uid)} and request that they share this directory with {names}.")
+        new_acl = entries
+        for _, uid in needed:
+            new_acl = xattr_acl.grant(new_acl, acl.ACL_USER, uid, xattr_acl.EXECUTE) or new_acl
+        # An existing mask without execute would hide the new entries' execute permission
+        new_acl = xattr_acl.widen_mask(new_acl, xattr_acl.EXECUTE) or new_acl
+        return AncestorAction(path=str(parent), action="grant", new_acl=xattr_acl.encode(new_acl))
+
+    ancestors = sorted({parent for path in paths for parent in Path(path).parents}, key=lambda parent: len(parent.parts))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {str(parent): action for parent, action in zip(ancestors, executor.map(plan, ancestors))}
+
+def _blocked_ancestor(path: str, plan: dict[str, AncestorAction]) -> AncestorAction | None:
+    """
+    Returns the shallowest ancestor of `path` that stops the recipient reaching it, if any
+    """
+    for parent in reversed(Path(path).parents):
+        if plan[str(parent)].action == "blocked":
+            return plan[str(parent)]
+    return None
+
+def apply_ancestor_plan(plan: dict[str, AncestorAction], paths: list[str], workers: int = 8, throttle: Throttle | None = None) -> dict[str, str]:
+    """
+    Writes the ancestor changes needed by `paths`, writing each ancestor exactly once even if it is shared by several paths
+    Returns:
+        The error for each ancestor that couldn't be changed
+    """
+    needed = dict.fromkeys(
+        str(parent)
+        for path in paths
+        for parent in reversed(Path(path).parents)
+        if plan[str(parent)].action == "grant"
+    )
+
+    def write(parent: str) -> str | None:
+        try:
+            write_acl_throttled(plan[parent].new_acl, parent, throttle=throttle)
+        except Exception as e:
+            return f"Share failed because the parent directory {parent} could not be updated: {e}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {parent: error for parent, error in zip(needed, executor.map(write, needed)) if error is not None}
 
+def _share_permissions(editable: bool) -> list[ACL_PERMISSION]:
     perms = [acl.ACL_EXECUTE, acl.ACL_READ]
     if editable:
         perms.append(acl.ACL_WRITE)
-    grant_user(
+    return perms
+
+def execute_share(
+    path: str,
+    share_user: str,
+    editable: bool,
+    recursive: bool,
+    default: bool,
+    directories_only: bool = False,
+    throttle: Throttle | None = None,
+    progress: Callable[[BulkStats], None] | None = None,
+) -> BulkStats:
+    """
+    High level operation that shares `path` with `share_user`, automatically adjusting parent directory ACLs where necessary
+    Params:
+        directories_only: If sharing recursively, only share the directories, and not the files in them
+        throttle: Rate limits the ACL writes
+        progress: Periodically called with the statistics so far
+    """
+    recipient_id = _share_recipient(share_user).pw_uid
+    _check_shareable(Path(path), share_user)
+    # Work out every ancestor change before making any of them, so that a blocked ancestor leaves everything untouched
+    plan = plan_ancestors([path], [share_user])
+    blocked = _blocked_ancestor(path, plan)
+    if blocked is not None:
+        raise Exception(blocked.message)
+    errors = apply_ancestor_plan(plan, [path], throttle=throttle)
+    if errors:
+        raise Exception(next(iter(errors.values())))
+
+    stats = grant_user(
         path,
         recipient_id,
-        permissions=perms,
+        permissions=_share_permissions(editable),
         default=default,
         recursive=recursive,
+        directories_only=directories_only,
+        throttle=throttle,
+        progress=progress,
+    )
+    stats.ancestors_changed = [parent for parent, action in plan.items() if action.action == "grant"]
+    return stats
+
+def execute_batch_share(
+    paths: list[str],
+    share_user: str,
+    editable: bool,
+    recursive: bool,
+    default: bool,
+    directories_only: bool = False,
+    workers: int = 8,
+    throttle: Throttle | None = None,
+    progress: Callable[[str, BulkStats], None] | None = None,
+) -> list[PathResult]:
+    """
+    High level operation that shares several paths with `share_user` at once.
+    The recipient is looked up once, each ancestor directory is processed once even if it is shared by several paths,
+    and then the paths themselves are shared concurrently.
+    A failure for one path doesn't prevent the others from being shared.
+    Params:
+        directories_only: If sharing recursively, only share the directories, and not the files in them
+        throttle: Rate limits the ACL writes of all paths together
+        progress: Periodically called with a path and the statistics so far for that path
+    """
+    recipient_id = _share_recipient(share_user).pw_uid
+
+    def share(path: str) -> BulkStats:
+        return grant_user(
+            path,
+            recipient_id,
+            permissions=_share_permissions(editable),
+            default=default,
+            recursive=recursive,
+            directories_only=directories_only,
+            throttle=throttle,
+            progress=(lambda stats: progress(path, stats)) if progress is not None else None,
+        )
+
+    return _share_paths(paths, [share_user], lambda path: _check_shareable(path, share_user), share, workers=workers, throttle=throttle)
+
+def _share_paths(
+    paths: list[str],
+    share_users: list[str],
+    check: Callable[[Path], None],
+    share: Callable[[str], BulkStats],
+    workers: int = 8,
+    throttle: Throttle | None = None,
+) -> list[PathResult]:
+    """
+    Shares several paths concurrently, after giving `share_users` access through every ancestor directory
+    Params:
+        check: Raises an exception if a path can't be shared
+        share: Changes the ACLs of a path itself
+    """
+    # Read every ancestor of every path once, then only write the ancestors of paths that can actually be shared
+    plan = plan_ancestors(paths, share_users, workers=workers)
+    failures: dict[str, str] = {}
+    for path in paths:
+        try:
+            check(Path(path))
+        except Exception as e:
+            failures[path] = str(e)
+            continue
+        blocked = _blocked_ancestor(path, plan)
+        if blocked is not None:
+            failures[path] = blocked.message
+    ancestor_errors = apply_ancestor_plan(plan, [path for path in paths if path not in failures], workers=workers, throttle=throttle)
+
+    def share_one(path: str) -> PathResult:
+        if path in failures:
+            return PathResult(path=path, success=False, message=failures[path])
+        parents = [str(parent) for parent in reversed(Path(path).parents)]
+        try:
+            for parent in parents:
+                if parent in ancestor_errors:
+                    raise Exception(ancestor_errors[parent])
+            stats = share(path)
+        except Exception as e:
+            return PathResult(path=path, success=False, message=str(e))
+        stats.ancestors_changed = [parent for parent in parents if plan[parent].action == "grant"]
+        return PathResult(path=path, success=True, message="Shared", stats=stats)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(share_one, paths))
+
+def compile_template(template: ShareTemplate) -> CompiledTemplate:
+    """
+    Looks up the principals of a template and builds its entries.
+    This is done for each operation rather than cached, since users and groups can be renamed or recreated with new IDs
+    """
+    entries: dict[tuple[int, int], int] = {}
+    for principal in template.principals:
+        if principal.tag_type == "user":
+            qualifier = _share_recipient(principal.name).pw_uid
+        else:
+            qualifier = principal_id("group", principal.name)
+        entry = (STR_TO_ACL_TYPE[principal.tag_type], qualifier)
+        entries[entry] = entries.get(entry, 0) | _perm_bits(_share_permissions(principal.editable))
+    users = [principal.name for principal in template.principals if principal.tag_type == "user"]
+    return CompiledTemplate(template, entries, users)
+
+def apply_template(file_path: str, template: CompiledTemplate, **kwargs) -> BulkStats:
+    """
+    Grants every principal of a template its permissions on a file, or on a directory and everything under it,
+    according to the template's recursive, default and directories only settings
+    Params:
+        kwargs: Passed to `apply_recursive`
+    """
+    return apply_recursive(
+        file_path,
+        template.merge,
+        template.merge_default if template.template.default else None,
+        recursive=template.template.recursive,
+        directories_only=template.template.directories_only,
+        **kwargs
     )
+
+def execute_template(
+    paths: list[str],
+    template: ShareTemplate,
+    workers: int = 8,
+    throttle: Throttle | None = None,
+    progress: Callable[[str, BulkStats], None] | None = None,
+) -> list[PathResult]:
+    """
+    High level operation that shares several paths using a template.
+    Like `execute_batch_share`, each ancestor directory is processed once, for all of the template's users together.
+    Named groups aren't given access to ancestor directories, since their members may already have it in other ways.
+    Principals that a path is already shared with keep their existing permissions, plus any that the template adds.
+    Params:
+        throttle: Rate limits the ACL writes of all paths together
+        progress: Periodically called with a path and the statistics so far for that path
+    """
+    compiled = compile_template(template)
+
+    def share(path: str) -> BulkStats:
+        return apply_template(
+            path,
+            compiled,
+            throttle=throttle,
+            progress=(lambda stats: progress(path, stats)) if progress is not None else None,
+        )
+
+    return _share_paths(paths, compiled.users, _check_owner, share, workers=workers, throttle=throttle)
+
+def _check_owner(path: Path):
+    if path.owner() != getuser():
+        raise Exception(f"You do not own this file or directory. The current owner is {path.owner()}. Only the owner can change its sharing.")
+
+def execute_revoke(
+    path: str,
+    principal: str,
+    recursive: bool,
+    tag_type: Literal["user", "group"] = "user",
+    throttle: Throttle | None = None,
+    progress: Callable[[BulkStats], None] | None = None,
+) -> BulkStats:
+    """
+    High level operation that stops sharing `path` with a user or group, removing them from both the access and default ACLs
+    """
+    _check_owner(Path(path))
+    stats = revoke_principal(path, STR_TO_ACL_TYPE[tag_type], principal_id(tag_type, principal), recursive=recursive, throttle=throttle, progress=progress)
+    if stats.changed == 0:
+        raise Exception(f"{path} is not shared with {principal}.")
+    return stats
+
+def execute_modify(
+    path: str,
+    principal: str,
+    editable: bool,
+    recursive: bool,
+    tag_type: Literal["user", "group"] = "user",
+    throttle: Throttle | None = None,
+    progress: Callable[[BulkStats], None] | None = None,
+) -> BulkStats:
+    """
+    High level operation that changes the access of a user or group that `path` is already shared with
+    """
+    _check_owner(Path(path))
+    tag, id = STR_TO_ACL_TYPE[tag_type], principal_id(tag_type, principal)
+    stats = modify_principal(path, tag, id, _share_permissions(editable), recursive=recursive, throttle=throttle, progress=progress)
+    if stats.changed == 0:
+        # Nothing changes either if the principal has no entry, or if it already has these permissions
+        st = os.stat(path)
+        acls = [xattr_acl.read_acl(path, st)]
+        if stat.S_ISDIR(st.st_mode):
+            acls.append(xattr_acl.read_acl(path, st, default=True))
+        if not any(xattr_acl.find(entries, tag, id) for entries in acls):
+            raise Exception(f"{path} is not shared with {principal}.")
+    return stats
@@ -0,0 +1,368 @@
+"""
+A persistent index that summarises who has access anywhere under a directory, decoupled from GUI code
+"""
+from collections import Counter
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Literal, NamedTuple
+from acledit.bulk import MemoryBudget, PathStack, acl_fingerprint, default_budget
+import posix1e as acl
+import fcntl
+import grp
+import logging
+import os
+import pwd
+import sqlite3
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Lock file held by the process that runs the indexer
+_indexer_lock = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS principals (
+    dir TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (dir, kind, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fingerprints (
+    dir TEXT NOT NULL,
+    fingerprint BLOB NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (dir, fingerprint)
+) WITHOUT ROWID;
+"""
+
+PRINCIPAL_KIND = Literal["user", "group", "other"]
+
+class AccessSummary(NamedTuple):
+    """
+    Who an ACL grants any access to. The owner and group owner are stored as flags because they depend on the file, not the ACL.
+    """
+    owner: bool
+    group_owner: bool
+    other: bool
+    users: frozenset[int]
+    groups: frozenset[int]
+
+    @staticmethod
+    def from_mode(mode: int) -> "AccessSummary":
+        """
+        Summarises a file that has no extended ACL, based on its permission bits
+        """
+        return AccessSummary(
+            owner=bool(mode & stat.S_IRWXU),
+            group_owner=bool(mode & stat.S_IRWXG),
+            other=bool(mode & stat.S_IRWXO),
+            users=frozenset(),
+            groups=frozenset(),
+        )
+
+    @staticmethod
+    def from_acl(facl: acl.ACL) -> "AccessSummary":
+        """
+        Summarises a true ACL pointer, taking the mask into account
+        """
+        perms: dict[tuple[int, int | None], int] = {}
+        mask = 0b111
+        for entry in facl:
+            bits = entry.permset.read << 2 | entry.permset.write << 1 | entry.permset.execute
+            if entry.tag_type == acl.ACL_MASK:
+                mask = bits
+            else:
+                qualifier = entry.qualifier if entry.tag_type in {acl.ACL_USER, acl.ACL_GROUP} else None
+                perms[entry.tag_type, qualifier] = bits
+        # The mask limits every entry other than the owner and other
+        return AccessSummary(
+            owner=bool(perms.get((acl.ACL_USER_OBJ, None), 0)),
+            group_owner=bool(perms.get((acl.ACL_GROUP_OBJ, None), 0) & mask),
+            other=bool(perms.get((acl.ACL_OTHER, None), 0)),
+            users=frozenset(qualifier for (tag, qualifier), bits in perms.items() if tag == acl.ACL_USER and bits & mask),
+            groups=frozenset(qualifier for (tag, qualifier), bits in perms.items() if tag == acl.ACL_GROUP and bits & mask),
+        )
+
+    def principals(self, st: os.stat_result) -> list[tuple[PRINCIPAL_KIND, int]]:
+        """
+        Lists the principals with any access to a specific file
+        """
+        result: list[tuple[PRINCIPAL_KIND, int]] = []
+        if self.owner:
+            result.append(("user", st.st_uid))
+        if self.group_owner:
+            result.append(("group", st.st_gid))
+        if self.other:
+            result.append(("other", -1))
+        result.extend(("user", uid) for uid in self.users if not (self.owner and uid == st.st_uid))
+        result.extend(("group", gid) for gid in self.groups if not (self.group_owner and gid == st.st_gid))
+        return result
+
+class PrincipalAccess(BaseModel):
+    """
+    A user or group that has access to some files within a subtree
+    """
+    kind: PRINCIPAL_KIND
+    #: User or group name, or None for "other"
+    name: str | None
+    #: Number of files and directories this principal has any access to
+    files: int
+
+class SubtreeSummary(BaseModel):
+    """
+    Summary of the access to everything under a directory, according to the index
+    """
+    path: str
+    #: Total number of indexed files and directories
+    files: int
+    #: Number of distinct access ACLs in use
+    distinct_acls: int
+    principals: list[PrincipalAccess]
+    #: Unix time at which the least recently indexed directory was indexed
+    indexed_at: float | None
+
+class IndexStats(BaseModel):
+    """
+    Statistics about a single indexing pass
+    """
+    directories_indexed: int = 0
+    directories_unchanged: int = 0
+    files: int = 0
+    errors: int = 0
+
+def _subtree_clause(column: str, path: str) -> tuple[str, tuple[str, ...]]:
+    """
+    Returns a WHERE clause that selects `path` and all of its descendants using a range scan on `column`
+    """
+    path = path.rstrip("/")
+    if path == "":
+        return "1", ()
+    # "0" sorts immediately after "/", so this range covers exactly the paths under `path/`
+    return f"({column} = ? OR ({column} >= ? AND {column} < ?))", (path, path + "/", path + "0")
+
+def _principal_name(kind: PRINCIPAL_KIND, id: int) -> str | None:
+    try:
+        if kind == "user":
+            return pwd.getpwuid(id).pw_name
+        elif kind == "group":
+            return grp.getgrgid(id).gr_name
+    except KeyError:
+        # The ID no longer exists in the directory
+        return str(id)
+    return None
+
+class AclIndex:
+    """
+    A SQLite database holding a per-directory summary of the ACLs of every file.
+    Each directory row covers the directory itself and its non-directory children.
+    Directories are only re-read when their modification time changes.
+    """
+    def __init__(self, database: str | Path, budget: MemoryBudget | None = None):
+        """
+        Params:
+            budget: Limits how many pending directories and ACL summaries are kept in memory while indexing.
+                Defaults to the default budget
+        """
+        self.database = Path(database)
+        self.budget = budget if budget is not None else default_budget()
+        #: Access summaries of the ACLs seen so far, keyed by their fingerprint
+        self._summaries: dict[bytes, AccessSummary] = {}
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens a new connection to the database, creating it if necessary
+        """
+        self.database.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.database, timeout=30)
+        # WAL allows the browser to read the index while the indexer is writing to it
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _summarise(self, path: str, st: os.stat_result) -> tuple[bytes, AccessSummary]:
+        fingerprint = acl_fingerprint(path, st)
+        summary = self._summaries.get(fingerprint)
+        if summary is None:
+            if fingerprint.startswith(b"mode:"):
+                summary = AccessSummary.from_mode(st.st_mode)
+            else:
+                summary = AccessSummary.from_acl(acl.ACL(file=path))
+            if len(self._summaries) >= self.budget.distinct_acls:
+                self._summaries.clear()
+            self._summaries[fingerprint] = summary
+        return fingerprint, summary
+
+    def _index_directory(self, connection: sqlite3.Connection, path: str, st: os.stat_result, stats: IndexStats, pending: PathStack) -> None:
+        """
+        Re-reads a single directory and replaces its rows. Its subdirectories are added to `pending`.
+        """
+        principals: Counter[tuple[PRINCIPAL_KIND, int]] = Counter()
+        fingerprints: Counter[bytes] = Counter()
+
+        def add(file_path: str, file_st: os.stat_result):
+            fingerprint, summary = self._summarise(file_path, file_st)
+            fingerprints[fingerprint] += 1
+            principals.update(summary.principals(file_st))
+            stats.files += 1
+
+        add(path, st)
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_symlink():
+                        # Symlinks don't have their own ACLs
+                        continue
+                    elif entry.is_dir():
+                        pending.append(entry.path)
+                    else:
+                        add(entry.path, entry.stat(follow_symlinks=False))
+                except OSError as e:
+                    logger.debug(f"Could not index {entry.path}: {e}")
+                    stats.errors += 1
+
+        with connection:
+            connection.execute("DELETE FROM principals WHERE dir = ?", (path,))
+            connection.execute("DELETE FROM fingerprints WHERE dir = ?", (path,))
+            connection.executemany(
+                "INSERT INTO principals (dir, kind, id, files) VALUES (?, ?, ?, ?)",
+                ((path, kind, id, files) for (kind, id), files in principals.items())
+            )
+            connection.executemany(
+                "INSERT INTO fingerprints (dir, fingerprint, files) VALUES (?, ?, ?)",
+                ((path, fingerprint, files) for fingerprint, files in fingerprints.items())
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO directories (path, parent, mtime_ns, ctime_ns, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (path, str(Path(path).parent), st.st_mtime_ns, st.st_ctime_ns, time.time())
+            )
+            # Drop subdirectories that have since been removed. This checks each one rather than comparing against the listing,
+            # so that no set of every subdirectory has to be held in memory
+            removed = [
+                child for child, in connection.execute("SELECT path FROM directories WHERE parent = ? AND path != ?", (path, path))
+                if not os.path.isdir(child) or os.path.islink(child)
+            ]
+            for child in removed:
+                self._forget(connection, child)
+
+        stats.directories_indexed += 1
+
+    @staticmethod
+    def _forget(connection: sqlite3.Connection, path: str):
+        """
+        Removes a directory and everything under it from the index
+        """
+        for table, column in [("directories", "path"), ("principals", "dir"), ("fingerprints", "dir")]:
+            clause, params = _subtree_clause(column, path)
+            connection.execute(f"DELETE FROM {table} WHERE {clause}", params)
+
+    def update(self, root: str, full: bool = False) -> IndexStats:
+        """
+        Brings the index up to date for everything under `root`.
+        Params:
+            full: If True, re-read every directory even if its modification time is unchanged
+        """
+        stats = IndexStats()
+        connection = self.connect()
+        stack = PathStack([str(Path(root))], memory_limit=self.budget.pending_paths)
+        try:
+            while stack:
+                path = stack.pop()
+                try:
+                    st = os.stat(path, follow_symlinks=False)
+                except FileNotFoundError:
+                    with connection:
+                        self._forget(connection, path)
+                    continue
+                row = connection.execute("SELECT mtime_ns, ctime_ns FROM directories WHERE path = ?", (path,)).fetchone()
+                if not full and row == (st.st_mtime_ns, st.st_ctime_ns):
+                    # Nothing was added or removed, so the subdirectories are the same as last time
+                    stack.extend(child for child, in connection.execute("SELECT path FROM directories WHERE parent = ? AND path != ?", (path, path)))
+                    stats.directories_unchanged += 1
+                    continue
+                try:
+                    self._index_directory(connection, path, st, stats, stack)
+                except OSError as e:
+                    logger.debug(f"Could not index {path}: {e}")
+                    stats.errors += 1
+        finally:
+            stack.close()
+            connection.close()
+        return stats
+
+    def summarise(self, path: str) -> SubtreeSummary:
+        """
+        Summarises who has access to anything under `path`, using only the index
+        """
+        connection = self.connect()
+        try:
+            clause, params = _subtree_clause("dir", path)
+            principals = [
+                PrincipalAccess(kind=kind, name=_principal_name(kind, id), files=files)
+                for kind, id, files in connection.execute(
+                    f"SELECT kind, id, SUM(files) AS total FROM principals WHERE {clause} GROUP BY kind, id ORDER BY total DESC",
+                    params
+                )
+            ]
+            files, distinct_acls = connection.execute(
+                f"SELECT SUM(files), COUNT(DISTINCT fingerprint) FROM fingerprints WHERE {clause}",
+                params
+            ).fetchone()
+            clause, params = _subtree_clause("path", path)
+            indexed_at, = connection.execute(f"SELECT MIN(indexed_at) FROM directories WHERE {clause}", params).fetchone()
+        finally:
+            connection.close()
+        return SubtreeSummary(
+            path=path,
+            files=files or 0,
+            distinct_acls=distinct_acls,
+            principals=principals,
+            indexed_at=indexed_at,
+        )
+
+def start_indexer(database: str | Path, roots: list[str], interval: float, full_rescan_every: int, budget: MemoryBudget | None = None) -> threading.Thread | None:
+    """
+    Starts a daemon thread that periodically updates the index for each root.
+    Only one process per database runs the indexer, so this returns None if another process already holds the lock.
+    Params:
+        budget: Passed to `AclIndex`
+    """
+    global _indexer_lock
+    index = AclIndex(database, budget=budget)
+    index.database.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    lock = open(str(index.database) + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    # The lock is released if the file is garbage collected, so keep a reference to it
+    _indexer_lock = lock
+
+    def _run():
+        passes = 0
+        while True:
+            full = full_rescan_every > 0 and passes % full_rescan_every == full_rescan_every - 1
+            for root in roots:
+                try:
+                    stats = index.update(root, full=full)
+                    logger.info(f"Indexed {root}: {stats}")
+                except Exception:
+                    logger.exception(f"Failed to index {root}")
+            passes += 1
+            time.sleep(interval)
+
+    thread = threading.Thread(target=_run, name="acl-indexer", daemon=True)
+    thread.start()
+    return thread
@@ -4,9 +4,12 @@ Classes for representing ACLs in Python, decoupled from GUI code
 from pathlib import Path
 from pydantic import BaseModel
 from typing import Iterable, TypeAlias, Literal
+from acledit.bulk import AclInterner, access_and_default_fingerprint
 import posix1e as acl 
+import os
 import pwd
 import grp
+import stat
 
 ACL_PERMISSION: TypeAlias = Literal[
     acl.ACL_WRITE,
@@ -134,18 +137,43 @@ class AclSet(BaseModel):
                 yield acl
 
     @staticmethod
-    def from_file(path: str) -> "AclSet":
+    def read_entries(path: str, st: os.stat_result) -> tuple[list[AclEntry], list[AclEntry] | None]:
         """
-        Create an instance of this class from a file path
+        Reads and name-resolves the access and default ACL entries of a file
         """
-        if Path(path).is_dir():
+        if stat.S_ISDIR(st.st_mode):
             default_acls = list(AclEntry.from_acl(acl.ACL(filedef=path)))
         else:
             default_acls = None
+        return list(AclEntry.from_acl(acl.ACL(file=path))), default_acls
+
+    @staticmethod
+    def interner(max_size: int | None = None) -> AclInterner[tuple[list[AclEntry], list[AclEntry] | None]]:
+        """
+        Returns an interner that can be passed to `from_file` so that files with identical ACLs are only parsed once
+        Params:
+            max_size: Passed to `AclInterner`
+        """
+        return AclInterner(AclSet.read_entries, key=access_and_default_fingerprint, max_size=max_size)
+
+    @staticmethod
+    def from_file(path: str, interner: AclInterner[tuple[list[AclEntry], list[AclEntry] | None]] | None = None, st: os.stat_result | None = None) -> "AclSet":
+        """
+        Create an instance of this class from a file path
+        Params:
+            interner: An interner created using `AclSet.interner()`, which is shared between calls for many files
+            st: The result of `os.stat` on the file, if already known
+        """
+        if st is None:
+            st = os.stat(path)
+        if interner is None:
+            acls, default_acls = AclSet.read_entries(path, st)
+        else:
+            acls, default_acls = interner(path, st)
 
         return AclSet(
             file_path=path,
-            acls=list(AclEntry.from_acl(acl.ACL(file=path))),
+            acls=acls,
             default_acls=default_acls
         )
 
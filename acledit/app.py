@@ -1,41 +1,106 @@
-from dash import Dash, html, Input, Output, ALL, dcc, ctx
+from dash import Dash, html, Input, Output, State, ALL, dcc, ctx
 from acledit.components.utils import real_event
-from acledit.config import config
+from acledit.config import get_config
 import dash_bootstrap_components as dbc
-from acledit.components.browser import FileBrowser, FileBrowserFile
+from acledit.components.browser import FileBrowser, FileBrowserFile, prewarm_listings
 from acledit.components.editor import AclEditorModal
 from acledit.components.share import AclShareModal
+from acledit.identity import user_index
+from acledit.acl_index import start_indexer
+from acledit.cache import create_cache
+from acledit import jobs
+from acledit.bulk import MemoryBudget, set_default_budget
+from acledit.profiling import RequestProfiler
+from acledit.static import LOCAL_ASSETS_PATH, ResponseOptimizer, local_assets, serve_local_assets
+
+# Settings that are only read when the app starts
+config = get_config()
+
+if config.static.local_assets is not None:
+    stylesheets = local_assets(config.static.local_assets, config.url_prefix)
+else:
+    stylesheets = [dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME]
 
 app = Dash(
     __name__,
     requests_pathname_prefix=config.url_prefix,
-    external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME],
+    external_stylesheets=stylesheets,
 )
 
-app.layout = dbc.Container(
-    [
-        dbc.Row(
-            [
-                dbc.Col(
-                    sm=12,
-                    children=[
-                        html.H1(
-                            children="Access Control", style={"textAlign": "center"}
-                        ),
-                        FileBrowser(id="file-browser")
-                    ],
-                )
-            ],
-            className="justify-content-center",
-        ),
-        # The path of the file we're currently editing ACLs for
-        dcc.Store(id="edit_file", data=None),
-        dcc.Store(id="current_acl", data=None),
-        AclEditorModal(id="acl_editor"),
-        AclShareModal(id="acl_share"),
+if config.static.local_assets is not None:
+    serve_local_assets(app.server, config.static.local_assets, app.config.routes_pathname_prefix)
+
+if config.profiling is not None:
+    RequestProfiler(
+        directory=config.profiling.directory,
+        token=config.profiling.token,
+        cookie_seconds=config.profiling.cookie_seconds,
+        keep=config.profiling.keep,
+    ).install(app.server)
+
+# Registered after the profiler, so that it runs first and profiles include the time spent compressing
+ResponseOptimizer(
+    static_paths=[
+        f"{app.config.routes_pathname_prefix}{path}"
+        for path in ["_dash-component-suites/", "_favicon.ico", f"{app.config.assets_url_path}/", f"{LOCAL_ASSETS_PATH}/"]
     ],
-    className="justify-content-center",
-)
+    min_size=config.static.compress_min_size,
+    max_age=config.static.max_age,
+    compress=config.static.compress,
+).install(app.server)
+
+if config.memory_budget is not None:
+    set_default_budget(MemoryBudget.from_megabytes(config.memory_budget))
+
+if config.shared_cache is not None:
+    # Let worker processes share one snapshot of the user directory
+    user_index.snapshot_cache = create_cache("users", ttl=user_index.max_age, max_size=1, database=config.shared_cache)
+    # Let progress polls reach any worker, not just the one running the operation
+    jobs.job_store = create_cache("jobs", ttl=jobs.JOB_EXPIRY, max_size=1024, database=config.shared_cache)
+
+# Build the username suggestion index in the background so that it is ready by the time someone shares
+user_index.refresh_async()
+
+if config.index is not None:
+    start_indexer(
+        database=config.index.database,
+        roots=[str(root) for root in config.index.roots],
+        interval=config.index.interval,
+        full_rescan_every=config.index.full_rescan_every,
+    )
+
+if config.prewarm_ttl is not None:
+    # Warm the directories that everyone opens first, without delaying startup
+    prewarm_listings([str(config.start_dir), *map(str, config.shortcuts.values())], ttl=config.prewarm_ttl)
+
+def serve_layout() -> dbc.Container:
+    # The layout is rebuilt on each page load, so that edits to the shortcuts and hints in the config take effect without a restart
+    return dbc.Container(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        sm=12,
+                        children=[
+                            html.H1(
+                                children="Access Control", style={"textAlign": "center"}
+                            ),
+                            FileBrowser(id="file-browser")
+                        ],
+                    )
+                ],
+                className="justify-content-center",
+            ),
+            # The path of the file we're currently editing ACLs for
+            dcc.Store(id="edit_file", data=None),
+            dcc.Store(id="current_acl", data=None),
+            AclEditorModal(id="acl_editor"),
+            AclShareModal(id="acl_share"),
+        ],
+        className="justify-content-center",
+    )
+
+app.layout = serve_layout
 
 # The edit button should trigger the ACL editor modal
 @app.callback(
@@ -60,3 +125,16 @@ def share_file(n_clicks: list[int]):
         return None
 
     return ctx.triggered_id["filename"]
+
+# The share selected button should trigger the ACL share modal for all selected files
+@app.callback(
+    Output(AclShareModal.current_file("acl_share"), "data", allow_duplicate=True),
+    Input(FileBrowser.share_selected("file-browser"), "n_clicks"),
+    State(FileBrowser.selection("file-browser"), "data"),
+    prevent_initial_call=True
+)
+def share_selected(n_clicks: int | None, selection: list[str]):
+    if not n_clicks or not selection:
+        return None
+
+    return selection
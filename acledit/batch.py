@@ -0,0 +1,84 @@
+"""
+Runs many share, revoke and modify operations at once, for scripting. This doesn't depend on Dash or the app config
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
+from typing import Callable, Iterable, Iterator, Literal
+from pydantic import BaseModel
+from acledit.acl import execute_batch_share, execute_modify, execute_revoke
+from acledit.bulk import BulkStats, PathResult
+from acledit.throttle import Throttle
+
+class BatchJob(BaseModel):
+    """
+    A single operation on a single path, as read from one line of a JSON Lines batch file
+    """
+    op: Literal["share", "revoke", "modify"]
+    path: str
+    #: The user or group to share with, stop sharing with, or change the access of
+    user: str
+    #: Whether the user can write to the file, for share and modify
+    editable: bool = False
+    recursive: bool = False
+    #: Whether new files should inherit the share, for share
+    default: bool = False
+    #: Whether a recursive share only changes directories, leaving existing files untouched, for share
+    directories_only: bool = False
+    #: Whether `user` is a user or a group, for revoke and modify
+    tag_type: Literal["user", "group"] = "user"
+
+class BatchResult(PathResult):
+    """
+    The outcome of a `BatchJob`
+    """
+    op: str
+    user: str
+
+def _share_options(job: BatchJob) -> tuple:
+    return job.user, job.editable, job.recursive, job.default, job.directories_only
+
+def run_batch(
+    jobs: Iterable[BatchJob],
+    workers: int = 8,
+    throttle: Throttle | None = None,
+    progress: Callable[[str, BulkStats], None] | None = None,
+) -> Iterator[BatchResult]:
+    """
+    Runs several jobs concurrently, yielding each result as soon as it finishes.
+    Shares with the same options are run together using `execute_batch_share`, so each ancestor directory is only processed once.
+    A failure for one job doesn't prevent the others from running.
+    Params:
+        throttle: Rate limits the ACL writes of all jobs together
+        progress: Periodically called with a path and the statistics so far for that path
+    """
+    jobs = list(jobs)
+    shares = sorted((job for job in jobs if job.op == "share"), key=_share_options)
+    others = [job for job in jobs if job.op != "share"]
+
+    def share_group(user: str, editable: bool, recursive: bool, default: bool, directories_only: bool, paths: list[str]) -> list[BatchResult]:
+        try:
+            results = execute_batch_share(paths, user, editable, recursive, default, directories_only=directories_only, workers=workers, throttle=throttle, progress=progress)
+        except Exception as e:
+            # For example, the recipient doesn't exist, which fails every path
+            return [BatchResult(op="share", user=user, path=path, success=False, message=str(e)) for path in paths]
+        return [BatchResult(op="share", user=user, **result.model_dump()) for result in results]
+
+    def run_one(job: BatchJob) -> list[BatchResult]:
+        report = (lambda stats: progress(job.path, stats)) if progress is not None else None
+        try:
+            if job.op == "revoke":
+                stats = execute_revoke(job.path, job.user, job.recursive, tag_type=job.tag_type, throttle=throttle, progress=report)
+            else:
+                stats = execute_modify(job.path, job.user, job.editable, job.recursive, tag_type=job.tag_type, throttle=throttle, progress=report)
+        except Exception as e:
+            return [BatchResult(op=job.op, user=job.user, path=job.path, success=False, message=str(e))]
+        return [BatchResult(op=job.op, user=job.user, path=job.path, success=True, message="Done", stats=stats)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(share_group, *options, [job.path for job in group])
+            for options, group in groupby(shares, key=_share_options)
+        ]
+        futures += [executor.submit(run_one, job) for job in others]
+        for future in as_completed(futures):
+            yield from future.result()
@@ -0,0 +1,326 @@
+"""
+Building blocks for operations over whole directory trees, decoupled from GUI code
+"""
+from pydantic import BaseModel, computed_field
+from typing import Callable, Generic, Hashable, Iterable, Iterator, NamedTuple, TypeVar
+from acledit.xattr_acl import ACCESS_XATTR, DEFAULT_XATTR
+import posix1e as acl
+import errno
+import os
+import stat
+import tempfile
+
+T = TypeVar("T")
+
+def acl_fingerprint(path: str, st: os.stat_result, default: bool = False) -> bytes:
+    """
+    Returns a key that is identical for any two files that have identical ACLs, without parsing the ACL.
+    This is the raw ACL xattr where available, and otherwise the ACL text.
+    Files without an ACL xattr are keyed by their permission bits, which is what their ACL is derived from.
+    Params:
+        st: The result of `os.stat` for the file
+        default: If True, fingerprint the default ACL instead of the access ACL
+    """
+    try:
+        return os.getxattr(path, DEFAULT_XATTR if default else ACCESS_XATTR)
+    except OSError as e:
+        if e.errno == errno.ENODATA:
+            # An empty default ACL doesn't depend on the mode
+            return b"" if default else b"mode:%o" % stat.S_IMODE(st.st_mode)
+        elif e.errno not in {errno.ENOTSUP, errno.EOPNOTSUPP}:
+            raise
+    # The filesystem doesn't expose ACLs as xattrs, so use the slower text form
+    if default:
+        return acl.ACL(filedef=path).to_any_text()
+    return acl.ACL(file=path).to_any_text()
+
+def access_and_default_fingerprint(path: str, st: os.stat_result) -> tuple[bytes, bytes | None]:
+    """
+    Fingerprints both ACLs of a directory, or only the access ACL of a file
+    """
+    if stat.S_ISDIR(st.st_mode):
+        return acl_fingerprint(path, st), acl_fingerprint(path, st, default=True)
+    return acl_fingerprint(path, st), None
+
+class MemoryBudget(NamedTuple):
+    """
+    Limits on what tree operations keep in memory, so that their peak memory doesn't grow with the size or width of the tree.
+    Walks only hold one directory listing per level of the tree, so these cover everything else
+    """
+    #: Maximum number of paths waiting to be visited that are kept in memory. The rest are spilled to a temporary file
+    pending_paths: int = 100_000
+    #: Maximum number of distinct ACLs whose processed form is remembered
+    distinct_acls: int = 4096
+
+    @staticmethod
+    def from_megabytes(megabytes: float) -> "MemoryBudget":
+        """
+        Splits a budget evenly between pending paths and remembered ACLs, using a rough size for each
+        """
+        half = megabytes * 1024 * 1024 / 2
+        # A path string and its list slot take roughly 200 bytes, and a processed ACL roughly 2 KB
+        return MemoryBudget(pending_paths=max(1024, int(half / 200)), distinct_acls=max(64, int(half / 2048)))
+
+_default_budget = MemoryBudget()
+
+def default_budget() -> MemoryBudget:
+    """
+    The budget used by tree operations that aren't given one
+    """
+    return _default_budget
+
+def set_default_budget(budget: MemoryBudget) -> None:
+    """
+    Sets the budget used by tree operations that aren't given one, for example from the app config at startup
+    """
+    global _default_budget
+    _default_budget = budget
+
+class PathStack:
+    """
+    A last in, first out stack of paths that keeps at most `memory_limit` of them in memory.
+    When it grows past that, the oldest half is spilled to a temporary file in one chunk, and read back once everything above it has been popped.
+    """
+    def __init__(self, paths: Iterable[str] = (), memory_limit: int | None = None):
+        """
+        Params:
+            memory_limit: Defaults to the `pending_paths` of the default budget
+        """
+        self.memory_limit = max(2, memory_limit if memory_limit is not None else default_budget().pending_paths)
+        self._paths: list[str] = []
+        #: The file offset at which each spilled chunk starts, oldest first
+        self._chunks: list[int] = []
+        self._file = None
+        self.extend(paths)
+
+    def __bool__(self) -> bool:
+        return bool(self._paths or self._chunks)
+
+    def append(self, path: str) -> None:
+        self._paths.append(path)
+        if len(self._paths) > self.memory_limit:
+            self._spill()
+
+    def extend(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            self.append(path)
+
+    def pop(self) -> str:
+        if not self._paths and self._chunks:
+            start = self._chunks.pop()
+            self._file.seek(start)
+            data = self._file.read()
+            self._file.truncate(start)
+            self._paths = [os.fsdecode(path) for path in data.split(b"\0")]
+        return self._paths.pop()
+
+    def _spill(self) -> None:
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        half = len(self._paths) // 2
+        # Paths can't contain null bytes, so they make a safe separator
+        self._chunks.append(self._file.seek(0, os.SEEK_END))
+        self._file.write(b"\0".join(os.fsencode(path) for path in self._paths[:half]))
+        del self._paths[:half]
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class AclInterner(Generic[T]):
+    """
+    Memoises a function of a file's ACL, so that it runs once per distinct ACL rather than once per file.
+    In most trees, nearly all files share one of a handful of ACLs.
+    """
+    def __init__(
+        self,
+        compute: Callable[[str, os.stat_result], T],
+        key: Callable[[str, os.stat_result], Hashable] = acl_fingerprint,
+        max_size: int | None = None
+    ):
+        """
+        Params:
+            compute: Function that reads and processes the ACL of a file. It is only called for the first file with each fingerprint
+            key: Function that fingerprints a file's ACL
+            max_size: Maximum number of distinct ACLs to remember. Defaults to the `distinct_acls` of the default budget
+        """
+        self.compute = compute
+        self.key = key
+        self.max_size = max_size if max_size is not None else default_budget().distinct_acls
+        self.lookups = 0
+        self.misses = 0
+        self._results: dict[Hashable, T] = {}
+
+    def __call__(self, path: str, st: os.stat_result) -> T:
+        self.lookups += 1
+        key = self.key(path, st)
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+        self.misses += 1
+        result = self.compute(path, st)
+        if len(self._results) >= self.max_size:
+            # Trees with this many distinct ACLs don't benefit from interning anyway
+            self._results.clear()
+        self._results[key] = result
+        return result
+
+class BulkStats(BaseModel):
+    """
+    Statistics about an operation applied to many files
+    """
+    #: Number of files and directories visited
+    files: int = 0
+    #: Number of files and directories whose ACL was rewritten
+    changed: int = 0
+    #: Number of distinct ACLs that had to be parsed and processed
+    distinct_acls: int = 0
+    #: Number of seconds the operation has taken so far
+    elapsed: float = 0
+    #: Parent directories whose ACL was changed so that the recipient can reach the shared files
+    ancestors_changed: list[str] = []
+
+    @computed_field
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Number of files processed per distinct ACL
+        """
+        return self.files / self.distinct_acls if self.distinct_acls else 0.0
+
+    @computed_field
+    @property
+    def files_per_second(self) -> float:
+        """
+        Throughput of the operation
+        """
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+class PathResult(BaseModel):
+    """
+    The outcome of an operation on one of several paths
+    """
+    path: str
+    success: bool
+    #: Description of the outcome, or the error message
+    message: str
+    stats: BulkStats | None = None
+
+class WalkEntry(NamedTuple):
+    """
+    A file or directory found while walking a tree
+    """
+    #: The path of the file, for display purposes
+    path: str
+    st: os.stat_result
+    #: The path that should be used for ACL operations on the file.
+    #: When walking by file descriptor, this is a /proc/self/fd link that the kernel resolves without walking the path.
+    #: It is only valid until the walk continues.
+    target: str
+
+#: Directory through which open file descriptors can be used as paths
+PROC_FD = "/proc/self/fd"
+#: True if trees can be walked using file descriptors
+FD_WALK_SUPPORTED = hasattr(os, "O_PATH") and os.path.isdir(PROC_FD)
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC
+
+def walk_tree(root: str, fd_relative: bool = FD_WALK_SUPPORTED, directories_only: bool = False) -> Iterator[WalkEntry]:
+    """
+    Yields `root` and everything under it, depth first, with each directory yielded before its contents.
+    Symlinks are neither followed nor yielded, since they can't have ACLs of their own.
+    Params:
+        fd_relative: If True, walk using directory file descriptors rather than paths.
+            This avoids the kernel re-resolving every component of every path in deep trees,
+            and means that swapping a directory for a symlink mid-walk can't redirect the walk elsewhere.
+        directories_only: If True, only yield `root` and the directories under it.
+            Files are skipped using the file type in the directory listing, without a stat call,
+            so the walk takes time proportional to the number of directories.
+    """
+    if fd_relative:
+        yield from _walk_fds(root, directories_only)
+    else:
+        yield from _walk_paths(root, directories_only)
+
+def _walk_paths(root: str, directories_only: bool = False) -> Iterator[WalkEntry]:
+    root_st = os.stat(root)
+    yield WalkEntry(root, root_st, root)
+    if not stat.S_ISDIR(root_st.st_mode):
+        return
+    # One open listing per level of the tree, like _walk_fds, rather than a list of every pending directory,
+    # which would grow with the width of the tree
+    stack: list[Iterator[os.DirEntry]] = [os.scandir(root)]
+    try:
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop().close()
+                continue
+            if entry.is_symlink():
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if directories_only and not is_dir:
+                continue
+            yield WalkEntry(entry.path, entry.stat(follow_symlinks=False), entry.path)
+            if is_dir:
+                stack.append(os.scandir(entry.path))
+    finally:
+        for it in stack:
+            it.close()
+
+def _fd_path(fd: int) -> str:
+    return f"{PROC_FD}/{fd}"
+
+def _walk_fds(root: str, directories_only: bool = False) -> Iterator[WalkEntry]:
+    try:
+        root_fd = os.open(root, _DIR_FLAGS)
+    except NotADirectoryError:
+        # A single file
+        root_fd = os.open(root, os.O_PATH | os.O_CLOEXEC)
+        try:
+            yield WalkEntry(root, os.stat(root_fd), _fd_path(root_fd))
+        finally:
+            os.close(root_fd)
+        return
+
+    # One open directory, and its listing, per level of the tree
+    stack: list[tuple[str, int, Iterator[os.DirEntry]]] = []
+    try:
+        stack.append((root, root_fd, os.scandir(root_fd)))
+        yield WalkEntry(root, os.stat(root_fd), _fd_path(root_fd))
+        while stack:
+            dir_path, dir_fd, it = stack[-1]
+            entry = next(it, None)
+            if entry is None:
+                it.close()
+                os.close(dir_fd)
+                stack.pop()
+                continue
+            if entry.is_symlink():
+                continue
+
+            child_path = os.path.join(dir_path, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                # O_NOFOLLOW ensures that a directory swapped for a symlink isn't followed
+                child_fd = os.open(entry.name, _DIR_FLAGS | os.O_NOFOLLOW, dir_fd=dir_fd)
+                try:
+                    child_it = os.scandir(child_fd)
+                except OSError:
+                    os.close(child_fd)
+                    raise
+                stack.append((child_path, child_fd, child_it))
+                yield WalkEntry(child_path, os.stat(child_fd), _fd_path(child_fd))
+            elif not directories_only:
+                child_fd = os.open(entry.name, os.O_PATH | os.O_NOFOLLOW | os.O_CLOEXEC, dir_fd=dir_fd)
+                try:
+                    child_st = os.stat(child_fd)
+                    # The file may have been swapped for a symlink since it was listed
+                    if not stat.S_ISLNK(child_st.st_mode):
+                        yield WalkEntry(child_path, child_st, _fd_path(child_fd))
+                finally:
+                    os.close(child_fd)
+    finally:
+        for _, dir_fd, it in stack:
+            it.close()
+            os.close(dir_fd)
@@ -0,0 +1,266 @@
+"""
+Short-lived caches for the results of expensive filesystem reads, decoupled from GUI code
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Generic, TypeVar
+import logging
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+V = TypeVar("V")
+
+class _Missing:
+    """
+    Sentinel type for a cache miss, since None can be a valid cached value
+    """
+
+MISSING = _Missing()
+
+def make_private_directory(path: Path) -> None:
+    """
+    Creates a directory that only this user can access, or checks that an existing directory is one.
+    A directory in /tmp could have been created by another user, who could then plant a file in it
+    Raises:
+        PermissionError: If the directory is a symlink, belongs to another user, or has any group or other permissions
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by this user, that no other user can access")
+
+class Cache(ABC, Generic[V]):
+    """
+    Base class for caches that map string keys to values, which expire after `ttl` seconds.
+    Concurrent `get_or_compute` calls for the same key within one process share a single computation,
+    so a burst of identical requests only does the work once.
+    """
+    def __init__(self, ttl: float):
+        """
+        Params:
+            ttl: Number of seconds for which a value is reused
+        """
+        self.ttl = ttl
+        #: Number of values returned from the cache
+        self.hits = 0
+        #: Number of values that had to be computed
+        self.misses = 0
+        #: Number of requests that waited for another request's computation instead of starting their own
+        self.coalesced = 0
+        self._inflight: dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> V | _Missing:
+        """
+        Returns the cached value, or `MISSING` if there is no unexpired value
+        """
+
+    @abstractmethod
+    def set(self, key: str, value: V, ttl: float | None = None) -> None:
+        """
+        Caches a value
+        Params:
+            ttl: Number of seconds for which this value is reused, if different to the cache's `ttl`
+        """
+
+    @abstractmethod
+    def invalidate(self, key: str | None = None) -> None:
+        """
+        Forgets the value for `key`, or every value if `key` is None
+        """
+
+    def get_or_compute(self, key: str, compute: Callable[[], V], ttl: float | None = None) -> V:
+        """
+        Returns the cached value for `key`, calling `compute` to produce it if necessary.
+        Exceptions raised by `compute` are passed to every waiting caller, and are not cached.
+        Params:
+            ttl: Number of seconds for which a newly computed value is reused, if different to the cache's `ttl`
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                # Another request may have finished computing this between the check above and taking the lock
+                value = self.get(key)
+                if value is not MISSING:
+                    self.hits += 1
+                    return value
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            self.coalesced += 1
+            return future.result()
+
+        self.misses += 1
+        try:
+            value = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.set(key, value, ttl)
+            future.set_result(value)
+            return value
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+class MemoryCache(Cache[V]):
+    """
+    A least recently used cache that lives in the memory of this process
+    """
+    def __init__(self, ttl: float, max_size: int = 256):
+        """
+        Params:
+            ttl: Number of seconds for which a value is reused
+            max_size: Maximum number of values to keep
+        """
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._values: OrderedDict[str, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> V | _Missing:
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return MISSING
+            expires, value = item
+            if expires < time.monotonic():
+                del self._values[key]
+                return MISSING
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: V, ttl: float | None = None) -> None:
+        with self._lock:
+            self._values[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def invalidate(self, key: str | None = None) -> None:
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+class SqliteCache(Cache[V]):
+    """
+    A least recently used cache stored in a SQLite database on local disk, so that it is shared by every worker process
+    that uses the same database. Values are pickled, so they must be picklable.
+    Since unpickling can run code, the database's directory must only be accessible by this user
+    """
+    def __init__(self, database: Path, name: str, ttl: float, max_size: int = 256):
+        """
+        Params:
+            database: Path to the database file. This should be on a local disk, in a directory that only the user running the app can access
+            name: Name of the table used for this cache, so that several caches can share one database
+            ttl: Number of seconds for which a value is reused
+            max_size: Maximum number of values to keep. The cache is trimmed every few writes, so it can briefly exceed this
+        """
+        super().__init__(ttl)
+        if not name.isidentifier():
+            raise ValueError(f"Invalid cache name {name!r}")
+        self.database = database
+        self.name = name
+        self.max_size = max_size
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns this thread's connection to the database, opening it if necessary
+        Raises:
+            PermissionError: If the database's directory could be written to by another user
+        """
+        connection: sqlite3.Connection | None = getattr(self._local, "connection", None)
+        if connection is None:
+            make_private_directory(self.database.parent)
+            connection = sqlite3.connect(self.database, timeout=5, isolation_level=None)
+            # WAL lets workers read the cache while another worker is writing to it
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.name} (key TEXT PRIMARY KEY, expires REAL NOT NULL, used REAL NOT NULL, value BLOB NOT NULL)")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_used ON {self.name} (used)")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> V | _Missing:
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(f"SELECT value FROM {self.name} WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if row is None:
+                return MISSING
+            # Only record the use if it changes the order noticeably, to avoid a write on every read
+            connection.execute(f"UPDATE {self.name} SET used = ? WHERE key = ? AND used < ?", (now, key, now - 1))
+            return pickle.loads(row[0])
+        except (sqlite3.Error, OSError):
+            # The cache is only an optimisation, so a locked or corrupt database shouldn't break the request
+            logger.exception(f"Failed to read from the {self.name} cache")
+            return MISSING
+
+    def set(self, key: str, value: V, ttl: float | None = None) -> None:
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, expires, used, value) VALUES (?, ?, ?, ?)",
+                (key, now + (self.ttl if ttl is None else ttl), now, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)),
+            )
+            self._writes += 1
+            # Trimming needs a scan of the table, so only do it occasionally
+            if self._writes % 32 == 0:
+                self._trim(connection, now)
+        except (sqlite3.Error, OSError):
+            logger.exception(f"Failed to write to the {self.name} cache")
+
+    def _trim(self, connection: sqlite3.Connection, now: float) -> None:
+        """
+        Deletes expired values, and then the least recently used values until the cache fits in `max_size`
+        """
+        connection.execute(f"DELETE FROM {self.name} WHERE expires <= ?", (now,))
+        connection.execute(
+            f"DELETE FROM {self.name} WHERE key IN (SELECT key FROM {self.name} ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+
+    def invalidate(self, key: str | None = None) -> None:
+        try:
+            if key is None:
+                self._connection().execute(f"DELETE FROM {self.name}")
+            else:
+                self._connection().execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+        except (sqlite3.Error, OSError):
+            logger.exception(f"Failed to invalidate the {self.name} cache")
+
+def create_cache(name: str, ttl: float, max_size: int = 256, database: Path | None = None) -> Cache:
+    """
+    Creates a cache in this process's memory, or in a database shared with other processes if `database` is provided.
+    If the database's directory isn't private to this user, the cache is kept in memory instead
+    Params:
+        name: Identifies the cache within the shared database
+    """
+    if database is not None:
+        try:
+            make_private_directory(database.parent)
+            return SqliteCache(database=database, name=name, ttl=ttl, max_size=max_size)
+        except OSError as e:
+            logger.error(f"The {name} cache is only kept in this process: {e}")
+    return MemoryCache(ttl=ttl, max_size=max_size)
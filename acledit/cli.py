@@ -0,0 +1,186 @@
+"""
+Command line interface for sharing files without the web app. This doesn't depend on Dash,
+and only reads the app config for the templates used by the template command.
+
+Each command prints one JSON object per line to stdout, and progress to stderr.
+
+Examples:
+    acledit share --user alice --recursive /projects/data
+    acledit revoke --user bob /projects/data/report.pdf
+    acledit status --user alice /projects/data
+    acledit audit /projects/data > backup.jsonl
+    acledit restore backup.jsonl
+    acledit batch jobs.jsonl
+    acledit template --config config.json lab-members /projects/data
+"""
+from argparse import ArgumentParser, FileType, Namespace
+from pathlib import Path
+from typing import Iterable, TextIO
+from pydantic import BaseModel, ValidationError
+from acledit.acl import audit_tree, check_ancestors, execute_template
+from acledit.acl_set import AclSet
+from acledit.batch import BatchJob, BatchResult, run_batch
+from acledit.bulk import BulkStats, MemoryBudget, set_default_budget
+from acledit.config import config_path
+from acledit.templates import load_templates
+from acledit.throttle import Throttle
+import sys
+
+def _emit(model: BaseModel):
+    print(model.model_dump_json(), flush=True)
+
+def _progress(path: str, stats: BulkStats):
+    print(f"{path}: {stats.files} files checked, {stats.changed} updated ({stats.files_per_second:.0f} files/s)", file=sys.stderr, flush=True)
+
+def _read_jobs(lines: Iterable[str], source: str) -> list[BatchJob]:
+    jobs = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            jobs.append(BatchJob.model_validate_json(line))
+        except ValidationError as e:
+            raise SystemExit(f"{source}, line {number}: {e}")
+    return jobs
+
+def _run(jobs: list[BatchJob], args: Namespace) -> int:
+    throttle = Throttle(user_rate=args.rate) if args.rate is not None else None
+    failures = 0
+    result: BatchResult
+    for result in run_batch(jobs, workers=args.workers, throttle=throttle, progress=_progress if args.progress else None):
+        _emit(result)
+        failures += not result.success
+    print(f"{len(jobs) - failures} of {len(jobs)} succeeded", file=sys.stderr)
+    return 1 if failures else 0
+
+def share(args: Namespace) -> int:
+    jobs = [
+        BatchJob(op="share", path=path, user=args.user, editable=args.edit, recursive=args.recursive, default=args.default, directories_only=args.directories_only)
+        for path in args.paths
+    ]
+    return _run(jobs, args)
+
+def revoke(args: Namespace) -> int:
+    jobs = [
+        BatchJob(op="revoke", path=path, user=args.user, recursive=args.recursive, tag_type="group" if args.group else "user")
+        for path in args.paths
+    ]
+    return _run(jobs, args)
+
+def batch(args: Namespace) -> int:
+    file: TextIO = args.file
+    return _run(_read_jobs(file, file.name), args)
+
+def template(args: Namespace) -> int:
+    templates = load_templates(config_path(args.config))
+    if args.name not in templates:
+        raise SystemExit(f"Unknown template {args.name}. The templates are: {', '.join(templates) or 'none'}")
+    throttle = Throttle(user_rate=args.rate) if args.rate is not None else None
+    failures = 0
+    for result in execute_template(args.paths, templates[args.name], workers=args.workers, throttle=throttle, progress=_progress if args.progress else None):
+        _emit(result)
+        failures += not result.success
+    print(f"{len(args.paths) - failures} of {len(args.paths)} succeeded", file=sys.stderr)
+    return 1 if failures else 0
+
+def status(args: Namespace) -> int:
+    allowed = True
+    for path in args.paths:
+        for result in check_ancestors(args.user, Path(path).resolve()):
+            _emit(result)
+            allowed = allowed and result.allowed
+    return 0 if allowed else 1
+
+def audit(args: Namespace) -> int:
+    stats = BulkStats()
+    for path in args.paths:
+        for acl_set in audit_tree(path, stats=stats):
+            _emit(acl_set)
+    print(f"{stats.files} files, using {stats.distinct_acls} distinct ACLs", file=sys.stderr)
+    return 0
+
+def restore(args: Namespace) -> int:
+    file: TextIO = args.file
+    failures = 0
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            acl_set = AclSet.model_validate_json(line)
+            acl_set.apply()
+        except Exception as e:
+            failures += 1
+            print(f"{file.name}, line {number}: {e}", file=sys.stderr)
+        else:
+            if args.progress:
+                print(f"Restored {acl_set.file_path}", file=sys.stderr)
+    return 1 if failures else 0
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog="acledit", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(required=True)
+
+    def add_budget_option(command: ArgumentParser):
+        command.add_argument("--memory-budget", type=float, metavar="MB", help="Approximate number of megabytes to use for remembering distinct ACLs, however large the tree")
+
+    def add_engine_options(command: ArgumentParser):
+        command.add_argument("--workers", type=int, default=8, help="Number of paths to process at once")
+        command.add_argument("--rate", type=float, help="Maximum number of ACL writes per second")
+        command.add_argument("--progress", action="store_true", help="Print progress to stderr while running")
+        add_budget_option(command)
+
+    command = commands.add_parser("share", help="Share files with a user, adjusting parent directories where necessary")
+    command.add_argument("paths", nargs="+")
+    command.add_argument("--user", required=True, help="Username to share with")
+    command.add_argument("--edit", action="store_true", help="Allow the user to edit the files")
+    command.add_argument("--recursive", action="store_true", help="Also share everything inside directories")
+    command.add_argument("--default", action="store_true", help="Also share files created in the directories in future")
+    command.add_argument("--directories-only", action="store_true", help="With --recursive, only share the directories and not the existing files in them. This is much faster for large trees")
+    add_engine_options(command)
+    command.set_defaults(func=share)
+
+    command = commands.add_parser("revoke", help="Stop sharing files with a user or group")
+    command.add_argument("paths", nargs="+")
+    command.add_argument("--user", required=True, help="Username or group name to stop sharing with")
+    command.add_argument("--group", action="store_true", help="--user is a group name")
+    command.add_argument("--recursive", action="store_true", help="Also stop sharing everything inside directories")
+    add_engine_options(command)
+    command.set_defaults(func=revoke)
+
+    command = commands.add_parser("batch", help='Run JSON Lines jobs such as {"op": "share", "path": "/data", "user": "alice"}')
+    command.add_argument("file", type=FileType("r"), nargs="?", default=sys.stdin, help="File of jobs. Defaults to stdin")
+    add_engine_options(command)
+    command.set_defaults(func=batch)
+
+    command = commands.add_parser("template", help="Share files with every user and group in a template from the app config")
+    command.add_argument("name", help="Name of the template")
+    command.add_argument("paths", nargs="+")
+    command.add_argument("--config", help="JSON file with a templates object, such as the app config. Defaults to $ACLEDIT_CONFIG, then config.json")
+    add_engine_options(command)
+    command.set_defaults(func=template)
+
+    command = commands.add_parser("status", help="Check whether a user can access files, including through every parent directory")
+    command.add_argument("paths", nargs="+")
+    command.add_argument("--user", required=True)
+    command.set_defaults(func=status)
+
+    command = commands.add_parser("audit", help="Print the ACLs of everything under some paths, in the format used by restore")
+    command.add_argument("paths", nargs="+")
+    add_budget_option(command)
+    command.set_defaults(func=audit)
+
+    command = commands.add_parser("restore", help="Reapply ACLs printed by audit")
+    command.add_argument("file", type=FileType("r"), nargs="?", default=sys.stdin, help="Output of audit. Defaults to stdin")
+    command.add_argument("--progress", action="store_true", help="Print each restored path to stderr")
+    command.set_defaults(func=restore)
+
+    return parser
+
+def main(argv: list[str] | None = None) -> int:
+    args = make_parser().parse_args(argv)
+    if getattr(args, "memory_budget", None) is not None:
+        set_default_budget(MemoryBudget.from_megabytes(args.memory_budget))
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
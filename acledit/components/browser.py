@@ -8,16 +8,79 @@ from dash import (
     MATCH,
     State,
     html,
+    no_update,
+    Patch,
 )
 import dash_bootstrap_components as dbc
 from acledit.components.icon import FontAwesomeIcon
 from acledit.components.utils import declare_child, real_event
-from acledit.config import config
+from acledit.config import get_config
+from acledit.acl_index import AclIndex
+from acledit.cache import Cache, create_cache
+from acledit.listing import FileDetails, FileRecord, Listing, file_details, list_directory, listing_key, read_details
+from acledit.watch import Watcher, create_watcher
 from pathlib import Path
+from typing import Any, Callable
 from getpass import getuser
 import os
 from dash.exceptions import PreventUpdate
-import pwd
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Read-only handle on the ACL index, if indexing is enabled
+acl_index = AclIndex(get_config().index.database) if get_config().index is not None else None
+
+#: Recent directory listings, so that many tabs or users opening the same directory only list it once
+listings: Cache[Listing] = create_cache("listings", ttl=get_config().cache_ttl, max_size=64, database=get_config().shared_cache)
+
+def _create_watcher() -> Watcher | None:
+    watch = get_config().watch
+    if watch is None:
+        return None
+    return create_watcher(watch.backend, poll_interval=watch.poll_interval, max_dirs=watch.max_dirs, idle_timeout=watch.idle_timeout)
+
+#: Watches the directories being viewed, if enabled, so that their listings are updated in place instead of being re-read
+watcher = _create_watcher()
+
+def cached_listing(dir: str, ttl: float | None = None) -> Listing:
+    """
+    Lists a directory, reusing a recent listing if the directory hasn't changed since.
+    If the directory is being watched, the last listing is updated with the files that have changed instead
+    Params:
+        ttl: Number of seconds to keep the listing for, if it has to be made. Defaults to `config.cache_ttl`.
+            Listings with a `ttl` are not watched, since they aren't necessarily being viewed
+    """
+    def load() -> Listing:
+        return listings.get_or_compute(listing_key(dir), lambda: list_directory(dir), ttl=ttl)
+
+    if watcher is not None and ttl is None:
+        return watcher.listing(dir, load)
+    return load()
+
+def prewarm_listings(dirs: list[str], ttl: float) -> threading.Thread:
+    """
+    Lists and caches directories in a background thread, so that the first person to open them doesn't have to wait.
+    This also reads each file's details, which warms the username cache and the kernel's attribute cache.
+    Params:
+        ttl: Number of seconds to keep the listings for
+    """
+    def _run():
+        # Shortcuts often include the start directory
+        for dir in dict.fromkeys(dirs):
+            try:
+                start = time.perf_counter()
+                listing = cached_listing(dir, ttl=ttl)
+                listing.details()
+                logger.info(f"Pre-warmed {dir} ({len(listing)} files) in {time.perf_counter() - start:.2f} seconds")
+            except OSError as e:
+                logger.warning(f"Failed to pre-warm {dir}: {e}")
+
+    thread = threading.Thread(target=_run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
 
 class FileBrowserFile(dbc.ListGroupItem):
     """
@@ -28,70 +91,88 @@ class FileBrowserFile(dbc.ListGroupItem):
     share = declare_child("share", filename=ALL)
     #: Listen to change in nclicks to determine when the user clicks the edit button
     edit = declare_child("edit", filename=ALL)
+    #: Listen to change in value to determine when the user selects the file for a batch share
+    select = declare_child("select", filename=ALL)
+
+    # Private fields
+    _badges = declare_child("badges", filename=ALL)
+    #: The share and edit buttons, which are replaced together once the file's details are known
+    _actions = declare_child("actions", filename=ALL)
 
-    def __init__(self, parent_id: str, file: Path, name: str | None = None, **kwargs):
+    def __init__(self, parent_id: str, file: FileRecord, name: str | None = None, details: FileDetails | None = None, **kwargs):
         """
         Params:
             name: Optional name for the path, otherwise the filename is used
+            details: The file's metadata. If not provided, the row is displayed with its buttons disabled,
+                and `load_row_details` fills them in once the listing has been displayed
             kwargs: Other distinguishing arguments
         """
-        # We specifically don't care about the target of the symlink in this case
-        stat = file.stat(follow_symlinks=False)
-        not_owned = pwd.getpwuid(stat.st_uid).pw_name != getuser()
-        acl_mount = config.has_acls(file)
-        disabled = not_owned or not acl_mount
-
-        error_message: str | None = None
-        if not_owned:
-            error_message = "You can only share files that you own"
-        elif not acl_mount:
-            error_message = "This file is not part of a filesystem that supports ACLs"
+        if details is None:
+            disabled = True
+            error_message = "Loading..."
+            badges = []
+        else:
+            error_message = share_error(file.path, details)
+            disabled = error_message is not None
+            badges = detail_badges(file.path, details)
 
         if name is None:
             name = file.name
 
-        buttons = [
-            dbc.Button(
-                [FontAwesomeIcon("share"), "Share"],
-                id=FileBrowserFile.share(
-                    aio_id=parent_id, filename=str(file), **kwargs
-                ),
-                title=error_message,
-                disabled=disabled,
-            ),
-        ]
+        # Shortcuts can't be selected, because they aren't part of the current directory
+        selectable = not kwargs.get("shortcut", False)
 
-        if config.editor:
-            buttons.append(dbc.Button(
-                [FontAwesomeIcon("pen-to-square"), "Edit"],
-                color="light",
-                id=FileBrowserFile.edit(
-                    aio_id=parent_id, filename=str(file), **kwargs 
-                ),
-                title=error_message,
-                disabled=disabled,
-            ))
         super().__init__(
             dbc.Row(
                 [
+                    *(
+                        [
+                            dbc.Col(
+                                dbc.Checkbox(
+                                    id=FileBrowserFile.select(
+                                        aio_id=parent_id, filename=file.path, **kwargs
+                                    ),
+                                    value=False,
+                                    disabled=disabled,
+                                ),
+                                width="auto",
+                            )
+                        ]
+                        if selectable
+                        else []
+                    ),
                     dbc.Col(
                         html.A(
                             [
                                 (
                                     FontAwesomeIcon("folder")
-                                    if file.is_dir()
+                                    if file.is_dir
                                     else FontAwesomeIcon("file")
                                 ),
                                 name,
                             ],
                             href="#",
                             id=FileBrowser._dir_browse(
-                                aio_id=parent_id, filename=str(file), **kwargs
+                                aio_id=parent_id, filename=file.path, **kwargs
+                            ),
+                        ),
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        html.Span(
+                            badges,
+                            id=FileBrowserFile._badges(
+                                aio_id=parent_id, filename=file.path, **kwargs
                             ),
                         )
                     ),
                     dbc.Col(
-                        dbc.ButtonGroup(buttons),
+                        dbc.ButtonGroup(
+                            row_buttons(parent_id, file.path, error_message, **kwargs),
+                            id=FileBrowserFile._actions(
+                                aio_id=parent_id, filename=file.path, **kwargs
+                            ),
+                        ),
                         className="justify-content-end d-flex",
                         md=6,
                     ),
@@ -101,6 +182,63 @@ class FileBrowserFile(dbc.ListGroupItem):
         )
 
 
+def row_buttons(parent_id: str, path: str, error_message: str | None, **kwargs) -> list[dbc.Button]:
+    """
+    The share and edit buttons of a row, which are disabled with the reason as their title if the file can't be shared
+    Params:
+        kwargs: Other distinguishing arguments of the row
+    """
+    buttons = [
+        dbc.Button(
+            [FontAwesomeIcon("share"), "Share"],
+            id=FileBrowserFile.share(
+                aio_id=parent_id, filename=path, **kwargs
+            ),
+            title=error_message,
+            disabled=error_message is not None,
+        ),
+    ]
+
+    if get_config().editor:
+        buttons.append(dbc.Button(
+            [FontAwesomeIcon("pen-to-square"), "Edit"],
+            color="light",
+            id=FileBrowserFile.edit(
+                aio_id=parent_id, filename=path, **kwargs
+            ),
+            title=error_message,
+            disabled=error_message is not None,
+        ))
+    return buttons
+
+def share_error(path: str, details: FileDetails | None) -> str | None:
+    """
+    Returns the reason that a file can't be shared or edited, or None if it can be
+    """
+    if details is None:
+        return "This file no longer exists"
+    elif details.owner != getuser():
+        return "You can only share files that you own"
+    elif not get_config().has_acls(Path(path)):
+        return "This file is not part of a filesystem that supports ACLs"
+    return None
+
+def detail_badges(path: str, details: FileDetails | None) -> list:
+    """
+    Small indicators shown next to the filename
+    """
+    badges = []
+    if details is not None and details.owner != getuser():
+        badges.append(dbc.Badge([FontAwesomeIcon("user"), details.owner], color="light", text_color="secondary", className="ms-2"))
+    if details is not None and details.shares:
+        badges.append(dbc.Badge([FontAwesomeIcon("users"), str(details.shares)], color="info", className="ms-2", title=f"Shared with {details.shares} users or groups"))
+    elif details is not None and details.shares == 0:
+        badges.append(dbc.Badge("ACL", color="light", text_color="secondary", className="ms-2", title="This file has an extended ACL"))
+    if not get_config().has_acls(Path(path)):
+        badges.append(dbc.Badge("No ACLs", color="light", text_color="secondary", className="ms-2"))
+    return badges
+
+
 class FileBrowser(dbc.Row):
     """
     Component for the entire file browser
@@ -108,6 +246,10 @@ class FileBrowser(dbc.Row):
     # Public
     #: The data property can be set to modify the working directory
     current_path = declare_child("current_path")
+    #: The data property holds the list of selected file paths
+    selection = declare_child("selection")
+    #: Listen to change in nclicks to determine when the user clicks the share selected button
+    share_selected = declare_child("share_selected")
 
     # Private
     _file_list = declare_child("file_list")
@@ -116,12 +258,30 @@ class FileBrowser(dbc.Row):
     _main_panel_title = declare_child("main_panel_title")
     _dir_go_input = declare_child("dir_go_input")
     _dir_go_button = declare_child("dir_go_button")
+    _access_summary = declare_child("access_summary")
+    _rows = declare_child("rows")
+    _search = declare_child("search")
+    _sort = declare_child("sort")
+    _pages = declare_child("pages")
+    _match_count = declare_child("match_count")
+    _version = declare_child("version")
+    _refresh = declare_child("refresh")
 
     def __init__(self, id: str):
         self._id = id
+        config = get_config()
         super().__init__(
             [
                 dcc.Store(id=self.current_path(id), data=str(config.start_dir)),
+                dcc.Store(id=self.selection(id), data=[]),
+                dcc.Store(id=self._rows(id), data=[]),
+                # The version of the directory being shown, for asking the watcher what has changed since
+                dcc.Store(id=self._version(id), data=None),
+                dcc.Interval(
+                    id=self._refresh(id),
+                    interval=int((config.watch.refresh_interval if config.watch is not None else 3) * 1000),
+                    disabled=config.watch is None,
+                ),
                 dbc.Col(
                     [
                         html.H3("Shortcuts"),
@@ -129,10 +289,19 @@ class FileBrowser(dbc.Row):
                             [
                                 # We need shortcut to ensure this doesn't have a duplicate ID with 
                                 # a file in the right panel
-                                FileBrowserFile(id, Path(path), name=name, shortcut=True)
+                                # Shortcuts are only rendered once, so their details are read immediately
+                                FileBrowserFile(id, FileRecord.from_path(Path(path)), name=name, details=file_details(str(path)), shortcut=True)
                                 for name, path in config.shortcuts.items()
                             ]
                         ),
+                        *(
+                            [
+                                html.H3("Who Has Access"),
+                                html.Div(id=self._access_summary(id)),
+                            ]
+                            if acl_index is not None
+                            else []
+                        ),
                     ],
                     md=4,
                 ),
@@ -148,7 +317,43 @@ class FileBrowser(dbc.Row):
                                 ),
                             ]
                         ),
+                        dbc.Button(
+                            [FontAwesomeIcon("share-nodes"), "Share Selected"],
+                            id=self.share_selected(id),
+                            disabled=True,
+                            className="my-2",
+                        ),
+                        dbc.InputGroup(
+                            [
+                                dbc.InputGroupText(FontAwesomeIcon("magnifying-glass")),
+                                dbc.Input(
+                                    id=self._search(id),
+                                    placeholder="Filter by name, or a pattern such as *.csv",
+                                    debounce=True,
+                                ),
+                                dbc.Select(
+                                    id=self._sort(id),
+                                    options=[
+                                        {"label": "Name (A to Z)", "value": "name"},
+                                        {"label": "Name (Z to A)", "value": "-name"},
+                                        {"label": "Newest first", "value": "-mtime"},
+                                        {"label": "Largest first", "value": "-size"},
+                                        {"label": "Owner", "value": "owner"},
+                                    ],
+                                    value="name",
+                                ),
+                            ],
+                            className="mb-2",
+                        ),
+                        html.P(id=self._match_count(id), className="text-muted"),
                         dbc.ListGroup(id=self._file_list(id)),
+                        dbc.Pagination(
+                            id=self._pages(id),
+                            max_value=1,
+                            active_page=1,
+                            fully_expanded=False,
+                            className="mt-2",
+                        ),
                     ],
                     md=8,
                 ),
@@ -158,13 +363,25 @@ class FileBrowser(dbc.Row):
 
 @callback(
     Output(FileBrowser._file_list(MATCH), "children"),
+    Output(FileBrowser._rows(MATCH), "data"),
+    Output(FileBrowser._pages(MATCH), "max_value"),
+    Output(FileBrowser._pages(MATCH), "active_page"),
+    Output(FileBrowser._match_count(MATCH), "children"),
+    Output(FileBrowser._version(MATCH), "data"),
     Input(FileBrowser.current_path(MATCH), "data"),
+    Input(FileBrowser._search(MATCH), "value"),
+    Input(FileBrowser._sort(MATCH), "value"),
+    Input(FileBrowser._pages(MATCH), "active_page"),
 )
-def populate_filelist(dir: str | None) -> list[dbc.ListGroupItem]:
-    # When the browser path changes, create the per-file components
+def populate_filelist(dir: str | None, search: str | None, sort: str, page: int | None) -> tuple[list[dbc.ListGroupItem], list[str], int, int, str, str | None]:
+    # When the browser path, search, sort or page changes, create the per-file components for the current page.
+    # This only needs the cached directory listing, so that large directories appear quickly
     if not real_event():
-        return []
+        return [], [], 1, 1, "", None
     parent_id = ctx.triggered_id["aio_id"]
+    if ctx.triggered_id["child"] != "pages" or page is None:
+        # Anything other than changing page starts again from the first page
+        page = 1
     new_children = [
         dbc.ListGroupItem(
             children=[FontAwesomeIcon("arrow-left-long"), "Back"],
@@ -174,9 +391,190 @@ def populate_filelist(dir: str | None) -> list[dbc.ListGroupItem]:
     ]
     if dir is None:
         dir = str(Path.home())
-    for file in sorted(Path(dir).iterdir(), key=lambda path: path.name):
+    page_size = get_config().page_size
+    # Taken before listing, so that the next refresh can only repeat changes, never miss them
+    version = watcher.watch(dir) if watcher is not None else None
+    listing = cached_listing(dir)
+    files, total = listing.query(
+        search=search or "",
+        sort=sort.removeprefix("-"),
+        descending=sort.startswith("-"),
+        page=page - 1,
+        page_size=page_size,
+    )
+    for file in files:
         new_children.append(FileBrowserFile(parent_id, file=file, shortcut=False))
-    return new_children
+
+    pages = max(1, -(-total // page_size))
+    if search:
+        count = f"{total} of {len(listing)} files match"
+    else:
+        count = f"{total} files"
+    return new_children, [file.path for file in files], pages, page, count, version
+
+
+@callback(
+    Output(FileBrowserFile._actions(MATCH, shortcut=False), "children"),
+    Output(FileBrowserFile.select(MATCH, shortcut=False), "disabled"),
+    Output(FileBrowserFile._badges(MATCH, shortcut=False), "children"),
+    Input(FileBrowser._rows(MATCH), "data"),
+    prevent_initial_call=True,
+)
+def load_row_details(_rows: list[str]) -> tuple[list, ...]:
+    # Once the rows have been displayed, read their metadata in one batch and enable the buttons of the files that can be shared.
+    # The rows are taken from the outputs rather than the input, in case the list has been re-rendered since.
+    # The browser sends the ID of every output of every row, so the buttons are replaced together rather than each being an output
+    paths = list(dict.fromkeys(item["id"]["filename"] for output in ctx.outputs_list for item in output))
+    details = dict(zip(paths, read_details(paths)))
+    errors = {path: share_error(path, details[path]) for path in paths}
+    parent_id = ctx.outputs_list[0][0]["id"]["aio_id"] if paths else None
+
+    def for_each(output: list[dict], value: Callable[[str], Any]) -> list:
+        # Outputs are listed in the order the components appear, so look each one up by filename
+        return [value(item["id"]["filename"]) for item in output]
+
+    actions, select, badges = ctx.outputs_list
+    return (
+        for_each(actions, lambda path: row_buttons(parent_id, path, errors[path], shortcut=False)),
+        for_each(select, lambda path: errors[path] is not None),
+        for_each(badges, lambda path: detail_badges(path, details[path])),
+    )
+
+
+@callback(
+    Output(FileBrowser._file_list(MATCH), "children", allow_duplicate=True),
+    Output(FileBrowser._pages(MATCH), "max_value", allow_duplicate=True),
+    Output(FileBrowser._match_count(MATCH), "children", allow_duplicate=True),
+    Output(FileBrowser._version(MATCH), "data", allow_duplicate=True),
+    Output(FileBrowserFile._actions(MATCH, shortcut=False), "children", allow_duplicate=True),
+    Output(FileBrowserFile.select(MATCH, shortcut=False), "disabled", allow_duplicate=True),
+    Output(FileBrowserFile._badges(MATCH, shortcut=False), "children", allow_duplicate=True),
+    Input(FileBrowser._refresh(MATCH), "n_intervals"),
+    State(FileBrowser.current_path(MATCH), "data"),
+    State(FileBrowser._search(MATCH), "value"),
+    State(FileBrowser._sort(MATCH), "value"),
+    State(FileBrowser._pages(MATCH), "active_page"),
+    State(FileBrowser._version(MATCH), "data"),
+    prevent_initial_call=True,
+)
+def refresh_rows(_n_intervals: int, dir: str | None, search: str | None, sort: str, page: int | None, version: str | None) -> tuple:
+    # Periodically ask the watcher what has changed in the directory being shown, and update only those rows.
+    # Added and removed rows are patched into the list, so the other rows and their ticked checkboxes are left alone
+    if watcher is None or dir is None:
+        raise PreventUpdate()
+    parent_id = ctx.triggered_id["aio_id"]
+    changed = watcher.changes(dir, version)
+    if changed is None:
+        # This worker process hasn't been following the directory, so start now and report changes from the next refresh
+        return no_update, no_update, no_update, watcher.watch(dir), *[[no_update] * len(output) for output in ctx.outputs_list[4:]]
+    version, changes = changed
+    if not changes:
+        raise PreventUpdate()
+
+    names = {change.name for change in changes}
+    page_size = get_config().page_size
+    listing = cached_listing(dir)
+    files, total = listing.query(
+        search=search or "",
+        sort=sort.removeprefix("-"),
+        descending=sort.startswith("-"),
+        page=(page or 1) - 1,
+        page_size=page_size,
+    )
+    # The rows currently displayed, in order
+    shown = [item["id"]["filename"] for item in ctx.outputs_list[4]]
+    wanted = [file.path for file in files]
+    shown_set, wanted_set = set(shown), set(wanted)
+    kept = [path for path in shown if path in wanted_set]
+    if kept != [path for path in wanted if path in shown_set]:
+        # The remaining rows have been reordered, for example by a sort on size, so every row is replaced
+        kept = []
+    kept_set = set(kept)
+
+    # Only new rows and rows whose files changed need their details read
+    touched = [path for path in wanted if path not in kept_set or Path(path).name in names]
+    details = dict(zip(touched, read_details(touched)))
+    children = no_update
+    if shown != wanted:
+        children = Patch()
+        # The first child is the "Back" row. Delete from the end so that earlier indices stay valid
+        for i in reversed(range(len(shown))):
+            if shown[i] not in kept_set:
+                del children[i + 1]
+        # Inserting in order puts each row at its final position
+        for i, file in enumerate(files):
+            if file.path not in kept_set:
+                children.insert(i + 1, FileBrowserFile(parent_id, file=file, details=details[file.path], shortcut=False))
+
+    def for_each(output: list[dict], value: Callable[[str], Any]) -> list:
+        # Rows that haven't changed are left as they are, and so are rows being removed or replaced
+        return [
+            value(item["id"]["filename"]) if item["id"]["filename"] in details and item["id"]["filename"] in kept_set else no_update
+            for item in output
+        ]
+
+    errors = {path: share_error(path, detail) for path, detail in details.items()}
+    actions, select, badges = ctx.outputs_list[4:]
+    count = f"{total} of {len(listing)} files match" if search else f"{total} files"
+    return (
+        children,
+        max(1, -(-total // page_size)),
+        count,
+        version,
+        for_each(actions, lambda path: row_buttons(parent_id, path, errors[path], shortcut=False)),
+        for_each(select, lambda path: errors[path] is not None),
+        for_each(badges, lambda path: detail_badges(path, details[path])),
+    )
+
+
+@callback(
+    Output(FileBrowser.selection(MATCH), "data"),
+    Output(FileBrowser.share_selected(MATCH), "children"),
+    Output(FileBrowser.share_selected(MATCH), "disabled"),
+    Input(FileBrowserFile.select(MATCH, filename=ALL, shortcut=False), "value"),
+    State(FileBrowserFile.select(MATCH, filename=ALL, shortcut=False), "id"),
+)
+def update_selection(values: list[bool | None], ids: list[dict]) -> tuple[list[str], list, bool]:
+    # When files are ticked, record which ones are selected
+    selected = [id["filename"] for id, value in zip(ids, values) if value]
+    label = [FontAwesomeIcon("share-nodes"), f"Share {len(selected)} Selected"]
+    return selected, label, len(selected) == 0
+
+
+@callback(
+    Output(FileBrowser._access_summary(MATCH), "children"),
+    Input(FileBrowser.current_path(MATCH), "data"),
+)
+def update_access_summary(dir: str | None) -> list:
+    # When the browser path changes, summarise who has access anywhere under it, using the index
+    if acl_index is None or dir is None:
+        raise PreventUpdate()
+    if not any(Path(dir).is_relative_to(root) for root in get_config().index.roots):
+        return [html.P("This directory is not indexed.", className="text-muted")]
+
+    summary = acl_index.summarise(dir)
+    if summary.indexed_at is None:
+        return [html.P("This directory has not been indexed yet.", className="text-muted")]
+
+    minutes = int((time.time() - summary.indexed_at) // 60)
+    return [
+        html.P(
+            f"{summary.files} files using {summary.distinct_acls} distinct ACLs, indexed up to {minutes} minutes ago.",
+            className="text-muted",
+        ),
+        dbc.ListGroup(
+            [
+                dbc.ListGroupItem(
+                    [
+                        FontAwesomeIcon({"user": "user", "group": "users", "other": "globe"}[principal.kind]),
+                        principal.name or "Everyone",
+                        dbc.Badge(f"{principal.files} files", color="secondary", className="ms-2"),
+                    ]
+                )
+                for principal in summary.principals
+            ]
+        ),
+    ]
 
 
 @callback(
@@ -6,7 +6,17 @@ import dash_bootstrap_components as dbc
 from acledit.components.utils import declare_child, real_event
 from dash.exceptions import PreventUpdate
 from acledit.acl import AclSet
+from acledit.acl_set import AclEntry
 from acledit.components.icon import FontAwesomeIcon
+from acledit.cache import Cache, create_cache
+from acledit.config import get_config
+import os
+
+#: Recently read ACLs, so that opening the same file several times at once only reads it once
+acl_sets: Cache[AclSet] = create_cache("acl_sets", ttl=get_config().cache_ttl, max_size=128, database=get_config().shared_cache)
+
+#: Number of user and group entries shown on each page of each table
+EDITOR_PAGE_SIZE = 25
 
 
 class AclEditorModal(html.Div):
@@ -23,7 +33,10 @@ class AclEditorModal(html.Div):
     _close = declare_child("close")
     _delete_entry = declare_child("delete_entry")
     _add_entry = declare_child("add_entry")
-    _checkbox = declare_child("_heckbox", type=ALL, qualifier=ALL, default=ALL, perm=ALL)
+    _checkbox = declare_child("checkbox", index=ALL, default=ALL, perm=ALL)
+    _filter = declare_child("filter")
+    _pages = declare_child("pages", default=ALL)
+    _summary = declare_child("summary")
 
     def __init__(self, id: str, **kwargs):
         super().__init__(
@@ -38,6 +51,17 @@ class AclEditorModal(html.Div):
                         dbc.ModalBody(
                             dbc.Form(
                                 [
+                                    dbc.InputGroup(
+                                        [
+                                            dbc.InputGroupText(FontAwesomeIcon("magnifying-glass")),
+                                            dbc.Input(
+                                                id=AclEditorModal._filter(id),
+                                                placeholder="Filter by user or group name",
+                                                debounce=True,
+                                            ),
+                                        ]
+                                    ),
+                                    html.P(id=AclEditorModal._summary(id), className="text-muted"),
                                     html.H3("Access Control"),
                                     dbc.Table(
                                         [
@@ -49,12 +73,14 @@ class AclEditorModal(html.Div):
                                                         html.Th("Read"),
                                                         html.Th("Write"),
                                                         html.Th("Execute"),
+                                                        html.Th("Delete"),
                                                     ]
                                                 )
                                             ),
                                             html.Tbody(id=AclEditorModal._acls_body(id)),
                                         ]
                                     ),
+                                    dbc.Pagination(id=AclEditorModal._pages(id, default=False), max_value=1, active_page=1, fully_expanded=False),
                                     # dbc.Button("New ACL", class_name="btn-block", id=AclEditorModal._add_entry(id, default = False)),
                                     html.H3("Default Access Control"),
                                     dbc.Table(
@@ -74,6 +100,7 @@ class AclEditorModal(html.Div):
                                             html.Tbody(id=AclEditorModal._default_acls_body(id)),
                                         ]
                                     ),
+                                    dbc.Pagination(id=AclEditorModal._pages(id, default=True), max_value=1, active_page=1, fully_expanded=False),
                                     # dbc.Button("New ACL", class_name="btn-block", id=AclEditorModal._add_entry(id, default=True)),
                                 ]
                             )
@@ -112,7 +139,10 @@ def update_acl_from_path(path: str | None):
     """
     if path is None:
         raise PreventUpdate()
-    return AclSet.from_file(path).model_dump()
+    st = os.stat(path)
+    # Changing an ACL updates the file's ctime, so a file that has been edited never hits a stale entry
+    key = f"acl\0{path}\0{st.st_ctime_ns}"
+    return acl_sets.get_or_compute(key, lambda: AclSet.from_file(path, st=st)).model_dump()
 
 @callback(
     Output(AclEditorModal._modal(MATCH), "is_open", allow_duplicate=True),
@@ -125,33 +155,80 @@ def close_modal(_clicks: int) -> bool:
 @callback(
     Output(AclEditorModal._modal(MATCH), "is_open"),
     Output(AclEditorModal._title(MATCH), "children"),
+    Output(AclEditorModal._filter(MATCH), "value"),
+    Output(AclEditorModal._pages(MATCH, default=False), "active_page", allow_duplicate=True),
+    Output(AclEditorModal._pages(MATCH, default=True), "active_page", allow_duplicate=True),
+    Input(AclEditorModal.current_file(MATCH), "data"),
+    prevent_initial_call=True,
+)
+def open_modal(path: str | None) -> tuple[Literal[True], str, str, int, int]:
+    """
+    When a file is chosen, open the modal on the first page, without the filter from the previous file
+    """
+    if path is None:
+        raise PreventUpdate()
+    return True, Path(path).name, "", 1, 1
+
+def entry_rows(id: str, entries: list[AclEntry], default: bool, search: str, page: int) -> tuple[list[html.Tr], int, int, int]:
+    """
+    Renders one page of the user and group entries that match the search
+    Params:
+        page: One-based page number
+    Returns:
+        The rows, the number of matching entries, the page actually shown, and the number of pages
+    """
+    search = search.strip().lower()
+    # Keep each entry's position in the full list, which is how callbacks refer to it
+    matching = [
+        (i, entry) for i, entry in enumerate(entries)
+        if entry.tag_type in {"user", "group"} and search in (entry.qualifier or "").lower()
+    ]
+    pages = max(1, -(-len(matching) // EDITOR_PAGE_SIZE))
+    # Deleting the last entry on the last page leaves that page empty, so go back a page
+    page = min(max(page, 1), pages)
+    rows = [html.Tr([
+        html.Td(entry.tag_type),
+        html.Td(entry.qualifier),
+        *[
+            html.Td(dbc.Checkbox(value=getattr(entry, perm), id=AclEditorModal._checkbox(id, index=i, default=default, perm=perm)))
+            for perm in ["read", "write", "execute"]
+        ],
+        html.Td(dbc.Button(FontAwesomeIcon("trash"), color="danger", id=AclEditorModal._delete_entry(id, index=i, default=default))),
+    ]) for i, entry in matching[(page - 1) * EDITOR_PAGE_SIZE:page * EDITOR_PAGE_SIZE]]
+    return rows, len(matching), page, pages
+
+@callback(
     Output(AclEditorModal._acls_body(MATCH), "children"),
     Output(AclEditorModal._default_acls_body(MATCH), "children"),
+    Output(AclEditorModal._pages(MATCH, default=False), "max_value"),
+    Output(AclEditorModal._pages(MATCH, default=True), "max_value"),
+    Output(AclEditorModal._pages(MATCH, default=False), "active_page"),
+    Output(AclEditorModal._pages(MATCH, default=True), "active_page"),
+    Output(AclEditorModal._summary(MATCH), "children"),
     Input(AclEditorModal._acl(MATCH), "data"),
+    Input(AclEditorModal._filter(MATCH), "value"),
+    Input(AclEditorModal._pages(MATCH, default=False), "active_page"),
+    Input(AclEditorModal._pages(MATCH, default=True), "active_page"),
     prevent_initial_call=True,
 )
-def open_modal(acl_data: dict) -> tuple[Literal[True], str, list[html.Tr], list[html.Tr]]:
+def render_entries(acl_data: dict | None, search: str | None, page: int | None, default_page: int | None) -> tuple[list[html.Tr], list[html.Tr], int, int, int, int, str]:
     """
-    When the internal ACL state changes, update the modal content
+    When the internal ACL state, the filter or the page changes, render the current page of each table.
+    Only one page is ever rendered, so large ACLs don't produce large component trees
     """
+    if acl_data is None:
+        raise PreventUpdate()
     id = ctx.triggered_id["aio_id"]
+    if ctx.triggered_id["child"] == "filter":
+        # A new filter starts again from the first page
+        page = default_page = 1
     acls = AclSet.model_validate(acl_data)
-
-    return True, Path(acls.file_path).name, [html.Tr([
-        html.Td(entry.tag_type),
-        html.Td(entry.qualifier),
-        html.Td(dbc.Checkbox(value=entry.read, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=False, perm="read"))),
-        html.Td(dbc.Checkbox(value=entry.write, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=False, perm="write"))),
-        html.Td(dbc.Checkbox(value=entry.execute, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=False, perm="execute"))),
-        html.Td(dbc.Button(FontAwesomeIcon("trash"), color="danger", id=AclEditorModal._delete_entry(id, index=i, default=False))),
-    ]) for i, entry in enumerate(acls.acls) if entry.tag_type in {"user", "group"}], [html.Tr([
-        html.Td(entry.tag_type),
-        html.Td(entry.qualifier),
-        html.Td(dbc.Checkbox(value=entry.read, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=True, perm="read"))),
-        html.Td(dbc.Checkbox(value=entry.write, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=True, perm="write"))),
-        html.Td(dbc.Checkbox(value=entry.execute, id=AclEditorModal._checkbox(id, type=entry.tag_type, qualifier=entry.qualifier, default=True, perm="execute"))),
-        html.Td(dbc.Button(FontAwesomeIcon("trash"), color="danger", id=AclEditorModal._delete_entry(id, index=i, default=True))),
-    ]) for i, entry in enumerate(acls.iter_default) if entry.tag_type in {"user", "group"}]
+    rows, matching, page, pages = entry_rows(id, acls.acls, False, search or "", page or 1)
+    default_rows, default_matching, default_page, default_pages = entry_rows(id, list(acls.iter_default), True, search or "", default_page or 1)
+    summary = f"{matching} access and {default_matching} default entries"
+    if search:
+        summary += f' matching "{search}"'
+    return rows, default_rows, pages, default_pages, page, default_page, summary
 
 
 @callback(
@@ -188,14 +265,12 @@ def save_acl(_n_clicks: int, acl_data: dict):
     State(AclEditorModal._acl(MATCH), "data"),
     prevent_initial_call=True
 )
-def checkbox_changed(_: bool, acl_raw: dict):
+def checkbox_changed(_values: list[bool], acl_raw: dict):
+    # The checkbox's ID says exactly which entry and permission it controls, so only that entry is updated
+    if not real_event(0):
+        raise PreventUpdate()
+    id = ctx.triggered_id
     acl = AclSet.model_validate(acl_raw)
-    for input, trigger in zip(ctx.inputs_list[0], ctx.args_grouping[0]):
-        if not trigger["triggered"]:
-            continue
-        id = input["id"]
-        entry = acl.find_entry(default=id["default"], qualifier=id["qualifier"], type=id["type"])
-        if entry is None:
-            raise Exception("")
-        setattr(entry, id["perm"], trigger["value"])
+    entries = acl.default_acls if id["default"] else acl.acls
+    setattr(entries[id["index"]], id["perm"], bool(ctx.triggered[0]["value"]))
     return acl.model_dump()
@@ -9,7 +9,6 @@ class FontAwesomeIcon(html.I):
             icon: The name of the FontAwesome icon *without* the fa- prefix
         """
         super().__init__(
-            className=f"fa-solid fa-{icon}",
-            style={"marginLeft": "10px", "marginRight": "10px"},
+            className=f"fa-solid fa-{icon} acledit-icon",
             **kwargs
         )
@@ -1,15 +1,17 @@
-from typing import Literal
-from dash import Dash, html, Input, Output, ALL, dcc, ctx, State, MATCH, callback
-from dash.development.base_component import Component
+from typing import Callable, Literal
+from dash import html, Input, Output, ALL, dcc, ctx, State, MATCH, callback, no_update
 import dash_bootstrap_components as dbc
 from acledit.components.utils import declare_child, real_event
 from dash.exceptions import PreventUpdate
-from acledit.acl import AclSet, grant_user, get_or_create_entry, can_read_recursive, execute_share
-from acledit.config import config
+from acledit.acl import check_ancestors, execute_share, execute_batch_share, execute_revoke, execute_modify, execute_template
+from acledit.bulk import BulkStats, PathResult
+from acledit.config import ThrottleConfig, get_config
+from acledit.identity import user_index
+from acledit.jobs import Job, cancel_job, submit, get_job
+from acledit.throttle import Throttle, ThrottleStats
+from functools import partial
+from acledit.components.icon import FontAwesomeIcon
 from pathlib import Path
-from getpass import getuser
-import posix1e as acl
-import os
 import pwd
 
 class AclShareModal(html.Div):
@@ -24,15 +26,25 @@ class AclShareModal(html.Div):
     _modal = declare_child("modal")
     _close = declare_child("close")
     _share = declare_child("share")
+    _modify = declare_child("modify")
+    _revoke = declare_child("revoke")
     _status = declare_child("status")
     _username = declare_child("username")
+    _suggestions = declare_child("suggestions")
+    _suggestion = declare_child("suggestion", username=ALL)
     _alerts = declare_child("alerts")
     _default = declare_child("default")
+    _directories_only = declare_child("directories_only")
     _recursive = declare_child("recursive")
     _editable = declare_child("editable")
     _advanced = declare_child("advanced")
+    _job = declare_child("job")
+    _job_poll = declare_child("job_poll")
+    _template = declare_child("template")
+    _apply_template = declare_child("apply_template")
 
     def __init__(self, id: str, **kwargs):
+        config = get_config()
         super().__init__(
             [
                 dbc.Modal(
@@ -49,9 +61,13 @@ class AclShareModal(html.Div):
                                     dbc.InputGroup(
                                         [
                                             dbc.InputGroupText("Username"),
-                                            dbc.Input(id=AclShareModal._username(id)),
+                                            dbc.Input(
+                                                id=AclShareModal._username(id),
+                                                autocomplete="off",
+                                            ),
                                         ]
                                     ),
+                                    dbc.ListGroup(id=AclShareModal._suggestions(id)),
                                     dbc.Checkbox(
                                         id=self._editable(id),
                                         label=html.Div(
@@ -98,11 +114,44 @@ class AclShareModal(html.Div):
                                                             ),
                                                             value=False,
                                                         ),
+                                                        dbc.Checkbox(
+                                                            id=self._directories_only(id),
+                                                            label=html.Div(
+                                                                [
+                                                                    html.Strong(
+                                                                        "Directories Only."
+                                                                    ),
+                                                                    " When sharing recursively, only share the directories inside this directory and not the existing files in them. Combined with Inherit, this lets new files be shared without changing every existing file, which is much faster for large directories.",
+                                                                    config.hints.directories_only,
+                                                                ]
+                                                            ),
+                                                            value=False,
+                                                        ),
                                                     ],
                                                 )
                                             ],
                                         ),
                                     ),
+                                    dbc.InputGroup(
+                                        [
+                                            dbc.InputGroupText("Template"),
+                                            dbc.Select(
+                                                id=AclShareModal._template(id),
+                                                options=[
+                                                    {"label": f"{name} ({template.description})" if template.description else name, "value": name}
+                                                    for name, template in config.templates.items()
+                                                ],
+                                            ),
+                                            dbc.Button(
+                                                "Apply Template",
+                                                id=AclShareModal._apply_template(id),
+                                                title="Share with every user and group in the template, using the template's settings instead of the ones above",
+                                                color="secondary",
+                                            ),
+                                        ],
+                                        # Sites without templates don't see this at all
+                                        style=None if config.templates else {"display": "none"},
+                                    ),
                                     dbc.Alert(
                                         "Disclaimer: even if you share a specific file with another user, they may be able to access all files within the VAST area if they know their exact filenames. The user will not be able to list files in VAST spaces they have not been explicitly given access to, however.",
                                         color="warning",
@@ -121,6 +170,18 @@ class AclShareModal(html.Div):
                                     "Share",
                                     id=AclShareModal._share(id),
                                 ),
+                                dbc.Button(
+                                    "Update Access",
+                                    id=AclShareModal._modify(id),
+                                    title="Change whether an existing user can edit, according to the Grant Edit setting",
+                                    color="secondary",
+                                ),
+                                dbc.Button(
+                                    "Revoke",
+                                    id=AclShareModal._revoke(id),
+                                    title="Stop sharing with this user",
+                                    color="danger",
+                                ),
                                 dbc.Button(
                                     "Close",
                                     id=AclShareModal._close(id),
@@ -133,6 +194,9 @@ class AclShareModal(html.Div):
                     id=AclShareModal._modal(id),
                 ),
                 dcc.Store(id=AclShareModal.current_file(id)),
+                # ID of the background job, and a timer to poll its progress
+                dcc.Store(id=AclShareModal._job(id)),
+                dcc.Interval(id=AclShareModal._job_poll(id), interval=250, disabled=True),
             ]
         )
 
@@ -146,19 +210,26 @@ class AclShareModal(html.Div):
     Input(AclShareModal.current_file(MATCH), "data"),
     prevent_initial_call=True,
 )
-def open_modal(filename: str | None) -> tuple[Literal[True], str, list, list, dict]:
+def open_modal(filename: str | list[str] | None) -> tuple[Literal[True], str, list, list, dict]:
     """
     Open the modal, set its title, and clear alerts
-    At this point we modify parts of the modal depending on if we're sharing a file or directory
+    At this point we modify parts of the modal depending on if we're sharing a file or directory,
+    or several files at once
     """
     if filename is None:
         raise PreventUpdate()
 
     modal_open = True
-    title = Path(filename).name
     alerts = []
+
+    if isinstance(filename, list):
+        title = f"{len(filename)} selected files"
+        is_dir = any(Path(path).is_dir() for path in filename)
+    else:
+        title = Path(filename).name
+        is_dir = Path(filename).is_dir()
     
-    if Path(filename).is_dir():
+    if is_dir:
         style = {"visible": True}
         editable_description = [
             html.Strong("Grant Edit."),
@@ -174,6 +245,45 @@ def open_modal(filename: str | None) -> tuple[Literal[True], str, list, list, di
     return modal_open, title, alerts, editable_description, style
 
 
+@callback(
+    Output(AclShareModal._suggestions(MATCH), "children"),
+    Input(AclShareModal._username(MATCH), "value"),
+    prevent_initial_call=True,
+)
+def suggest_users(query: str | None) -> list[dbc.ListGroupItem]:
+    """
+    Suggest usernames as the user types, using the in-memory user index
+    """
+    if not query:
+        return []
+    parent_id = ctx.triggered_id["aio_id"]
+    matches = user_index.search(query, limit=8)
+    if any(match.username == query for match in matches):
+        # The user has already picked a valid username
+        return []
+    return [
+        dbc.ListGroupItem(
+            [html.Strong(match.username), f" {match.full_name}"],
+            id=AclShareModal._suggestion(parent_id, username=match.username),
+            action=True,
+            n_clicks=0,
+        )
+        for match in matches
+    ]
+
+@callback(
+    Output(AclShareModal._username(MATCH), "value"),
+    Input(AclShareModal._suggestion(MATCH, username=ALL), "n_clicks"),
+    prevent_initial_call=True,
+)
+def pick_suggestion(n_clicks: list[int]) -> str:
+    """
+    Fill in the username when the user clicks a suggestion
+    """
+    if ctx.triggered_id is None or not any(n_clicks):
+        raise PreventUpdate()
+    return ctx.triggered_id["username"]
+
 @callback(
     Output(AclShareModal._modal(MATCH), "is_open", allow_duplicate=True),
     Input(AclShareModal._close(MATCH), "n_clicks"),
@@ -182,64 +292,274 @@ def open_modal(filename: str | None) -> tuple[Literal[True], str, list, list, di
 def close_modal(_n_clicks: int) -> bool:
     return False
 
+#: The current throttle, and the config it was created from
+_throttle: tuple[ThrottleConfig, Throttle] | None = None
+
+def get_throttle() -> Throttle:
+    """
+    Returns the rate limits shared by every bulk operation started from this process.
+    If the throttle config has changed, new operations get a new throttle with the new limits.
+    """
+    global _throttle
+    settings = get_config().throttle
+    if _throttle is None or _throttle[0] != settings:
+        _throttle = (
+            settings,
+            Throttle(
+                user_rate=settings.user_ops_per_second,
+                host_rate=settings.host_ops_per_second,
+                host_state_file=settings.host_state_file,
+                latency_threshold=settings.latency_threshold,
+            ),
+        )
+    return _throttle[1]
+
+def start_operation(run: Callable[[Callable[[str, BulkStats], None]], BulkStats | list[PathResult]], message: str, throttle: Throttle) -> tuple[list, str, bool]:
+    """
+    Runs a bulk operation in a background job, so that its progress can be shown while it runs.
+    The progress includes the throttle's statistics, since the browser may poll a different worker process
+    Params:
+        run: Function that performs the operation. It receives a function to call with each path's progress
+        message: Shown when the operation succeeds
+        throttle: The throttle that the operation uses
+    """
+    def job_function(job: Job):
+        job.progress = {"paths": {}, "throttle": throttle.stats.model_dump()}
+
+        def report(path: str, stats: BulkStats):
+            # Replaced rather than updated, so that publishing never sees a dictionary that is being changed
+            job.progress = {
+                "paths": {**job.progress["paths"], path: stats.model_dump()},
+                "throttle": throttle.stats.model_dump(),
+            }
+            job.publish()
+
+        return run(report)
+
+    job = submit(job_function, kind="operation", description=message)
+    return [], job.id, False
+
 @callback(
     Output(AclShareModal._alerts(MATCH), "children", allow_duplicate=True),
+    Output(AclShareModal._job(MATCH), "data", allow_duplicate=True),
+    Output(AclShareModal._job_poll(MATCH), "disabled", allow_duplicate=True),
     Input(AclShareModal._share(MATCH), "n_clicks"),
     State(AclShareModal.current_file(MATCH), "data"),
     State(AclShareModal._username(MATCH), "value"),
     State(AclShareModal._editable(MATCH), "value"),
     State(AclShareModal._recursive(MATCH), "value"),
     State(AclShareModal._default(MATCH), "value"),
+    State(AclShareModal._directories_only(MATCH), "value"),
     prevent_initial_call=True,
 )
 def on_share(
     _n_clicks: int,
-    current_file: str,
+    current_file: str | list[str],
     share_user: str,
     editable: bool,
     recursive: bool,
     default: bool,
-) -> list:
+    directories_only: bool,
+) -> tuple[list, str, bool]:
     """
-    Perform the share, and generate any status alerts
+    Start the share in the background
     """
-    try:
-        execute_share(current_file, share_user, editable, recursive, default)
-    except Exception as e:
-        return [
-            dbc.Alert(
-                str(e),
-                dismissable=True,
-                color="danger",
-            )
-        ]
+    throttle = get_throttle()
+
+    def run(report: Callable[[str, BulkStats], None]) -> BulkStats | list[PathResult]:
+        if isinstance(current_file, list):
+            return execute_batch_share(current_file, share_user, editable, recursive, default, directories_only=directories_only, throttle=throttle, progress=report)
+        return execute_share(current_file, share_user, editable, recursive, default, directories_only=directories_only, throttle=throttle, progress=partial(report, current_file))
+
+    return start_operation(run, "File successfully shared!", throttle)
+
+@callback(
+    Output(AclShareModal._alerts(MATCH), "children", allow_duplicate=True),
+    Output(AclShareModal._job(MATCH), "data", allow_duplicate=True),
+    Output(AclShareModal._job_poll(MATCH), "disabled", allow_duplicate=True),
+    Input(AclShareModal._apply_template(MATCH), "n_clicks"),
+    State(AclShareModal.current_file(MATCH), "data"),
+    State(AclShareModal._template(MATCH), "value"),
+    prevent_initial_call=True,
+)
+def on_template(
+    _n_clicks: int,
+    current_file: str | list[str],
+    name: str | None,
+) -> tuple[list, str | None, bool]:
+    """
+    Start sharing with every principal of a template in the background
+    """
+    template = get_config().templates.get(name) if name else None
+    if template is None:
+        return error_alerts("Please choose a template."), no_update, no_update
+    throttle = get_throttle()
+    paths = current_file if isinstance(current_file, list) else [current_file]
+
+    def run(report: Callable[[str, BulkStats], None]) -> BulkStats | list[PathResult]:
+        results = execute_template(paths, template, throttle=throttle, progress=report)
+        if isinstance(current_file, list):
+            return results
+        if not results[0].success:
+            raise Exception(results[0].message)
+        return results[0].stats
 
+    return start_operation(run, f"Shared using the {name} template!", throttle)
+
+@callback(
+    Output(AclShareModal._alerts(MATCH), "children", allow_duplicate=True),
+    Output(AclShareModal._job(MATCH), "data", allow_duplicate=True),
+    Output(AclShareModal._job_poll(MATCH), "disabled", allow_duplicate=True),
+    Input(AclShareModal._modify(MATCH), "n_clicks"),
+    State(AclShareModal.current_file(MATCH), "data"),
+    State(AclShareModal._username(MATCH), "value"),
+    State(AclShareModal._editable(MATCH), "value"),
+    State(AclShareModal._recursive(MATCH), "value"),
+    prevent_initial_call=True,
+)
+def on_modify(
+    _n_clicks: int,
+    current_file: str | list[str],
+    share_user: str,
+    editable: bool,
+    recursive: bool,
+) -> tuple[list, str, bool]:
+    """
+    Change the access of a user that the file is already shared with, in the background
+    """
+    throttle = get_throttle()
+
+    def run(report: Callable[[str, BulkStats], None]) -> BulkStats | list[PathResult]:
+        def modify(path: str) -> BulkStats:
+            return execute_modify(path, share_user, editable, recursive, throttle=throttle, progress=partial(report, path))
+        if isinstance(current_file, list):
+            return run_each(current_file, modify)
+        return modify(current_file)
+
+    return start_operation(run, "Access successfully updated!", throttle)
+
+@callback(
+    Output(AclShareModal._alerts(MATCH), "children", allow_duplicate=True),
+    Output(AclShareModal._job(MATCH), "data", allow_duplicate=True),
+    Output(AclShareModal._job_poll(MATCH), "disabled", allow_duplicate=True),
+    Input(AclShareModal._revoke(MATCH), "n_clicks"),
+    State(AclShareModal.current_file(MATCH), "data"),
+    State(AclShareModal._username(MATCH), "value"),
+    State(AclShareModal._recursive(MATCH), "value"),
+    prevent_initial_call=True,
+)
+def on_revoke(
+    _n_clicks: int,
+    current_file: str | list[str],
+    share_user: str,
+    recursive: bool,
+) -> tuple[list, str, bool]:
+    """
+    Stop sharing the file with a user, in the background
+    """
+    throttle = get_throttle()
+
+    def run(report: Callable[[str, BulkStats], None]) -> BulkStats | list[PathResult]:
+        def revoke(path: str) -> BulkStats:
+            return execute_revoke(path, share_user, recursive, throttle=throttle, progress=partial(report, path))
+        if isinstance(current_file, list):
+            return run_each(current_file, revoke)
+        return revoke(current_file)
+
+    return start_operation(run, "Access successfully revoked!", throttle)
+
+def run_each(paths: list[str], operation: Callable[[str], BulkStats]) -> list[PathResult]:
+    """
+    Runs an operation on several paths, recording the outcome of each
+    """
+    results = []
+    for path in paths:
+        try:
+            stats = operation(path)
+        except Exception as e:
+            results.append(PathResult(path=path, success=False, message=str(e)))
+        else:
+            results.append(PathResult(path=path, success=True, message="Done", stats=stats))
+    return results
+
+def results_table(results: list[PathResult]) -> list:
+    """
+    A table describing the outcome of an operation on several paths
+    """
+    failures = sum(not result.success for result in results)
+    return [
+        dbc.Alert(
+            f"{len(results) - failures} of {len(results)} paths succeeded.",
+            dismissable=True,
+            color="success" if failures == 0 else "warning",
+        ),
+        dbc.Table(
+            [
+                html.Thead(html.Tr([html.Th("Path"), html.Th("Result"), html.Th("Files Updated")])),
+                html.Tbody([
+                    html.Tr(
+                        [
+                            html.Td(html.Code(Path(result.path).name)),
+                            html.Td(result.message),
+                            html.Td(f"{result.stats.changed} of {result.stats.files}" if result.stats is not None else ""),
+                        ],
+                        className=None if result.success else "table-danger",
+                    )
+                    for result in results
+                ]),
+            ],
+            size="sm",
+        ),
+    ]
+
+def error_alerts(message: str) -> list[dbc.Alert]:
+    """
+    Alerts describing an operation that failed
+    """
     return [
-        dbc.Alert(f"File successfully shared!", dismissable=True, color="success")
+        dbc.Alert(
+            message,
+            dismissable=True,
+            color="danger",
+        )
+    ]
+
+def success_alerts(message: str, stats: BulkStats) -> list[dbc.Alert]:
+    """
+    Alerts describing an operation that succeeded
+    """
+    details = f"{message} Updated {stats.changed} of {stats.files} files, which used {stats.distinct_acls} distinct ACLs."
+    if stats.ancestors_changed:
+        details += f" Also allowed access through {len(stats.ancestors_changed)} parent directories: {', '.join(stats.ancestors_changed)}."
+    return [
+        dbc.Alert(
+            details,
+            dismissable=True,
+            color="success"
+        )
     ]
 
 @callback(
     Output(AclShareModal._alerts(MATCH), "children"),
+    Output(AclShareModal._job(MATCH), "data"),
+    Output(AclShareModal._job_poll(MATCH), "disabled"),
     Input(AclShareModal._status(MATCH), "n_clicks"),
     State(AclShareModal._username(MATCH), "value"),
     State(AclShareModal.current_file(MATCH), "data"),
+    State(AclShareModal._job(MATCH), "data"),
 )
-def on_calculate(_n_clicks: int, user: str, path: str) -> list[dbc.Alert]:
+def on_calculate(_n_clicks: int, user: str, path: str | list[str], previous_job: str | None) -> tuple[list[dbc.Alert], str | None, bool]:
     """
     Triggers when the user clicks "status".
-    Generates various status alerts relating to the validity of the user,
-    the path, and the user's access to the path
+    Validates the user and the path, and then starts checking the user's access
+    to the path and its ancestors in the background
     """
     if not real_event():
         raise PreventUpdate()
-    if not Path(path).exists():
-        return [
-            dbc.Alert(
-                f'The path "{path}" does not exist!',
-                dismissable=False,
-                color="danger",
-            )
-        ]
+
+    if previous_job is not None:
+        cancel_job(previous_job)
+
     try:
         pwd.getpwnam(user)
     except KeyError:
@@ -249,21 +569,146 @@ def on_calculate(_n_clicks: int, user: str, path: str) -> list[dbc.Alert]:
                 dismissable=False,
                 color="danger",
             )
-        ]
+        ], None, True
 
-    if can_read_recursive(user, Path(path)):
+    paths = path if isinstance(path, list) else [path]
+    alerts = [
+        dbc.Alert(
+            f'The path "{missing}" does not exist!',
+            dismissable=False,
+            color="danger",
+        )
+        for missing in paths if not Path(missing).exists()
+    ]
+    paths = [existing for existing in paths if Path(existing).exists()]
+    if len(paths) == 0:
+        return alerts, None, True
+
+    def run(job: Job):
+        for target in paths:
+            if job.cancelled.is_set():
+                return
+            for status in check_ancestors(user, Path(target), cancel=job.cancelled):
+                job.emit({"target": target, **status.model_dump()})
+            job.emit({"target": target, "done": True})
+
+    return alerts, submit(run, kind="status").id, False
+
+@callback(
+    Output(AclShareModal._alerts(MATCH), "children", allow_duplicate=True),
+    Output(AclShareModal._job_poll(MATCH), "disabled", allow_duplicate=True),
+    Input(AclShareModal._job_poll(MATCH), "n_intervals"),
+    State(AclShareModal._job(MATCH), "data"),
+    State(AclShareModal._username(MATCH), "value"),
+    prevent_initial_call=True,
+)
+def poll_job(_n_intervals: int, job_id: str | None, user: str) -> tuple[list, bool]:
+    """
+    Show the progress of the current background job, or its results once it has finished
+    """
+    if job_id is None:
+        return no_update, True
+    job = get_job(job_id)
+    if job is None:
         return [
             dbc.Alert(
-                f"{user} CAN access {path}",
+                "The progress of this operation can't be found. It may still be running in another worker process, so check the file's sharing before trying again.",
                 dismissable=False,
-                color="success",
+                color="warning",
             )
-        ]
+        ], True
+    if job.error is not None:
+        return error_alerts(job.error), True
+
+    if job.kind == "status":
+        return status_job_alerts(job, user), job.done
+
+    if not job.done:
+        return progress_alerts(job), False
+    if isinstance(job.result, list):
+        return results_table(job.result), True
+    return success_alerts(job.description, job.result), True
 
+def progress_alerts(job: Job) -> list:
+    """
+    Alerts describing the progress of a running operation, including any throttling
+    """
+    progress = job.progress or {"paths": {}, "throttle": {}}
+    paths = [BulkStats.model_validate(stats) for stats in progress["paths"].values()]
+    files = sum(stats.files for stats in paths)
+    changed = sum(stats.changed for stats in paths)
+    rate = sum(stats.files_per_second for stats in paths)
+    throttle_stats = ThrottleStats.model_validate(progress["throttle"])
+    details = [f"{files} files checked and {changed} updated so far, at {rate:.0f} files per second."]
+    if throttle_stats.waited > 0:
+        details.append(f" Throttled for {throttle_stats.waited:.1f} seconds to protect the filesystem.")
+    if throttle_stats.backoff < 1:
+        details.append(f" The filesystem is slow ({throttle_stats.latency * 1000:.0f} ms per update), so running at {throttle_stats.backoff:.0%} speed.")
     return [
         dbc.Alert(
+            [dbc.Spinner(size="sm", spinner_class_name="me-2"), *details],
+            dismissable=False,
+            color="info",
+        )
+    ]
+
+def status_job_alerts(job: Job, user: str) -> list:
+    """
+    Show the results of the background status check so far
+    """
+    # Group the results by the path being checked, preserving the order the paths were checked in
+    results: dict[str, list[dict]] = {}
+    finished: set[str] = set()
+    for event in list(job.events):
+        results.setdefault(event["target"], [])
+        if event.get("done"):
+            finished.add(event["target"])
+        else:
+            results[event["target"]].append(event)
+
+    alerts = []
+    for target, statuses in results.items():
+        alerts.extend(status_alerts(user, target, statuses, target in finished))
+    return alerts
+
+def status_alerts(user: str, path: str, statuses: list[dict], finished: bool) -> list:
+    """
+    Generates the status alerts for a single path, from the per-directory results received so far
+    """
+    total = len(Path(path).parents) + 1
+    blocked = any(not status["allowed"] for status in statuses)
+
+    if blocked:
+        summary = dbc.Alert(
             f"{user} CANNOT access {path}",
             dismissable=False,
             color="danger",
         )
+    elif finished:
+        summary = dbc.Alert(
+            f"{user} CAN access {path}",
+            dismissable=False,
+            color="success",
+        )
+    else:
+        summary = dbc.Alert(
+            f"Checking whether {user} can access {path}: {len(statuses)} of {total} directories checked",
+            dismissable=False,
+            color="info",
+        )
+
+    # Show the ancestors from the top down, regardless of the order they were checked in
+    rows = [
+        dbc.ListGroupItem(
+            [
+                FontAwesomeIcon("check" if status["allowed"] else "xmark"),
+                html.Code(status["path"]),
+                f" needs {status['permission']}",
+                *([dbc.Badge("Blocks access", color="danger", className="ms-2")] if not status["allowed"] else []),
+                *([html.Small(f" ({status['error']})")] if status["error"] else []),
+            ],
+            color=None if status["allowed"] else "danger",
+        )
+        for status in sorted(statuses, key=lambda status: len(Path(status["path"]).parts))
     ]
+    return [summary, dbc.ListGroup(rows, flush=True, className="mb-2")]
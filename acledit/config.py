@@ -1,9 +1,18 @@
 import json
+import logging
+import os
+import threading
 from pydantic import BaseModel, Field, AfterValidator
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Literal
 from pwd import getpwuid
 from os import getuid
+from acledit.templates import ShareTemplate
+
+logger = logging.getLogger(__name__)
+
+#: Environment variable that can be set to the path of the config file
+CONFIG_ENV = "ACLEDIT_CONFIG"
 
 def interpolate_start_dir(v: str) -> Path:
     """
@@ -38,6 +47,189 @@ class Hints(BaseModel):
         ),
     ] = ""
 
+    directories_only: Annotated[
+        str,
+        Field(
+            description='An optional string that will be added onto the text used to describe the "directories only" share option.'
+        ),
+    ] = ""
+
+class IndexConfig(BaseModel):
+    """
+    Model for the background indexer that summarises who has access to each directory
+    """
+
+    roots: Annotated[
+        list[Path],
+        Field(
+            description="Directories whose entire subtree will be indexed."
+        ),
+    ]
+
+    database: Annotated[
+        str,
+        Field(
+            description='Path to the SQLite database that stores the index. This should be on a local disk. The `{user}` and `{home}` placeholders can be used.',
+            validate_default=True,
+        ),
+        AfterValidator(interpolate_start_dir),
+    ] = "/tmp/acledit-{user}/index.sqlite"
+
+    interval: Annotated[
+        float,
+        Field(
+            description="Number of seconds to wait between indexing passes."
+        ),
+    ] = 600
+
+    full_rescan_every: Annotated[
+        int,
+        Field(
+            description="Every this many passes, re-read directories even if their modification time hasn't changed. This picks up ACL changes to files, which don't change the directory's modification time."
+        ),
+    ] = 24
+
+class ThrottleConfig(BaseModel):
+    """
+    Model for limiting how quickly bulk operations change ACLs, to protect shared filesystems
+    """
+
+    user_ops_per_second: Annotated[
+        float | None,
+        Field(
+            description="Maximum number of ACL writes per second made by one user's instance of the app. This applies to each worker process separately, so an instance with several workers can make this many writes per second in each. If not set, this is unlimited."
+        ),
+    ] = None
+
+    host_ops_per_second: Annotated[
+        float | None,
+        Field(
+            description="Maximum number of ACL writes per second made by all instances of the app on this host. If not set, this is unlimited."
+        ),
+    ] = None
+
+    host_state_file: Annotated[
+        Path,
+        Field(
+            description="A file, writable by all users, that instances of the app use to share the host-wide limit. This should be on a local disk, such as /dev/shm. If the file can't be used safely, for example because it is a symlink or another user's file is protected by fs.protected_regular, each process is limited to the host-wide rate on its own instead."
+        ),
+    ] = Path("/dev/shm/acledit-throttle")
+
+    latency_threshold: Annotated[
+        float | None,
+        Field(
+            description="If the average time taken to write an ACL rises above this many seconds, bulk operations slow down until it recovers. If not set, there is no adaptive backoff."
+        ),
+    ] = 0.05
+
+class WatchConfig(BaseModel):
+    """
+    Model for refreshing the file browser when files in the current directory change
+    """
+
+    backend: Annotated[
+        Literal["auto", "inotify", "poll"],
+        Field(
+            description='How to detect changes. "inotify" is immediate and cheap, but does not see changes made on other hosts of a network filesystem. "poll" re-reads each directory that is being viewed at most every `poll_interval` seconds, in the background. "auto" uses inotify if it is available.'
+        ),
+    ] = "auto"
+
+    poll_interval: Annotated[
+        float,
+        Field(
+            description='Number of seconds between scans of each watched directory, when polling.'
+        ),
+    ] = 5
+
+    refresh_interval: Annotated[
+        float,
+        Field(
+            description="Number of seconds between each browser tab asking the server for changes to the directory it is showing."
+        ),
+    ] = 3
+
+    max_dirs: Annotated[
+        int,
+        Field(
+            description="Maximum number of directories watched at once by each worker process. The least recently viewed directory stops being watched when this is exceeded."
+        ),
+    ] = 64
+
+    idle_timeout: Annotated[
+        float,
+        Field(
+            description="Number of seconds after which a directory that nobody is viewing stops being watched."
+        ),
+    ] = 300
+
+class ProfilingConfig(BaseModel):
+    """
+    Model for profiling individual requests on demand, to diagnose slow requests in production
+    """
+
+    token: Annotated[
+        str,
+        Field(
+            description='Secret that enables profiling. A request is profiled if it sends this in the `X-Acledit-Profile` header, or if the page was loaded with `?profile=<token>`, in which case the following requests from that browser are profiled too.'
+        ),
+    ]
+
+    directory: Annotated[
+        str,
+        Field(
+            description='Directory in which each profile is saved as a pstats file, with a JSON summary of the time spent in acledit, Dash and system calls. The `{user}` and `{home}` placeholders can be used.',
+            validate_default=True,
+        ),
+        AfterValidator(interpolate_start_dir),
+    ] = "/tmp/acledit-{user}/profiles"
+
+    cookie_seconds: Annotated[
+        float,
+        Field(
+            description="Number of seconds that a browser keeps being profiled after loading a page with the `profile` query parameter."
+        ),
+    ] = 300
+
+    keep: Annotated[
+        int,
+        Field(
+            description="Maximum number of profiles to keep. The oldest are deleted first."
+        ),
+    ] = 100
+
+class StaticConfig(BaseModel):
+    """
+    Model for how responses and static files are sent to the browser. These are only read when the app starts
+    """
+
+    compress: Annotated[
+        bool,
+        Field(
+            description="Whether to compress responses with gzip for browsers that accept it. Disable this if a reverse proxy already compresses them."
+        ),
+    ] = True
+
+    compress_min_size: Annotated[
+        int,
+        Field(
+            description="Responses smaller than this many bytes are not compressed."
+        ),
+    ] = 1024
+
+    max_age: Annotated[
+        int,
+        Field(
+            description="Number of seconds that browsers may keep static files without checking for a newer version. Static URLs change whenever the file does, so this can be long."
+        ),
+    ] = 31536000
+
+    local_assets: Annotated[
+        Path | None,
+        Field(
+            description="If provided, the Bootstrap and Font Awesome stylesheets are served from this directory instead of a CDN, for sites without internet access. Create it using `python -m acledit.static <directory>` on a machine with internet access."
+        ),
+    ] = None
+
 class Config(BaseModel):
     """
     Model defining the top-level configuration options for the app
@@ -83,10 +275,106 @@ class Config(BaseModel):
 
     fs_mounts: Annotated[list[Path], Field(description="A list of paths for which ACLs will be considered to be enabled and supported")] = [Path("/")]
 
+    cache_ttl: Annotated[float, Field(description="Number of seconds for which directory listings and ACLs are reused between requests. Concurrent requests for the same directory always share one listing.")] = 5
+
+    page_size: Annotated[int, Field(description="Number of files shown on each page of the file browser. Searching, sorting and paging are done on the server, so large directories don't have to be sent to the browser.")] = 200
+
+    prewarm_ttl: Annotated[
+        float | None,
+        Field(
+            description="If set, `start_dir` and the shortcuts are listed in the background when the app starts, and the listings are kept for this many seconds so that they are ready when first opened."
+        ),
+    ] = None
+
+    shared_cache: Annotated[
+        str | None,
+        Field(
+            description='Path to a SQLite database used to share cached directory listings, ACLs, user lookups and the progress of background operations between worker processes, such as when running under gunicorn with several workers. This should be on a local disk, in a directory that is owned by the user running the app and that no other user can access, since the cached values are unpickled. Otherwise, each process keeps its own cache. The `{user}` and `{home}` placeholders can be used. If not set, each process has its own cache.'
+        ),
+        AfterValidator(lambda v: None if v is None else interpolate_start_dir(v)),
+    ] = None
+
+    throttle: Annotated[ThrottleConfig, Field(description="Rate limits for bulk ACL changes")] = ThrottleConfig()
+
+    static: Annotated[StaticConfig, Field(description="Compression and caching of responses, and where stylesheets are loaded from")] = StaticConfig()
+
+    memory_budget: Annotated[
+        float | None,
+        Field(
+            description="Approximate number of megabytes that recursive shares, revokes and the indexer may use to remember pending directories and distinct ACLs, however large the tree. If not set, a budget of roughly 30 MB is used."
+        ),
+    ] = None
+
+    templates: Annotated[dict[str, ShareTemplate], Field(description='Named sets of users and groups that files can be shared with in one step, from the share dialog or `acledit template`.')] = {}
+
+    index: Annotated[IndexConfig | None, Field(description='If provided, a background process indexes these directories so that the file browser can show who has access anywhere under the current directory.')] = None
+
+    profiling: Annotated[ProfilingConfig | None, Field(description='If provided, requests that present the token are profiled. This must be set when the app starts.')] = None
+
+    watch: Annotated[WatchConfig | None, Field(description='If provided, the directories open in the file browser are watched, and files that are added, removed or have their ACLs changed are updated in place without reloading the directory.')] = None
+
     def has_acls(self, path: Path) -> bool:
         "Returns True if the given path supports ACLs"
         return any(path.is_relative_to(mount) for mount in self.fs_mounts)
 
 
-with open("config.json", "rb") as f:
-    config = Config.model_validate(json.load(f))
+def config_path(path: str | Path | None = None) -> Path:
+    """
+    Locates the config file. This is `path` if provided, otherwise the path in the `ACLEDIT_CONFIG` environment variable,
+    otherwise `config.json` in the working directory.
+    """
+    if path is None:
+        path = os.environ.get(CONFIG_ENV, "config.json")
+    return Path(path).absolute()
+
+#: Each config file that has been read, with its modification time when it was read
+_loaded: dict[Path, tuple[int, Config]] = {}
+#: Recorded instead of the modification time when the file couldn't be read
+MISSING_MTIME = -1
+_lock = threading.Lock()
+
+def get_config(path: str | Path | None = None) -> Config:
+    """
+    Returns the parsed config. The file is only read again if it has been modified since it was last read,
+    so this is cheap enough to call on every request, and edits take effect without restarting the app.
+    If a modified file is invalid, or is briefly missing while it is replaced, the last valid config is kept.
+    Params:
+        path: Path to the config file. See `config_path` for the default
+    """
+    path = config_path(path)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        with _lock:
+            loaded = _loaded.get(path)
+            if loaded is None:
+                raise
+            if loaded[0] != MISSING_MTIME:
+                logger.exception(f"Failed to read {path}, so the previous config is still being used")
+                # Only logged once, and the file is read again once it exists
+                _loaded[path] = (MISSING_MTIME, loaded[1])
+            return loaded[1]
+    with _lock:
+        loaded = _loaded.get(path)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1]
+        try:
+            with open(path, "rb") as f:
+                config = Config.model_validate(json.load(f))
+        except (OSError, ValueError):
+            if loaded is None:
+                raise
+            logger.exception(f"Failed to reload {path}, so the previous config is still being used")
+            # Don't try again until the file changes
+            _loaded[path] = (mtime, loaded[1])
+            return loaded[1]
+        if loaded is not None:
+            logger.info(f"Reloaded {path}")
+        _loaded[path] = (mtime, config)
+        return config
+
+def __getattr__(name: str):
+    # `from acledit.config import config` still works, but the file is only read when it is first needed
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,157 @@
+"""
+Cached lookups of users and groups from the system directory, decoupled from GUI code
+"""
+from bisect import bisect_left
+from functools import lru_cache
+from typing import NamedTuple
+from acledit.cache import Cache
+import logging
+import pwd
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class UserRecord(NamedTuple):
+    """
+    A single user account, as shown in type-ahead suggestions
+    """
+    username: str
+    full_name: str
+
+def full_name(gecos: str) -> str:
+    """
+    Extracts the full name from a GECOS field, which may contain several comma separated fields
+    """
+    return gecos.split(",", 1)[0].strip()
+
+@lru_cache(maxsize=4096)
+def owner_name(uid: int) -> str:
+    """
+    Returns the username that owns files with this user ID, or the ID itself if it has no account
+    """
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+class UserIndex:
+    """
+    An in-memory prefix index over usernames and full names, used for username suggestions.
+    The index is a sorted array of lowercase search keys that is searched using bisection.
+    It is built from a snapshot of the user directory, and rebuilt in a background thread once the snapshot goes stale.
+    """
+    def __init__(self, max_age: float = 900, min_prefix: int = 2, cache_size: int = 1024, snapshot_cache: Cache[list[UserRecord]] | None = None):
+        """
+        Params:
+            max_age: Number of seconds after which the directory snapshot is refreshed
+            min_prefix: Queries shorter than this return no suggestions, since they would match most of the directory
+            cache_size: Number of recent query results to remember between rebuilds
+            snapshot_cache: If provided, directory snapshots are shared through this cache, so that other processes don't need to read the whole directory
+        """
+        self.max_age = max_age
+        self.snapshot_cache = snapshot_cache
+        self.min_prefix = min_prefix
+        self.cache_size = cache_size
+        #: Sorted search keys, the index into the records for each key, the records themselves, and recent results.
+        #: These are kept in one tuple so that a rebuild can swap them all at once
+        self._index: tuple[list[str], list[int], list[UserRecord], dict[tuple[str, int], list[UserRecord]]] = ([], [], [], {})
+        self._built_at: float | None = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @staticmethod
+    def _snapshot() -> list[UserRecord]:
+        """
+        Reads every account from the user directory
+        """
+        return [UserRecord(entry.pw_name, full_name(entry.pw_gecos)) for entry in pwd.getpwall()]
+
+    def build(self, records: list[UserRecord] | None = None) -> None:
+        """
+        Synchronously (re)build the index.
+        Params:
+            records: The accounts to index. If not provided, the user directory is read
+        """
+        if records is None:
+            if self.snapshot_cache is None:
+                records = self._snapshot()
+            else:
+                records = self.snapshot_cache.get_or_compute("users", self._snapshot)
+        records = sorted(set(records))
+        keyed: list[tuple[str, int]] = []
+        for i, record in enumerate(records):
+            keys = {record.username.lower()}
+            if record.full_name:
+                # Index the whole name as well as each word, so that surnames can be searched
+                name = record.full_name.lower()
+                keys.add(name)
+                keys.update(name.split())
+            keyed.extend((key, i) for key in keys)
+        keyed.sort()
+
+        self._index = ([key for key, _ in keyed], [i for _, i in keyed], records, {})
+        self._built_at = time.monotonic()
+        logger.info(f"Indexed {len(records)} users using {len(keyed)} search keys")
+
+    def refresh_async(self) -> None:
+        """
+        Rebuild the index in a background thread, unless a rebuild is already running
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.build()
+            except Exception:
+                logger.exception("Failed to build the user index")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=_run, name="user-index", daemon=True).start()
+
+    @property
+    def stale(self) -> bool:
+        """
+        True if the index has never been built or is older than `max_age`
+        """
+        return self._built_at is None or time.monotonic() - self._built_at > self.max_age
+
+    def search(self, query: str, limit: int = 10) -> list[UserRecord]:
+        """
+        Returns up to `limit` accounts whose username, full name, or any word of their full name starts with `query`.
+        If the index is stale, this returns results from the old snapshot and schedules a rebuild.
+        """
+        if self.stale:
+            self.refresh_async()
+
+        prefix = query.strip().lower()
+        if len(prefix) < self.min_prefix:
+            return []
+
+        keys, owners, records, cache = self._index
+        # Type-ahead sends one request per keystroke, so repeated prefixes are answered from memory
+        results = cache.get((prefix, limit))
+        if results is not None:
+            return results
+
+        results = []
+        seen: set[int] = set()
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and len(results) < limit and keys[i].startswith(prefix):
+            owner = owners[i]
+            if owner not in seen:
+                seen.add(owner)
+                results.append(records[owner])
+            i += 1
+
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[(prefix, limit)] = results
+        return results
+
+#: Shared index of all users in the directory
+user_index = UserIndex()
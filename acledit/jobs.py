@@ -0,0 +1,152 @@
+"""
+Runs long operations in background threads, so that callbacks can return immediately and poll for progress.
+If `job_store` is set to a shared cache, the progress and results of each job can be read by every worker process,
+not just the one running it
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+from acledit.cache import MISSING, Cache
+from uuid import uuid4
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Number of seconds that a finished job is kept for, so that the browser can collect its results
+JOB_EXPIRY = 600
+#: Minimum number of seconds between publishing the progress of a running job to `job_store`
+PUBLISH_INTERVAL = 0.25
+
+#: Where jobs are published for other worker processes, if there are any
+job_store: Cache[dict] | None = None
+
+class Job:
+    """
+    A background operation, which reports its progress as a list of JSON-compatible events
+    """
+    def __init__(self, kind: str = "", description: str = ""):
+        self.id = uuid4().hex
+        #: What sort of job this is, so that its progress can be displayed appropriately
+        self.kind = kind
+        self.description = description
+        self.events: list[Any] = []
+        #: The latest progress snapshot, for jobs that report progress as a whole rather than as events
+        self.progress: Any = None
+        self.done = False
+        #: Error message if the job raised an exception
+        self.error: str | None = None
+        #: The return value of the job function
+        self.result: Any = None
+        #: Set this to ask the job to stop early
+        self.cancelled = threading.Event()
+        self.finished_at: float | None = None
+        self._published = 0.0
+
+    def emit(self, event: Any):
+        """
+        Report some progress. `event` should be JSON compatible
+        """
+        self.events.append(event)
+        self.publish()
+
+    def snapshot(self) -> dict:
+        """
+        The state of the job, which can be pickled
+        """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "events": list(self.events),
+            # Copied, since the job may be updating it in another thread
+            "progress": dict(self.progress) if isinstance(self.progress, dict) else self.progress,
+            "done": self.done,
+            "error": self.error,
+            "result": self.result,
+            "finished_at": self.finished_at,
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot: dict) -> "Job":
+        """
+        A read-only copy of a job that is running, or ran, in another process
+        """
+        job = Job()
+        for key, value in snapshot.items():
+            setattr(job, key, value)
+        return job
+
+    def publish(self, force: bool = False) -> None:
+        """
+        Makes the job's progress visible to other worker processes, and picks up cancellation requests from them.
+        Call this after changing `progress`. This does nothing if there is no `job_store`
+        Params:
+            force: Publish even if the job was published very recently
+        """
+        if job_store is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._published < PUBLISH_INTERVAL:
+            return
+        self._published = now
+        job_store.set(self.id, self.snapshot(), ttl=JOB_EXPIRY)
+        if job_store.get(_cancel_key(self.id)) is not MISSING:
+            self.cancelled.set()
+
+_jobs: dict[str, Job] = {}
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="job")
+
+def _expire_jobs():
+    now = time.time()
+    for job_id, job in list(_jobs.items()):
+        if job.finished_at is not None and now - job.finished_at > JOB_EXPIRY:
+            _jobs.pop(job_id, None)
+
+def submit(fn: Callable[[Job], Any], kind: str = "", description: str = "") -> Job:
+    """
+    Run `fn` in the background. It receives the `Job`, so that it can report progress and check for cancellation
+    """
+    _expire_jobs()
+    job = Job(kind=kind, description=description)
+
+    def _run():
+        try:
+            job.result = fn(job)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.done = True
+            job.publish(force=True)
+
+    _jobs[job.id] = job
+    # Published before returning, so that the first poll finds it whichever worker it reaches
+    job.publish(force=True)
+    _executor.submit(_run)
+    return job
+
+def _cancel_key(job_id: str) -> str:
+    return f"cancel\0{job_id}"
+
+def get_job(job_id: str) -> Job | None:
+    """
+    Finds a job that was started in this process, or a copy of one published to `job_store` by another process
+    """
+    job = _jobs.get(job_id)
+    if job is None and job_store is not None:
+        snapshot = job_store.get(job_id)
+        if snapshot is not MISSING:
+            job = Job.from_snapshot(snapshot)
+    return job
+
+def cancel_job(job_id: str) -> None:
+    """
+    Asks a job to stop early, in whichever process it is running
+    """
+    job = _jobs.get(job_id)
+    if job is not None:
+        job.cancelled.set()
+    elif job_store is not None:
+        job_store.set(_cancel_key(job_id), True, ttl=JOB_EXPIRY)
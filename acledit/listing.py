@@ -0,0 +1,182 @@
+"""
+Directory listings for the file browser, decoupled from GUI code
+"""
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from pathlib import Path
+from typing import Iterable, Literal, NamedTuple, TypeAlias
+import re
+from acledit.identity import owner_name
+from acledit.xattr_acl import count_named_entries
+import os
+
+class FileRecord(NamedTuple):
+    """
+    The minimum the file browser needs to display a file, which can be read from the directory without a stat call per file
+    """
+    path: str
+    name: str
+    #: True if this is a directory, or a symlink to one
+    is_dir: bool
+
+    @staticmethod
+    def from_path(path: Path) -> "FileRecord":
+        """
+        Creates a record for a single path, such as a shortcut
+        """
+        return FileRecord(path=str(path), name=path.name, is_dir=path.is_dir())
+
+class FileDetails(NamedTuple):
+    """
+    Metadata about a file that needs a stat call, which is loaded after the listing has been displayed
+    """
+    #: Username of the owner of the file itself, not the target of a symlink
+    owner: str
+    mtime: float
+    size: int
+    #: Number of named users and groups in the file's ACL, or None if it has no extended ACL
+    shares: int | None
+
+def file_details(path: str) -> FileDetails:
+    """
+    Reads the metadata of a single file
+    """
+    # We specifically don't care about the target of the symlink in this case
+    st = os.stat(path, follow_symlinks=False)
+    try:
+        shares = count_named_entries(path)
+    except OSError:
+        # For example, a dangling symlink
+        shares = None
+    return FileDetails(owner=owner_name(st.st_uid), mtime=st.st_mtime, size=st.st_size, shares=shares)
+
+def read_details(paths: list[str], workers: int = 8) -> list[FileDetails | None]:
+    """
+    Reads the metadata of several files in parallel, since each stat can be a round trip to a network filesystem.
+    Files that can no longer be read, for example because they were deleted since being listed, are None
+    """
+    def read(path: str) -> FileDetails | None:
+        try:
+            return file_details(path)
+        except OSError:
+            return None
+
+    if len(paths) <= 1:
+        return [read(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(read, paths))
+
+SORT_KEY: TypeAlias = Literal["name", "mtime", "size", "owner"]
+
+class Listing:
+    """
+    The files in a directory, sorted by filename, with precomputed keys for searching and sorting
+    """
+    def __init__(self, records: list[FileRecord]):
+        self.records = records
+        #: Lowercase filenames, in the same order as `records`, for case-insensitive search
+        self.search_keys = [record.name.lower() for record in records]
+        #: The details of each file, in the same order as `records`, once they have been read
+        self._details: list[FileDetails | None] | None = None
+        #: The indices of `records` in order of each sort key and direction
+        self._orders: dict[tuple[SORT_KEY, bool], list[int]] = {
+            ("name", False): list(range(len(records))),
+            ("name", True): list(reversed(range(len(records)))),
+        }
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def details(self) -> list[FileDetails | None]:
+        """
+        Reads the details of every file. This is only needed to sort by something other than the filename
+        """
+        if self._details is None:
+            self._details = read_details([record.path for record in self.records])
+        return self._details
+
+    def order(self, sort: SORT_KEY, descending: bool = False) -> list[int]:
+        """
+        Returns the indices of `records` sorted by `sort`, then by filename
+        """
+        order = self._orders.get((sort, descending))
+        if order is None:
+            details = self.details()
+            if sort == "owner":
+                keys = [detail.owner if detail is not None else "" for detail in details]
+            else:
+                keys = [getattr(detail, sort) if detail is not None else 0 for detail in details]
+            # The sort is stable and the records are already sorted by filename, so ties stay in filename order
+            order = sorted(range(len(self.records)), key=keys.__getitem__, reverse=descending)
+            self._orders[(sort, descending)] = order
+        return order
+
+    def matches(self, search: str) -> list[bool] | None:
+        """
+        Returns which files match the search, or None if every file matches.
+        The search is a case-insensitive substring, or a glob pattern if it contains any of `*?[`
+        """
+        search = search.strip().lower()
+        if not search:
+            return None
+        if any(char in search for char in "*?["):
+            match = re.compile(translate(search)).match
+            return [match(key) is not None for key in self.search_keys]
+        return [search in key for key in self.search_keys]
+
+    def query(self, search: str = "", sort: SORT_KEY = "name", descending: bool = False, page: int = 0, page_size: int = 200) -> tuple[list[FileRecord], int]:
+        """
+        Searches, sorts and pages the listing
+        Params:
+            page: Zero-based page number
+        Returns:
+            The records on the requested page, and the total number of records that match the search
+        """
+        order = self.order(sort, descending)
+        matches = self.matches(search)
+        if matches is not None:
+            order = [i for i in order if matches[i]]
+        start = page * page_size
+        return [self.records[i] for i in order[start:start + page_size]], len(order)
+
+    def updated(self, dir: str, names: Iterable[str]) -> "Listing":
+        """
+        Returns a copy of this listing with some files re-read, which is much cheaper than listing the directory again.
+        Each name is added if it now exists, removed if it doesn't, and has its details re-read if they have already been read
+        Params:
+            dir: The directory that this is a listing of
+            names: Filenames that have been created, deleted or changed since this listing was made
+        """
+        names = set(names)
+        details = self._details if self._details is not None else [None] * len(self.records)
+        kept = [(record, detail) for record, detail in zip(self.records, details) if record.name not in names]
+        fresh = []
+        for name in sorted(names):
+            path = os.path.join(dir, name)
+            if os.path.lexists(path):
+                fresh.append(FileRecord(path=path, name=name, is_dir=os.path.isdir(path)))
+        fresh_details = read_details([record.path for record in fresh]) if self._details is not None else [None] * len(fresh)
+        # Both parts are already sorted by filename, so this is close to linear
+        merged = sorted([*kept, *zip(fresh, fresh_details)], key=lambda item: item[0].name)
+        listing = Listing([record for record, _ in merged])
+        if self._details is not None:
+            listing._details = [detail for _, detail in merged]
+        return listing
+
+def list_directory(dir: str) -> Listing:
+    """
+    Lists a directory
+    """
+    records = []
+    with os.scandir(dir) as it:
+        for entry in it:
+            # On most filesystems, the directory entry says whether it is a directory, so this only needs a stat call for symlinks
+            records.append(FileRecord(path=entry.path, name=entry.name, is_dir=entry.is_dir()))
+    records.sort(key=lambda record: record.name)
+    return Listing(records)
+
+def listing_key(dir: str) -> str:
+    """
+    A cache key for the listing of `dir`. This changes whenever files are added, removed or renamed in it
+    """
+    return f"listing\0{dir}\0{os.stat(dir).st_mtime_ns}"
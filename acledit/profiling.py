@@ -0,0 +1,230 @@
+"""
+Profiles individual requests to the Flask server on demand, so that slow requests can be diagnosed in production
+with the real user's identity, filesystems and NSS configuration. This doesn't depend on Dash
+"""
+from collections import Counter
+from pathlib import Path
+from typing import Literal
+from flask import Flask, Response, g, request
+from pydantic import BaseModel
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Header that requests a profile of a single request
+PROFILE_HEADER = "X-Acledit-Profile"
+#: Query parameter that requests a profile of this request, and of the following requests from the same browser
+PROFILE_PARAM = "profile"
+PROFILE_COOKIE = "acledit_profile"
+
+CATEGORY = Literal["acledit", "dash", "syscalls", "other"]
+
+#: Modules whose time counts as Dash's, including the web server and JSON serialisation of the component tree
+_FRAMEWORK = re.compile(r"[/\\](dash|dash_bootstrap_components|plotly|_plotly_utils|flask|werkzeug|json)[/\\]")
+#: Built-in functions that are thin wrappers around system calls, including NSS lookups
+_SYSCALL = re.compile(r"built-in method (posix|_?io|_?pwd|grp|_socket|select|_?fcntl|_?sqlite3)\.|method '(read|write|readinto|flush|close)' of '_io\.")
+
+def categorise(filename: str, function: str) -> CATEGORY:
+    """
+    Attributes a profiled function to acledit itself, Dash, system calls, or anything else such as pydantic
+    """
+    if filename == "~":
+        # cProfile records built-in functions without a file
+        return "syscalls" if _SYSCALL.search(function) else "other"
+    if re.search(r"[/\\]acledit[/\\]", filename):
+        return "acledit"
+    if _FRAMEWORK.search(filename):
+        return "dash"
+    return "other"
+
+class FunctionTime(BaseModel):
+    """
+    Time spent in one profiled function
+    """
+    function: str
+    category: CATEGORY
+    calls: int
+    #: Seconds spent in the function itself, excluding the functions it called
+    own_seconds: float
+    #: Seconds spent in the function and everything it called
+    total_seconds: float
+
+class ProfileSummary(BaseModel):
+    """
+    Where the time of one profiled request went
+    """
+    path: str
+    #: The outputs of the callback, for Dash callback requests
+    callback: str | None = None
+    status: int
+    seconds: float
+    #: Seconds of each category, excluding time spent in functions of other categories
+    categories: dict[CATEGORY, float]
+    #: The functions that took the most time themselves
+    top_functions: list[FunctionTime]
+    #: File name of the full profile, which can be loaded with `pstats`
+    profile: str
+
+def summarise(stats: pstats.Stats, top: int = 25) -> tuple[dict[CATEGORY, float], list[FunctionTime]]:
+    """
+    Totals the time of each category, and finds the functions that took the most time themselves
+    """
+    categories: Counter[CATEGORY] = Counter({category: 0.0 for category in ["acledit", "dash", "syscalls", "other"]})
+    functions = []
+    for (filename, line, name), (_primitive, calls, own, total, _callers) in stats.stats.items():
+        category = categorise(filename, name)
+        categories[category] += own
+        functions.append(FunctionTime(
+            function=name if filename == "~" else f"{filename}:{line}({name})",
+            category=category,
+            calls=calls,
+            own_seconds=own,
+            total_seconds=total,
+        ))
+    functions.sort(key=lambda function: function.own_seconds, reverse=True)
+    return dict(categories), functions[:top]
+
+class RequestProfiler:
+    """
+    Profiles requests that carry the secret token in the `X-Acledit-Profile` header, the `profile` query parameter,
+    or the cookie that the query parameter sets. Each profile is saved as a pstats file with a JSON summary next to it.
+    Only one request is profiled at a time, since Python only allows one active profiler.
+    """
+    def __init__(self, directory: Path, token: str, cookie_seconds: float = 300, keep: int = 100):
+        """
+        Params:
+            directory: Where to save the profiles. This should be on a local disk, and only readable by the user running the app
+            token: Secret that a request must present to be profiled
+            cookie_seconds: How long a browser keeps being profiled after loading a page with the query parameter
+            keep: Maximum number of profiles to keep. The oldest are deleted first
+        """
+        self.directory = directory
+        self.token = token
+        self.cookie_seconds = cookie_seconds
+        self.keep = keep
+        self._active = threading.Lock()
+
+    def install(self, server: Flask) -> None:
+        """
+        Registers the profiler with a Flask server
+        """
+        server.before_request(self._start)
+        server.after_request(self._finish)
+        # Stop the profiler even if the request fails, so that the next request can be profiled
+        server.teardown_request(self._abandon)
+
+    def _requested(self) -> str | None:
+        """
+        Returns how this request asked to be profiled, if it presented the right token
+        """
+        for source, value in [
+            ("header", request.headers.get(PROFILE_HEADER)),
+            ("query", request.args.get(PROFILE_PARAM)),
+            ("cookie", request.cookies.get(PROFILE_COOKIE)),
+        ]:
+            if value is not None and hmac.compare_digest(value.encode(), self.token.encode()):
+                return source
+        return None
+
+    def _start(self) -> None:
+        source = self._requested()
+        if source is None:
+            return
+        if not self._active.acquire(blocking=False):
+            logger.info(f"Not profiling {request.path}, because another request is being profiled")
+            return
+        g.profile_source = source
+        g.profile_start = time.perf_counter()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _stop(self) -> cProfile.Profile | None:
+        profiler: cProfile.Profile | None = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self._active.release()
+        return profiler
+
+    def _abandon(self, _error: BaseException | None) -> None:
+        self._stop()
+
+    def _finish(self, response: Response) -> Response:
+        # Dash serialises the callback's output before this runs, so that time is included
+        profiler = self._stop()
+        if profiler is None:
+            return response
+        seconds = time.perf_counter() - g.profile_start
+        try:
+            name = self._save(profiler, response, seconds)
+            response.headers[PROFILE_HEADER] = name
+        except OSError:
+            logger.exception("Failed to save a request profile")
+        if g.profile_source == "query":
+            response.set_cookie(PROFILE_COOKIE, self.token, max_age=int(self.cookie_seconds), httponly=True, samesite="Strict")
+        return response
+
+    def _save(self, profiler: cProfile.Profile, response: Response, seconds: float) -> str:
+        """
+        Writes the profile and its summary, and returns the profile's file name
+        """
+        callback = None
+        if request.is_json:
+            # Dash callbacks post the IDs of their outputs
+            callback = (request.get_json(silent=True) or {}).get("output")
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", callback or request.path).strip("-")[:60] or "index"
+        now = time.time()
+        # Milliseconds, so that callbacks fired together get separate files
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03}-{os.getpid()}-{slug}.prof"
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        profiler.dump_stats(self.directory / name)
+
+        categories, top_functions = summarise(pstats.Stats(profiler))
+        summary = ProfileSummary(
+            path=request.full_path,
+            callback=callback,
+            status=response.status_code,
+            seconds=seconds,
+            categories=categories,
+            top_functions=top_functions,
+            profile=name,
+        )
+        (self.directory / name).with_suffix(".json").write_text(summary.model_dump_json(indent=2))
+        logger.info(f"Profiled {callback or request.path} in {seconds:.3f} seconds: " + ", ".join(f"{category} {time:.3f}s" for category, time in categories.items()))
+        self._prune()
+        return name
+
+    def _prune(self) -> None:
+        """
+        Deletes the oldest profiles beyond `keep`
+        """
+        profiles = sorted(self.directory.glob("*.prof"), key=lambda path: path.stat().st_mtime)
+        for profile in profiles[:max(0, len(profiles) - self.keep)]:
+            profile.unlink(missing_ok=True)
+            profile.with_suffix(".json").unlink(missing_ok=True)
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Prints the summary of a saved profile, or re-summarises a pstats file
+    """
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Summarises a profile saved by the request profiler")
+    parser.add_argument("profile", type=Path, help="A .prof file")
+    parser.add_argument("--top", type=int, default=25, help="Number of functions to show")
+    args = parser.parse_args(argv)
+    categories, top_functions = summarise(pstats.Stats(str(args.profile)), top=args.top)
+    total = sum(categories.values()) or 1
+    for category, seconds in categories.items():
+        print(f"{category:<10} {seconds:8.3f} s  {seconds / total:6.1%}")
+    print()
+    for function in top_functions:
+        print(f"{function.own_seconds:8.3f} s  {function.calls:>8} calls  {function.category:<9} {function.function}")
+
+if __name__ == "__main__":
+    main()
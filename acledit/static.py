@@ -0,0 +1,168 @@
+"""
+Makes the app cheaper to load over slow links: responses are compressed, browsers keep versioned static files,
+and the stylesheets that would otherwise come from a CDN can be served by the app itself, for sites without internet access.
+This doesn't depend on Dash
+"""
+from pathlib import Path
+from flask import Flask, Response, request, send_from_directory
+from acledit.cache import MISSING, MemoryCache
+import gzip
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+#: Content types that are worth compressing. Images other than icons, and fonts, are already compressed
+COMPRESSIBLE = re.compile(r"^(text/|application/(json|javascript|x-javascript)|image/(svg\+xml|x-icon|vnd\.microsoft\.icon))")
+#: Query parameters that Dash and this module add to static URLs, which change whenever the file does
+VERSION_PARAMS = {"m", "v"}
+#: Number of compressed static files to keep in memory
+STATIC_CACHE_SIZE = 64
+#: URL path under which local assets are served
+LOCAL_ASSETS_PATH = "vendor"
+#: Where each local stylesheet is saved within the directory. Font Awesome's stylesheet refers to its fonts as ../webfonts
+STYLESHEETS = ["bootstrap.min.css", "css/all.css"]
+
+class ResponseOptimizer:
+    """
+    Compresses responses for browsers that accept gzip, and lets browsers cache static files whose URL includes a version.
+    Dash sends the whole component tree of each callback's outputs as JSON, and that is very repetitive,
+    so compressing callback responses saves far more than compressing the static files.
+    """
+    def __init__(self, static_paths: list[str], min_size: int = 1024, level: int = 6, max_age: int = 31536000, compress: bool = True):
+        """
+        Params:
+            static_paths: URL path prefixes of static files, which can be cached when their URL includes a version
+            min_size: Responses smaller than this many bytes aren't compressed, since it wouldn't save a round trip
+            level: gzip compression level, from 1 (fastest) to 9 (smallest)
+            max_age: Number of seconds that browsers may keep versioned static files without asking again
+            compress: Whether to compress responses at all, for example if a reverse proxy already does
+        """
+        self.static_paths = tuple(static_paths)
+        self.min_size = min_size
+        self.level = level
+        self.max_age = max_age
+        self.compress = compress
+        #: Each static file and its compressed form by URL path, since they are the same for every request.
+        #: The query string isn't part of the key, because anyone can add to it
+        self._static: MemoryCache[tuple[bytes, bytes]] = MemoryCache(ttl=float("inf"), max_size=STATIC_CACHE_SIZE)
+
+    def install(self, server: Flask) -> None:
+        """
+        Registers the optimizer with a Flask server
+        """
+        server.after_request(self._finish)
+
+    def _finish(self, response: Response) -> Response:
+        static = request.path.startswith(self.static_paths)
+        if static and response.status_code == 200 and VERSION_PARAMS & request.args.keys():
+            # The URL changes whenever the file does, so the browser never needs to check for a newer one
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        if self.compress:
+            self._compress(response, static)
+        return response
+
+    def _compress(self, response: Response, static: bool) -> None:
+        if not COMPRESSIBLE.match(response.mimetype or ""):
+            return
+        response.vary.add("Accept-Encoding")
+        if (
+            response.status_code != 200
+            or "gzip" not in request.accept_encodings
+            or "Content-Encoding" in response.headers
+            or "Content-Range" in response.headers
+            or (response.is_streamed and not response.direct_passthrough)
+        ):
+            return
+        # Static files are sent as open files, which are small enough to read
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return
+        if static:
+            cached = self._static.get(request.path)
+            if cached is not MISSING and cached[0] == data:
+                compressed = cached[1]
+            else:
+                # Also replaces the cached file when it has changed
+                compressed = gzip.compress(data, compresslevel=self.level)
+                self._static.set(request.path, (data, compressed))
+        else:
+            compressed = gzip.compress(data, compresslevel=self.level)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = "gzip"
+        etag, weak = response.get_etag()
+        if etag is not None:
+            # The compressed file is a different representation, so it mustn't share the original's tag.
+            # The original's tag was checked before it was compressed, so check the new one
+            response.set_etag(f"{etag}-gzip", weak=weak)
+            response.make_conditional(request)
+
+def local_assets(directory: Path, url_prefix: str) -> list[str]:
+    """
+    Returns the URLs of the stylesheets in a directory created by `download_assets`, with a version that changes whenever they do
+    Params:
+        url_prefix: The prefix at which the browser reaches the app
+    Raises:
+        Exception: If the directory doesn't have the stylesheets
+    """
+    urls = []
+    for name in STYLESHEETS:
+        path = directory / name
+        if not path.is_file():
+            raise Exception(f"{path} does not exist. Run `python -m acledit.static {directory}` on a machine with internet access, and copy the directory here.")
+        urls.append(f"{url_prefix}{LOCAL_ASSETS_PATH}/{name}?v={path.stat().st_mtime_ns}")
+    return urls
+
+def serve_local_assets(server: Flask, directory: Path, route_prefix: str) -> None:
+    """
+    Serves the files in a directory created by `download_assets`
+    Params:
+        route_prefix: The prefix of the app's routes, which may differ from the URL prefix behind a proxy
+    """
+    def send(filename: str) -> Response:
+        return send_from_directory(directory, filename)
+
+    server.add_url_rule(f"{route_prefix}{LOCAL_ASSETS_PATH}/<path:filename>", "local_assets", send)
+
+def download_assets(directory: Path, urls: list[str]) -> None:
+    """
+    Downloads stylesheets, and the fonts that they use, so that they can be served locally
+    Params:
+        urls: The stylesheet to save as each of `STYLESHEETS`
+    """
+    from urllib.parse import urljoin
+    from urllib.request import urlopen
+
+    for name, url in zip(STYLESHEETS, urls):
+        with urlopen(url) as response:
+            css = response.read()
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(css)
+        logger.info(f"Downloaded {url} to {path}")
+        for reference in dict.fromkeys(re.findall(rb"url\(['\"]?(\.\./[^'\")?#]+)", css)):
+            reference = reference.decode()
+            font = (path.parent / reference).resolve()
+            font.parent.mkdir(parents=True, exist_ok=True)
+            with urlopen(urljoin(url, reference)) as response:
+                font.write_bytes(response.read())
+            logger.info(f"Downloaded {reference} to {font}")
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Downloads the stylesheets that the app normally loads from a CDN
+    """
+    from argparse import ArgumentParser
+    import dash_bootstrap_components as dbc
+    parser = ArgumentParser(description="Downloads the stylesheets and fonts used by the app, for the local_assets option of sites without internet access")
+    parser.add_argument("directory", type=Path)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    download_assets(args.directory, [dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME])
+
+if __name__ == "__main__":
+    main()
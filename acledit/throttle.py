@@ -0,0 +1,228 @@
+"""
+Rate limiting for bulk ACL changes, so that large operations don't overload shared filesystem metadata servers
+"""
+from pathlib import Path
+from pydantic import BaseModel
+import fcntl
+import logging
+import math
+import os
+import stat
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    A thread-safe token bucket, shared by all operations in this process
+    """
+    def __init__(self, rate: float, burst: float | None = None):
+        """
+        Params:
+            rate: Number of operations allowed per second
+            burst: Maximum number of operations that can happen at once after a quiet period. Defaults to one second's worth
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: float, now: float, n: float) -> tuple[float, float]:
+        """
+        Refills and takes `n` tokens from a bucket with `tokens` tokens in it.
+        Returns the new number of tokens, which may be negative, and the time to wait before proceeding.
+        The shared state file can be written by anyone, so the state is clamped to what a working bucket could hold,
+        and the wait is at most the time to refill a full burst plus `n`
+        """
+        if math.isnan(tokens):
+            tokens = 0.0
+        elapsed = now - self._updated
+        if not elapsed > 0:
+            # A time in the future, or NaN, would otherwise stop the bucket from refilling
+            elapsed = 0.0
+        tokens = min(self.burst, max(-self.burst, tokens) + elapsed * self.rate) - n
+        return tokens, min(max(0.0, -tokens / self.rate), (self.burst + n) / self.rate)
+
+    def acquire(self, n: float = 1) -> float:
+        """
+        Blocks until `n` operations are allowed. Returns the number of seconds spent waiting
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens, wait = self._take(self._tokens, now, n)
+            self._updated = now
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A token bucket whose state is kept in a small file, so that it is shared by every process on the host that uses the same file.
+    Since any local user can write to the file, its contents are clamped, and if another process holds the lock for too long,
+    or the file can no longer be used, the bucket falls back to limiting this process alone.
+    """
+    STATE = struct.Struct("<dd")
+    #: Number of seconds to wait for another process to release the state file
+    LOCK_TIMEOUT = 1.0
+    #: Number of seconds to limit only this process after the state file couldn't be used
+    RETRY_INTERVAL = 60.0
+
+    def __init__(self, rate: float, state_file: Path, burst: float | None = None):
+        """
+        Raises:
+            OSError: If the state file can't be opened, or isn't safe to use.
+                For example, it is a symlink, or it belongs to another user on a system with `fs.protected_regular`
+        """
+        super().__init__(rate, burst)
+        self.state_file = state_file
+        # O_NOFOLLOW stops a planted symlink from redirecting the writes to one of this user's own files
+        fd = os.open(state_file, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW | os.O_CLOEXEC, 0o666)
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode) or st.st_nlink != 1:
+                raise OSError(f"{state_file} is not a regular file with a single link")
+            if st.st_uid == os.getuid():
+                # Other users' processes need to be able to share the bucket
+                os.fchmod(fd, 0o666)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._local = TokenBucket(rate, burst)
+        #: Until this monotonic time, the state file isn't used
+        self._bypass_until = 0.0
+
+    def _lock_file(self) -> bool:
+        """
+        Locks the state file, giving up after `LOCK_TIMEOUT` seconds so that another user can't hold up this one's operations
+        """
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+
+    def _take_shared(self, n: float) -> float | None:
+        """
+        Takes `n` tokens from the state file.
+        Returns the time to wait before proceeding, or None if the file can't be used right now
+        """
+        try:
+            if not self._lock_file():
+                logger.warning(f"Another process has held {self.state_file} for more than {self.LOCK_TIMEOUT} seconds, so only this process is limited for now")
+                self._bypass_until = time.monotonic() + self.RETRY_INTERVAL
+                return None
+            try:
+                # The wall clock is used because the monotonic clock isn't comparable between processes
+                now = time.time()
+                data = os.pread(self._fd, self.STATE.size, 0)
+                if len(data) == self.STATE.size:
+                    tokens, self._updated = self.STATE.unpack(data)
+                else:
+                    tokens, self._updated = self.burst, now
+                tokens, wait = self._take(tokens, now, n)
+                os.pwrite(self._fd, self.STATE.pack(tokens, now), 0)
+                return wait
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        except OSError as e:
+            logger.warning(f"Failed to use the shared rate limit in {self.state_file}, so only this process is limited for now: {e}")
+            self._bypass_until = time.monotonic() + self.RETRY_INTERVAL
+            return None
+
+    def acquire(self, n: float = 1) -> float:
+        with self._lock:
+            wait = self._take_shared(n) if time.monotonic() >= self._bypass_until else None
+        if wait is None:
+            return self._local.acquire(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class ThrottleStats(BaseModel):
+    """
+    Statistics about the throttling of the operations in this process
+    """
+    #: Number of operations that have been throttled
+    ops: int = 0
+    #: Total number of seconds spent waiting for the rate limits or for backoff
+    waited: float = 0
+    #: Exponentially weighted average number of seconds per write
+    latency: float = 0
+    #: Fraction of the normal throughput currently allowed by adaptive backoff
+    backoff: float = 1
+
+class Throttle:
+    """
+    Limits bulk operations according to per-process and per-host rates,
+    and backs off when the filesystem's write latency rises.
+    The per-process rate is what the config calls the per-user rate, which is per worker process when the app has several.
+    """
+    def __init__(
+        self,
+        user_rate: float | None = None,
+        host_rate: float | None = None,
+        host_state_file: Path | None = None,
+        latency_threshold: float | None = None,
+    ):
+        """
+        Params:
+            user_rate: Maximum operations per second for this process, or None for no limit
+            host_rate: Maximum operations per second across every process using `host_state_file`, or None for no limit
+            latency_threshold: If the average write latency in seconds rises above this, throughput is reduced until it recovers
+        """
+        self.buckets: list[TokenBucket] = []
+        if user_rate is not None:
+            self.buckets.append(TokenBucket(user_rate))
+        if host_rate is not None and host_state_file is not None:
+            try:
+                self.buckets.append(SharedTokenBucket(host_rate, host_state_file))
+            except OSError as e:
+                # Rate limiting mustn't stop the operation itself
+                logger.warning(f"Failed to use the shared rate limit in {host_state_file}, so only this process is limited: {e}")
+                self.buckets.append(TokenBucket(host_rate))
+        self.latency_threshold = latency_threshold
+        self.stats = ThrottleStats()
+        self._adjusted = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Call this before each operation. Blocks until the operation is allowed
+        """
+        waited = sum(bucket.acquire() for bucket in self.buckets)
+        backoff = self.stats.backoff
+        if backoff < 1:
+            # Space out operations so that the filesystem is only busy for `backoff` of the time
+            delay = self.stats.latency * (1 / backoff - 1)
+            time.sleep(delay)
+            waited += delay
+        with self._lock:
+            self.stats.ops += 1
+            self.stats.waited += waited
+
+    def record(self, latency: float):
+        """
+        Call this after each operation with the number of seconds it took
+        """
+        with self._lock:
+            stats = self.stats
+            stats.latency = latency if stats.ops <= 1 else 0.9 * stats.latency + 0.1 * latency
+            if self.latency_threshold is None:
+                return
+            now = time.monotonic()
+            # Adjust at most once per second, so that each change has time to take effect
+            if now - self._adjusted < 1:
+                return
+            self._adjusted = now
+            if stats.latency > self.latency_threshold:
+                stats.backoff = max(0.05, stats.backoff / 2)
+            elif stats.latency < self.latency_threshold / 2:
+                stats.backoff = min(1.0, stats.backoff + 0.1)
@@ -0,0 +1,442 @@
+"""
+Watches the directories open in the file browser for changes, so that their listings can be updated incrementally
+instead of being re-read. This doesn't depend on Dash or the app config
+"""
+from abc import ABC, abstractmethod
+from typing import Callable, Literal, NamedTuple
+from acledit.listing import Listing
+import ctypes
+import ctypes.util
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Change(NamedTuple):
+    """
+    Something that happened to one file in a watched directory
+    """
+    kind: Literal["add", "remove", "change"]
+    #: Filename within the directory
+    name: str
+
+class _WatchedDir:
+    """
+    What the watcher knows about one directory
+    """
+    def __init__(self, version: int):
+        #: Increases by one for each recorded change
+        self.version = version
+        #: Every change with a version after this one is in `log`. Older versions can't be caught up from
+        self.base = version
+        self.log: list[tuple[int, Change]] = []
+        self.last_used = time.monotonic()
+        #: The most recent listing of this directory, and the version it is up to date with
+        self.listing: Listing | None = None
+        self.listing_version = 0
+        #: The modification time of the directory when the listing was made
+        self.listing_mtime = 0
+        #: Held while listing the directory, so that concurrent requests share one listing
+        self.listing_lock = threading.Lock()
+
+class Watcher(ABC):
+    """
+    Base class that records changes to a bounded number of recently viewed directories.
+    Versions are returned as opaque strings that only this watcher understands,
+    so a version from another process or a previous run is never mistaken for one of ours.
+    """
+    def __init__(self, max_dirs: int = 64, idle_timeout: float = 300, max_log: int = 1024):
+        """
+        Params:
+            max_dirs: Maximum number of directories to watch at once. The least recently viewed directory is dropped when this is exceeded
+            idle_timeout: Number of seconds after which a directory that nobody has viewed is no longer watched
+            max_log: Maximum number of changes to remember per directory. Clients that fall further behind reload the whole page
+        """
+        self.max_dirs = max_dirs
+        self.idle_timeout = idle_timeout
+        self.max_log = max_log
+        self._token = secrets.token_hex(4)
+        self._dirs: dict[str, _WatchedDir] = {}
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+
+    def _start(self) -> None:
+        """
+        Starts watching in the background. This is called again in a forked worker process, since threads don't survive a fork
+        """
+
+    @abstractmethod
+    def _add(self, dir: str) -> bool:
+        """
+        Starts watching one directory. This is called without holding `_lock`, and is called while the user waits for
+        the directory to be shown, so it shouldn't read the directory
+        Returns:
+            False if the directory can't be watched
+        """
+
+    @abstractmethod
+    def _remove(self, dir: str) -> None:
+        """
+        Stops watching one directory. The caller holds `_lock`
+        """
+
+    def _version_token(self, version: int) -> str:
+        return f"{self._token}:{version}"
+
+    def watch(self, dir: str) -> str | None:
+        """
+        Starts watching `dir` if it isn't already, and marks it as recently viewed
+        Returns:
+            The current version of the directory, to pass to `changes`, or None if it can't be watched
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forget anything inherited from the parent process, whose watches and threads don't exist here
+                self._pid = os.getpid()
+                self._token = secrets.token_hex(4)
+                self._dirs.clear()
+                self._start()
+            state = self._dirs.get(dir)
+            if state is not None:
+                state.last_used = time.monotonic()
+                return self._version_token(state.version)
+        # Starting to watch makes a system call, which shouldn't hold up requests for other directories
+        if not self._add(dir):
+            return None
+        with self._lock:
+            state = self._dirs.get(dir)
+            if state is None:
+                state = self._dirs[dir] = _WatchedDir(version=0)
+                self._evict()
+            state.last_used = time.monotonic()
+            return self._version_token(state.version)
+
+    def _evict(self) -> None:
+        """
+        Stops watching directories that haven't been viewed recently. The caller must hold `_lock`
+        """
+        now = time.monotonic()
+        by_age = sorted(self._dirs, key=lambda dir: self._dirs[dir].last_used)
+        for i, dir in enumerate(by_age):
+            if len(self._dirs) - i > self.max_dirs or now - self._dirs[dir].last_used > self.idle_timeout:
+                self._remove(dir)
+                del self._dirs[dir]
+
+    def _record(self, dir: str, changes: list[Change]) -> None:
+        """
+        Called by subclasses when files in a watched directory change
+        """
+        with self._lock:
+            state = self._dirs.get(dir)
+            if state is None:
+                return
+            for change in changes:
+                state.version += 1
+                state.log.append((state.version, change))
+            if len(state.log) > self.max_log:
+                dropped = len(state.log) - self.max_log // 2
+                state.base = state.log[dropped - 1][0]
+                del state.log[:dropped]
+
+    def _lost(self, dir: str | None = None) -> None:
+        """
+        Called by subclasses when changes to `dir`, or every directory if it is None, may have been missed.
+        Anyone who was following the directory has to re-read it
+        """
+        with self._lock:
+            for key, state in self._dirs.items():
+                if dir is None or key == dir:
+                    state.version += 1
+                    state.base = state.version
+                    state.log.clear()
+                    state.listing = None
+
+    def changes(self, dir: str, since: str | None) -> tuple[str, list[Change]] | None:
+        """
+        Returns the changes to `dir` after version `since`, and the current version.
+        Returns None if they aren't known, for example because `dir` isn't being watched by this process,
+        in which case the caller should re-read the directory
+        """
+        with self._lock:
+            state = self._dirs.get(dir)
+            token, _, version = (since or "").partition(":")
+            if state is None or token != self._token or not version.isdigit() or int(version) < state.base:
+                return None
+            state.last_used = time.monotonic()
+            return self._version_token(state.version), [change for v, change in state.log if v > int(version)]
+
+    def listing(self, dir: str, load: Callable[[], Listing]) -> Listing:
+        """
+        Returns an up to date listing of `dir`, which is kept current by applying changes to the last listing.
+        If the directory has been modified without the watcher seeing any changes, for example by another host of a
+        network filesystem, it is listed again
+        Params:
+            load: Lists the directory from scratch, if there is no listing that can be updated
+        """
+        self.watch(dir)
+        with self._lock:
+            state = self._dirs.get(dir)
+        if state is None:
+            # The directory can't be watched, or was evicted straight away, which only happens if max_dirs is 0
+            return load()
+        with state.listing_lock:
+            # Taken before listing, so that a change made while listing is noticed next time
+            mtime = os.stat(dir).st_mtime_ns
+            with self._lock:
+                listing, since, version = state.listing, state.listing_version, state.version
+                if since < state.base:
+                    # Some of the changes since the listing was made have been forgotten
+                    listing = None
+                names = {change.name for v, change in state.log if v > since}
+            if listing is not None and not names and mtime != state.listing_mtime:
+                # Files were added or removed without the watcher seeing it
+                listing = None
+            if listing is None:
+                # Changes made while listing are applied again next time, which is harmless
+                listing = load()
+            elif names:
+                listing = listing.updated(dir, names)
+            with self._lock:
+                # The listing is only kept if nothing was lost in the meantime
+                if state.base <= version:
+                    state.listing, state.listing_version, state.listing_mtime = listing, version, mtime
+            return listing
+
+    def close(self) -> None:
+        """
+        Stops watching every directory
+        """
+        with self._lock:
+            for dir in list(self._dirs):
+                self._remove(dir)
+            self._dirs.clear()
+
+# Constants from <sys/inotify.h>
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_EXCL_UNLINK = 0x4000000
+
+_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher(Watcher):
+    """
+    Watches directories using Linux's inotify, so changes are seen immediately without scanning anything.
+    This is called through ctypes, since the standard library doesn't wrap inotify.
+    Changes made on other hosts of a network filesystem are generally not reported.
+    """
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK
+
+    def __init__(self, **kwargs):
+        """
+        Raises:
+            OSError: If inotify isn't available
+        """
+        super().__init__(**kwargs)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = -1
+        self._wds: dict[int, str] = {}
+
+    def _start(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._wds.clear()
+        threading.Thread(target=self._read_events, args=(self._fd,), name="inotify", daemon=True).start()
+
+    def _add(self, dir: str) -> bool:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir), self.MASK)
+        if wd < 0:
+            # For example, the limit on watches has been reached. The directory is listed as if there were no watcher
+            logger.warning(f"Failed to watch {dir}: {os.strerror(ctypes.get_errno())}")
+            return False
+        self._wds[wd] = dir
+        return True
+
+    def _remove(self, dir: str) -> None:
+        for wd, watched in list(self._wds.items()):
+            if watched == dir:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wds[wd]
+
+    def _read_events(self, fd: int) -> None:
+        while True:
+            try:
+                buffer = os.read(fd, 64 * 1024)
+            except OSError:
+                # The descriptor was closed because the process forked and started again
+                return
+            changes: dict[str, list[Change]] = {}
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buffer, offset)
+                name = os.fsdecode(buffer[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0"))
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self._lost()
+                    continue
+                dir = self._wds.get(wd)
+                if dir is None:
+                    continue
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The directory itself has gone
+                    self._lost(dir)
+                elif name:
+                    kind = "add" if mask & (IN_CREATE | IN_MOVED_TO) else "remove" if mask & (IN_DELETE | IN_MOVED_FROM) else "change"
+                    changes.setdefault(dir, []).append(Change(kind=kind, name=name))
+            for dir, dir_changes in changes.items():
+                self._record(dir, dir_changes)
+
+class PollingWatcher(Watcher):
+    """
+    Watches directories by re-reading them every few seconds, for systems without inotify, and for network filesystems
+    where other hosts' changes matter. This costs a stat call per file per scan, so directories are only scanned in the
+    background, and only while someone is viewing them. A directory that goes unviewed for a while is compared with its
+    last scan once it is viewed again, so the changes in between are still reported
+    """
+    #: Nanoseconds before a directory was added that file changes may not have been listed in
+    CTIME_MARGIN = 1_000_000_000
+
+    def __init__(self, interval: float = 2, **kwargs):
+        """
+        Params:
+            interval: Number of seconds between scans
+        """
+        super().__init__(**kwargs)
+        self.interval = interval
+        #: The change time of each file in each directory at the last scan
+        self._snapshots: dict[str, dict[str, int]] = {}
+        #: When each directory was last scanned, by the monotonic clock
+        self._scanned: dict[str, float] = {}
+        #: Directories that haven't been scanned yet, with the time they were added in nanoseconds since the epoch
+        self._pending: dict[str, int] = {}
+        self._wake = threading.Event()
+
+    def _start(self) -> None:
+        self._snapshots.clear()
+        self._scanned.clear()
+        self._pending.clear()
+        self._wake = threading.Event()
+        threading.Thread(target=self._poll, args=(os.getpid(), self._wake), name="watch-poll", daemon=True).start()
+
+    def _add(self, dir: str) -> bool:
+        if not os.path.isdir(dir):
+            logger.warning(f"Failed to watch {dir}: not a directory")
+            return False
+        with self._lock:
+            if dir not in self._snapshots:
+                # Filesystem timestamps can be coarser than the clock, so files changed slightly earlier are reported too,
+                # which only means re-reading them
+                self._pending.setdefault(dir, time.time_ns() - self.CTIME_MARGIN)
+        # The first scan is done by the poller, so that the directory can be shown without a stat call per file
+        self._wake.set()
+        return True
+
+    def _remove(self, dir: str) -> None:
+        self._snapshots.pop(dir, None)
+        self._scanned.pop(dir, None)
+        self._pending.pop(dir, None)
+
+    @staticmethod
+    def _scan(dir: str) -> dict[str, int]:
+        snapshot = {}
+        with os.scandir(dir) as it:
+            for entry in it:
+                try:
+                    # Changing an ACL, ownership or contents all update the change time
+                    snapshot[entry.name] = entry.stat(follow_symlinks=False).st_ctime_ns
+                except OSError:
+                    pass
+        return snapshot
+
+    def _first_scan(self, dir: str, added: int) -> None:
+        """
+        Takes the snapshot of a newly watched directory. The directory was listed when it was added,
+        so files that changed since then are reported as changes
+        """
+        try:
+            after = self._scan(dir)
+        except OSError:
+            with self._lock:
+                self._pending.pop(dir, None)
+            self._lost(dir)
+            return
+        with self._lock:
+            if self._pending.get(dir) != added:
+                # Stopped watching in the meantime
+                return
+            del self._pending[dir]
+            self._snapshots[dir] = after
+            self._scanned[dir] = time.monotonic()
+        changes = [Change(kind="change", name=name) for name, ctime in after.items() if ctime >= added]
+        if changes:
+            self._record(dir, changes)
+
+    def _poll(self, pid: int, wake: threading.Event) -> None:
+        next_scan = time.monotonic() + self.interval
+        while pid == os.getpid():
+            wake.wait(max(0.0, next_scan - time.monotonic()))
+            wake.clear()
+            with self._lock:
+                pending = list(self._pending.items())
+            for dir, added in pending:
+                self._first_scan(dir, added)
+            if time.monotonic() < next_scan:
+                continue
+            next_scan = time.monotonic() + self.interval
+            with self._lock:
+                # Directories that nobody has looked at since their last scan can wait until somebody does
+                dirs = [
+                    (dir, before) for dir, before in self._snapshots.items()
+                    if dir in self._dirs and self._dirs[dir].last_used > self._scanned[dir]
+                ]
+            for dir, before in dirs:
+                scanned = time.monotonic()
+                try:
+                    after = self._scan(dir)
+                except OSError:
+                    self._lost(dir)
+                    continue
+                changes = [Change(kind="remove", name=name) for name in before.keys() - after.keys()]
+                changes += [
+                    Change(kind="add" if name not in before else "change", name=name)
+                    for name, ctime in after.items() if before.get(name) != ctime
+                ]
+                with self._lock:
+                    if dir in self._snapshots:
+                        self._snapshots[dir] = after
+                        self._scanned[dir] = scanned
+                if changes:
+                    self._record(dir, changes)
+
+def create_watcher(backend: Literal["auto", "inotify", "poll"] = "auto", poll_interval: float = 2, **kwargs) -> Watcher:
+    """
+    Creates a watcher using inotify if possible, otherwise polling
+    Params:
+        kwargs: Passed to `Watcher`
+    """
+    if backend != "poll":
+        try:
+            return InotifyWatcher(**kwargs)
+        except OSError as e:
+            if backend == "inotify":
+                raise
+            logger.info(f"inotify is not available ({e}), so directories will be polled instead")
+    return PollingWatcher(interval=poll_interval, **kwargs)
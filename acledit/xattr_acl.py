@@ -0,0 +1,267 @@
+"""
+Reads and writes ACLs directly in the binary extended attribute format used by Linux, bypassing libacl.
+This is used by bulk operations, where the same ACL is read from and written to many files.
+"""
+from typing import NamedTuple, TypeAlias
+import posix1e as acl
+import errno
+import os
+import stat
+import struct
+
+#: Extended attributes in which Linux stores the access and default ACLs
+ACCESS_XATTR = "system.posix_acl_access"
+DEFAULT_XATTR = "system.posix_acl_default"
+
+#: The xattr is a little endian version header, followed by a (tag, permissions, id) struct per entry
+XATTR_VERSION = 2
+HEADER = struct.Struct("<I")
+ENTRY = struct.Struct("<HHI")
+#: ID stored for entries that don't have a qualifier
+UNDEFINED_ID = 0xFFFFFFFF
+
+# The kernel uses the same tag and permission values as libacl
+USER_OBJ = acl.ACL_USER_OBJ
+USER = acl.ACL_USER
+GROUP_OBJ = acl.ACL_GROUP_OBJ
+GROUP = acl.ACL_GROUP
+MASK = acl.ACL_MASK
+OTHER = acl.ACL_OTHER
+READ = acl.ACL_READ
+WRITE = acl.ACL_WRITE
+EXECUTE = acl.ACL_EXECUTE
+RWX = READ | WRITE | EXECUTE
+
+class RawEntry(NamedTuple):
+    """
+    A single ACL entry, exactly as stored by the kernel
+    """
+    tag: int
+    perm: int
+    id: int = UNDEFINED_ID
+
+#: An ACL, as entries sorted in the order the kernel requires
+RawAcl: TypeAlias = tuple[RawEntry, ...]
+
+def decode(data: bytes) -> RawAcl:
+    """
+    Parses the value of an ACL xattr
+    """
+    view = memoryview(data)
+    version, = HEADER.unpack_from(view)
+    if version != XATTR_VERSION:
+        raise ValueError(f"Unsupported ACL xattr version {version}")
+    return tuple(RawEntry._make(entry) for entry in ENTRY.iter_unpack(view[HEADER.size:]))
+
+def encode(entries: RawAcl) -> bytes:
+    """
+    Serialises an ACL into the value of an ACL xattr
+    """
+    buffer = bytearray(HEADER.size + ENTRY.size * len(entries))
+    HEADER.pack_into(buffer, 0, XATTR_VERSION)
+    for i, entry in enumerate(entries):
+        ENTRY.pack_into(buffer, HEADER.size + ENTRY.size * i, *entry)
+    return bytes(buffer)
+
+def from_mode(mode: int) -> RawAcl:
+    """
+    The ACL that is equivalent to a file's permission bits
+    """
+    return (
+        RawEntry(USER_OBJ, (mode >> 6) & RWX),
+        RawEntry(GROUP_OBJ, (mode >> 3) & RWX),
+        RawEntry(OTHER, mode & RWX),
+    )
+
+def from_pylibacl(facl: acl.ACL) -> RawAcl:
+    """
+    Converts a true ACL pointer into the raw representation
+    """
+    entries = []
+    for entry in facl:
+        qualifier = entry.qualifier if entry.tag_type in {USER, GROUP} else UNDEFINED_ID
+        perm = entry.permset.read * READ | entry.permset.write * WRITE | entry.permset.execute * EXECUTE
+        entries.append(RawEntry(entry.tag_type, perm, qualifier))
+    return tuple(sorted(entries, key=lambda entry: (entry.tag, entry.id)))
+
+def to_pylibacl(entries: RawAcl) -> acl.ACL:
+    """
+    Converts the raw representation into a true ACL pointer
+    """
+    facl = acl.ACL()
+    for raw in entries:
+        entry = acl.Entry(facl)
+        entry.tag_type = raw.tag
+        if raw.tag in {USER, GROUP}:
+            entry.qualifier = raw.id
+        entry.permset.read = bool(raw.perm & READ)
+        entry.permset.write = bool(raw.perm & WRITE)
+        entry.permset.execute = bool(raw.perm & EXECUTE)
+    return facl
+
+def read_acl(path: str, st: os.stat_result, default: bool = False) -> RawAcl:
+    """
+    Reads the access or default ACL of a file.
+    Falls back to libacl if the filesystem doesn't expose ACLs as xattrs.
+    Params:
+        st: The result of `os.stat` on the file, which is used if it has no extended ACL
+    """
+    try:
+        return decode(os.getxattr(path, DEFAULT_XATTR if default else ACCESS_XATTR))
+    except OSError as e:
+        if e.errno == errno.ENODATA:
+            return () if default else from_mode(stat.S_IMODE(st.st_mode))
+        elif e.errno not in {errno.ENOTSUP, errno.EOPNOTSUPP}:
+            raise
+    return from_pylibacl(acl.ACL(filedef=path) if default else acl.ACL(file=path))
+
+def count_named_entries(path: str) -> int | None:
+    """
+    Counts the named users and groups in a file's access ACL, without decoding the rest of it or resolving any names.
+    Returns None if the file has no extended ACL, or if the filesystem doesn't expose ACLs as xattrs.
+    """
+    try:
+        data = os.getxattr(path, ACCESS_XATTR)
+    except OSError as e:
+        if e.errno in {errno.ENODATA, errno.ENOTSUP, errno.EOPNOTSUPP}:
+            return None
+        raise
+    # Only the tag of each entry is needed, which is the first field
+    return sum(tag in {USER, GROUP} for tag, _, _ in ENTRY.iter_unpack(memoryview(data)[HEADER.size:]))
+
+def write_acl(path: str, data: bytes, default: bool = False):
+    """
+    Writes an encoded ACL to a file.
+    The same `data` can be written to any number of files.
+    Falls back to libacl if the filesystem doesn't expose ACLs as xattrs.
+    """
+    try:
+        if default and len(data) == HEADER.size:
+            # An empty default ACL is stored as the absence of the xattr
+            try:
+                os.removexattr(path, DEFAULT_XATTR)
+            except OSError as e:
+                if e.errno != errno.ENODATA:
+                    raise
+        else:
+            os.setxattr(path, DEFAULT_XATTR if default else ACCESS_XATTR, data)
+        return
+    except OSError as e:
+        if e.errno not in {errno.ENOTSUP, errno.EOPNOTSUPP}:
+            raise
+    if default and len(data) == HEADER.size:
+        acl.delete_default(path)
+    else:
+        to_pylibacl(decode(data)).applyto(path, acl.ACL_TYPE_DEFAULT if default else acl.ACL_TYPE_ACCESS)
+
+def _replace(entries: RawAcl, tag: int, id: int, perm: int | None) -> RawAcl:
+    """
+    Returns `entries` with the given entry set to `perm`, or removed if `perm` is None, keeping the entries sorted
+    """
+    kept = [entry for entry in entries if not (entry.tag == tag and entry.id == id)]
+    if perm is not None:
+        kept.append(RawEntry(tag, perm, id))
+    return tuple(sorted(kept, key=lambda entry: (entry.tag, entry.id)))
+
+def find(entries: RawAcl, tag: int, id: int = UNDEFINED_ID) -> RawEntry | None:
+    """
+    Returns the entry with the given tag and qualifier, if there is one
+    """
+    for entry in entries:
+        if entry.tag == tag and entry.id == id:
+            return entry
+    return None
+
+def calc_mask(entries: RawAcl) -> RawAcl:
+    """
+    Sets the mask to the union of the permissions it applies to, as `acl_calc_mask` does.
+    The mask is removed if there are no named users or groups left for it to apply to.
+    """
+    if not any(entry.tag in {USER, GROUP} for entry in entries):
+        return tuple(entry for entry in entries if entry.tag != MASK)
+    perm = 0
+    for entry in entries:
+        if entry.tag in {USER, GROUP_OBJ, GROUP}:
+            perm |= entry.perm
+    return _replace(entries, MASK, UNDEFINED_ID, perm)
+
+def with_base_entries(default: RawAcl, access: RawAcl) -> RawAcl:
+    """
+    If the default ACL is empty, starts it with the owner, group owner and other entries of the access ACL,
+    since every ACL requires them
+    """
+    if default:
+        return default
+    return tuple(entry for entry in access if entry.tag in {USER_OBJ, GROUP_OBJ, OTHER})
+
+def grant(entries: RawAcl, tag: int, id: int, perm: int) -> RawAcl | None:
+    """
+    Adds `perm` to the entry for a named user or group, creating it if necessary.
+    Like `ensure_mask`, this adds a rwx mask if there isn't one.
+    Returns None if the ACL already grants these permissions.
+    """
+    existing = find(entries, tag, id)
+    if existing is not None and existing.perm & perm == perm:
+        return None
+    entries = _replace(entries, tag, id, perm | (existing.perm if existing is not None else 0))
+    if find(entries, MASK) is None:
+        entries = _replace(entries, MASK, UNDEFINED_ID, RWX)
+    return entries
+
+def allows(entries: RawAcl, owner: int, group: int, uid: int, gids: set[int], perm: int) -> bool:
+    """
+    Checks whether a user has `perm` on a file with this ACL, in the same order as the kernel's access check.
+    See the "Access check algorithm" section of acl(5)
+    Params:
+        owner: The user ID that owns the file
+        group: The group ID that owns the file
+        uid: The user to check
+        gids: Every group that `uid` is a member of
+    """
+    if uid == owner:
+        entry = find(entries, USER_OBJ)
+        return entry is not None and entry.perm & perm == perm
+    mask_entry = find(entries, MASK)
+    mask = mask_entry.perm if mask_entry is not None else RWX
+    entry = find(entries, USER, uid)
+    if entry is not None:
+        return entry.perm & mask & perm == perm
+    in_group = False
+    for entry in entries:
+        if (entry.tag == GROUP_OBJ and group in gids) or (entry.tag == GROUP and entry.id in gids):
+            in_group = True
+            if entry.perm & mask & perm == perm:
+                return True
+    if in_group:
+        return False
+    entry = find(entries, OTHER)
+    return entry is not None and entry.perm & perm == perm
+
+def widen_mask(entries: RawAcl, perm: int) -> RawAcl | None:
+    """
+    Adds `perm` to the mask, so that it doesn't hide that permission of named entries.
+    Returns None if the mask already includes it, or there is no mask.
+    """
+    mask = find(entries, MASK)
+    if mask is None or mask.perm & perm == perm:
+        return None
+    return _replace(entries, MASK, UNDEFINED_ID, mask.perm | perm)
+
+def revoke(entries: RawAcl, tag: int, id: int) -> RawAcl | None:
+    """
+    Removes the entry for a named user or group, and recalculates the mask.
+    Returns None if there is no such entry.
+    """
+    if find(entries, tag, id) is None:
+        return None
+    return calc_mask(_replace(entries, tag, id, None))
+
+def modify(entries: RawAcl, tag: int, id: int, perm: int) -> RawAcl | None:
+    """
+    Sets the permissions of an existing entry for a named user or group, and recalculates the mask.
+    Returns None if there is no such entry, or it already has these permissions.
+    """
+    existing = find(entries, tag, id)
+    if existing is None or existing.perm == perm:
+        return None
+    return calc_mask(_replace(entries, tag, id, perm))
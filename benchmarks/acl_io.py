@@ -0,0 +1,59 @@
+"""
+Compares the throughput of granting a user access to many files via pylibacl, and via raw ACL xattrs.
+
+Usage:
+    python benchmarks/acl_io.py [--files 10000] [--dir /path/on/acl/filesystem]
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable
+import os
+import time
+import posix1e as acl
+from acledit import xattr_acl
+from acledit.acl import apply_acl_safely, get_or_create_entry, ensure_mask, grant_user
+
+def pylibacl_grant(path: str, user_id: int):
+    facl = acl.ACL(file=path)
+    ensure_mask(facl)
+    entry = get_or_create_entry(facl, acl.ACL_USER, user_id)
+    entry.permset.add(acl.ACL_READ)
+    apply_acl_safely(facl, path)
+
+def xattr_grant(path: str, user_id: int):
+    entries = xattr_acl.read_acl(path, os.stat(path))
+    new_acl = xattr_acl.grant(entries, acl.ACL_USER, user_id, acl.ACL_READ)
+    if new_acl is not None:
+        xattr_acl.write_acl(path, xattr_acl.encode(new_acl))
+
+def time_per_file(files: list[str], grant: Callable[[str, int], None], user_id: int) -> float:
+    start = time.perf_counter()
+    for path in files:
+        grant(path, user_id)
+    return (time.perf_counter() - start) / len(files)
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--dir", help="Directory in which to create the test files. This must support ACLs")
+    args = parser.parse_args()
+
+    with TemporaryDirectory(dir=args.dir) as root:
+        files = []
+        for i in range(args.files):
+            path = Path(root, f"file{i}")
+            path.touch()
+            files.append(str(path))
+
+        # Use a different user ID for each run so that every run has to write
+        for user_id, name, grant in [(10_001, "pylibacl", pylibacl_grant), (10_002, "raw xattr", xattr_grant)]:
+            print(f"{name:>20}: {time_per_file(files, grant, user_id) * 1e6:8.1f} µs/file")
+
+        start = time.perf_counter()
+        stats = grant_user(root, 10_003, permissions=[acl.ACL_READ], recursive=True)
+        elapsed = (time.perf_counter() - start) / stats.files
+        print(f"{'interned grant_user':>20}: {elapsed * 1e6:8.1f} µs/file ({stats.dedup_ratio:.0f} files per distinct ACL)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Measures the bytes sent and received when loading the app and navigating into a directory,
+with and without response compression.
+This runs the app in-process against a temporary directory, using a temporary config file.
+
+Usage:
+    python benchmarks/navigation_bytes.py [--files 200] [--dir /tmp]
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import json
+import os
+import re
+import sys
+import tempfile
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200, help="Number of files in the directory. The default fills one page of the browser")
+    parser.add_argument("--dir", help="Where to create the directory")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        tree = Path(root) / "projects" / "some-lab" / "shared-data"
+        tree.mkdir(parents=True)
+        for i in range(args.files):
+            (tree / f"sample_{i:05}_sequencing_run.fastq.gz").touch()
+        config = Path(root) / "config.json"
+        config.write_text(json.dumps({"python": sys.executable, "start_dir": str(tree.parent), "fs_mounts": [root], "editor": True}))
+        os.environ["ACLEDIT_CONFIG"] = str(config)
+
+        from acledit.app import app
+        client = app.server.test_client()
+        print(f"{'request':<40} {'sent':>10} {'received':>10} {'gzip':>10}")
+        totals = [0, 0, 0]
+
+        def measure(label: str, method: str, url: str, body: dict | None = None) -> bytes:
+            data = json.dumps(body).encode() if body is not None else b""
+            plain = client.open(url, method=method, data=data, content_type="application/json" if body else None)
+            compressed = client.open(url, method=method, data=data, content_type="application/json" if body else None, headers={"Accept-Encoding": "gzip"})
+            sizes = [len(data), len(plain.data), len(compressed.get_data())]
+            for i, size in enumerate(sizes):
+                totals[i] += size
+            print(f"{label:<40} {sizes[0]:>10} {sizes[1]:>10} {sizes[2]:>10}")
+            return plain.data
+
+        # The page and the files it loads from this server. Anything loaded from a CDN isn't counted
+        index = measure("index", "GET", "/").decode()
+        for url in re.findall(r'(?:src|href)="(/[^"]+)"', index):
+            measure(url.split("?")[0][-40:], "GET", url)
+        measure("layout", "GET", "/_dash-layout")
+        dependencies = json.loads(measure("dependencies", "GET", "/_dash-dependencies"))
+        print(f"{'page load total':<40} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10}")
+        totals[:] = [0, 0, 0]
+
+        def concrete(id: str | dict) -> str | dict:
+            # Pattern matching IDs are sent as JSON, with MATCH as ["MATCH"]
+            if isinstance(id, str) and id.startswith("{"):
+                id = json.loads(id)
+            if isinstance(id, dict):
+                return {key: "file-browser" if value == ["MATCH"] else value for key, value in id.items()}
+            return id
+
+        def prop_id(id: str | dict, property: str) -> str:
+            if isinstance(id, dict):
+                id = json.dumps(id, sort_keys=True, separators=(",", ":"))
+            return f"{id}.{property}"
+
+        def find(output: str) -> dict:
+            return next(dependency for dependency in dependencies if output in dependency["output"])
+
+        def call(label: str, dependency: dict, values: dict[str, object], outputs: list) -> dict:
+            # Values are given by the child name of each input
+            inputs = [
+                {"id": concrete(input["id"]), "property": input["property"], "value": values.get(concrete(input["id"])["child"])}
+                for input in dependency["inputs"]
+            ]
+            state = [
+                {"id": concrete(state["id"]), "property": state["property"], "value": values.get(concrete(state["id"])["child"])}
+                for state in dependency["state"]
+            ]
+            body = {
+                "output": dependency["output"],
+                "outputs": outputs,
+                "inputs": inputs,
+                "state": state,
+                "changedPropIds": [prop_id(inputs[0]["id"], inputs[0]["property"])],
+            }
+            return json.loads(measure(label, "POST", "/_dash-update-component", body))
+
+        def outputs_of(dependency: dict, ids: dict[str, list[dict]] | None = None) -> list:
+            outputs = []
+            for output in re.findall(r"(\{.*?\}|[^.]+)\.([a-z_]+)", dependency["output"].strip(".")):
+                id = json.loads(output[0]) if output[0].startswith("{") else output[0]
+                if isinstance(id, dict) and ["ALL"] in id.values():
+                    # One output per matching component that is on the page
+                    outputs.append([{"id": row, "property": output[1]} for row in (ids or {}).get(id["child"], [])])
+                else:
+                    outputs.append({"id": concrete(id), "property": output[1]})
+            return outputs
+
+        def collect_ids(component: object, ids: dict[str, list[dict]]):
+            if isinstance(component, list):
+                for child in component:
+                    collect_ids(child, ids)
+            elif isinstance(component, dict):
+                props = component.get("props", {})
+                id = props.get("id")
+                if isinstance(id, dict) and id.get("shortcut") is False:
+                    ids.setdefault(id["child"], []).append(id)
+                collect_ids(props.get("children"), ids)
+
+        # Open the directory, then load the details of its rows, as the browser does after each navigation
+        populate = find('"child":"file_list","cls":"FileBrowser"}.children')
+        response = call("open directory", populate, {"current_path": str(tree), "search": "", "sort": "name", "pages": 1}, outputs_of(populate))
+        file_list = next(iter(response["response"].values()))["children"]
+        ids: dict[str, list[dict]] = {}
+        collect_ids(file_list, ids)
+        details = next(
+            dependency for dependency in dependencies
+            if len(dependency["inputs"]) == 1 and '"child":"rows"' in dependency["inputs"][0]["id"]
+        )
+        call("load row details", details, {"rows": [str(path) for path in tree.iterdir()]}, outputs_of(details, ids))
+        print(f"{'navigation total':<40} {totals[0]:>10} {totals[1]:>10} {totals[2]:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Compares walking a deep tree and reading every ACL xattr by path, and by file descriptor.
+
+Usage:
+    python benchmarks/walk.py [--depth 40] [--width 50] [--dir /path/on/acl/filesystem]
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import os
+import time
+from acledit.bulk import FD_WALK_SUPPORTED, acl_fingerprint, walk_tree
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--depth", type=int, default=40, help="Number of nested directories")
+    parser.add_argument("--width", type=int, default=50, help="Number of files in each directory")
+    parser.add_argument("--dir", help="Directory in which to create the test tree")
+    args = parser.parse_args()
+
+    with TemporaryDirectory(dir=args.dir) as root:
+        current = Path(root)
+        for depth in range(args.depth):
+            for i in range(args.width):
+                (current / f"file{i}").touch()
+            current = current / f"level{depth}"
+            current.mkdir()
+
+        modes = [("path", False)]
+        if FD_WALK_SUPPORTED:
+            modes.append(("file descriptor", True))
+        for name, fd_relative in modes:
+            start = time.perf_counter()
+            files = 0
+            for entry in walk_tree(root, fd_relative=fd_relative):
+                acl_fingerprint(entry.target, entry.st)
+                files += 1
+            elapsed = time.perf_counter() - start
+            print(f"{name:>16}: {files / elapsed:10.0f} files/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures the peak memory of walking a single very wide directory, and of queueing the subdirectories of one,
+and checks that each stays within a memory budget as the directory grows tenfold and a hundredfold.
+This covers `walk_tree` and `PathStack`, which every recursive operation uses to visit the tree.
+Exits with an error if any peak exceeds the budget.
+
+Usage:
+    python benchmarks/walk_memory.py [--files 1000000] [--budget 8] [--dir /tmp]
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import sys
+import tempfile
+import time
+import tracemalloc
+from acledit.bulk import MemoryBudget, PathStack, walk_tree
+
+def measure(label: str, run) -> int:
+    """
+    Runs `run`, and returns its peak traced memory in bytes
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {count:>9} items in {elapsed:6.2f} s, peak {peak / 1024 / 1024:7.2f} MB")
+    return peak
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1_000_000, help="Number of files in the widest directory. It is also walked at a tenth and a hundredth of this size")
+    parser.add_argument("--budget", type=float, default=8, help="Memory budget in megabytes, as in the memory_budget config option")
+    parser.add_argument("--dir", help="Where to create the directory, which should be on a local disk")
+    args = parser.parse_args()
+    budget = MemoryBudget.from_megabytes(args.budget)
+    limit = args.budget * 1024 * 1024
+    failures = []
+
+    def check(label: str, peak: int):
+        if peak > limit:
+            failures.append(f"{label} peaked at {peak / 1024 / 1024:.2f} MB, over the {args.budget} MB budget")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        created = 0
+        for size in [args.files // 100, args.files // 10, args.files]:
+            for i in range(created, size):
+                (Path(root) / f"file{i:08}").touch()
+            created = size
+            for fd_relative in [True, False]:
+                label = f"walk {size} files ({'fds' if fd_relative else 'paths'})"
+                check(label, measure(label, lambda: sum(1 for _ in walk_tree(root, fd_relative=fd_relative))))
+
+        def pending(count: int) -> int:
+            # A directory with this many subdirectories would queue them all
+            stack = PathStack(memory_limit=budget.pending_paths)
+            try:
+                stack.extend(f"{root}/dir{i:08}" for i in range(count))
+                popped = 0
+                while stack:
+                    stack.pop()
+                    popped += 1
+                return popped
+            finally:
+                stack.close()
+
+        # Ten and a hundred times as many paths as the budget keeps in memory
+        for count in [budget.pending_paths * 10, budget.pending_paths * 100]:
+            label = f"queue {count} pending directories"
+            check(label, measure(label, lambda: pending(count)))
+
+    if failures:
+        sys.exit("\n".join(failures))
+    print(f"Every peak was within the {args.budget} MB budget")
+
+if __name__ == "__main__":
+    main()
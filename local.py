@@ -1,3 +1,14 @@
+from argparse import ArgumentParser
+from acledit.config import CONFIG_ENV
+import os
+
+parser = ArgumentParser(description="Runs the app in development mode")
+parser.add_argument("--config", help="Path to the config file. Defaults to the ACLEDIT_CONFIG environment variable, or config.json")
+args = parser.parse_args()
+if args.config is not None:
+    # Set this before importing the app, so that every part of it reads the same file
+    os.environ[CONFIG_ENV] = args.config
+
 from acledit import app
 
 app.app.run(
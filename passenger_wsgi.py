@@ -5,11 +5,14 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-# Automatically enforce running this app with the configured interpreter
-with open("config.json") as fp:
+# Automatically enforce running this app with the configured interpreter.
+# This can't import acledit.config to find the config file, because the current interpreter may not have the dependencies,
+# so it mirrors acledit.config.config_path
+config_path = os.environ.get("ACLEDIT_CONFIG", "config.json")
+with open(config_path) as fp:
     target_interpreter = json.load(fp).get("python")
     if target_interpreter is None:
-        raise Exception('You must have a config.json file in the app directory that specifies the Python interpreter to use, in the form {"python": "/path/to/python"}')
+        raise Exception(f'You must have a config file at {os.path.abspath(config_path)}, or the path in the ACLEDIT_CONFIG environment variable, that specifies the Python interpreter to use, in the form {{"python": "/path/to/python"}}')
     else:
         target_interpreter = os.path.normpath(target_interpreter)
 
@@ -0,0 +1,31 @@
+from acledit import xattr_acl
+from acledit.xattr_acl import GROUP, GROUP_OBJ, MASK, OTHER, READ, RWX, USER, USER_OBJ, RawEntry
+
+BASE = xattr_acl.from_mode(0o750)
+
+def named_ids(entries: xattr_acl.RawAcl, tag: int) -> list[int]:
+    return [entry.id for entry in entries if entry.tag == tag]
+
+def test_grant_keeps_named_entries_in_id_order():
+    # The kernel rejects named entries that aren't in ascending ID order, whatever their permissions
+    entries = xattr_acl.grant(BASE, USER, 1000, RWX)
+    entries = xattr_acl.grant(entries, USER, 2000, READ)
+    assert named_ids(entries, USER) == [1000, 2000]
+    assert [entry.tag for entry in entries] == [USER_OBJ, USER, USER, GROUP_OBJ, MASK, OTHER]
+
+def test_encode_round_trip_keeps_order():
+    entries = xattr_acl.grant(BASE, GROUP, 20, RWX)
+    entries = xattr_acl.grant(entries, GROUP, 30, READ)
+    entries = xattr_acl.grant(entries, USER, 2000, READ)
+    entries = xattr_acl.grant(entries, USER, 1000, RWX)
+    decoded = xattr_acl.decode(xattr_acl.encode(entries))
+    assert decoded == entries
+    assert named_ids(decoded, USER) == [1000, 2000]
+    assert named_ids(decoded, GROUP) == [20, 30]
+
+def test_modify_keeps_named_entries_in_id_order():
+    entries = xattr_acl.grant(BASE, USER, 1000, READ)
+    entries = xattr_acl.grant(entries, USER, 2000, READ)
+    entries = xattr_acl.modify(entries, USER, 2000, 0)
+    assert named_ids(entries, USER) == [1000, 2000]
+    assert xattr_acl.find(entries, USER, 2000) == RawEntry(USER, 0, 2000)